@@ -1,11 +1,82 @@
 from django.contrib import admin
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
-from .models import Category, Product, Coupon, Address, Wishlist, Cart, CartItem, Order, OrderItem
+from django import forms
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.utils.functional import cached_property
+from .models import Category, Product, Coupon, Address, Wishlist, Cart, CartItem, Order, OrderItem, Job, Notification, ArchivedOrder
+from .tasks import queue_status_jobs
 admin.site.site_header = "eCommerce"
 admin.site.site_title = "eCommerce Portal"
 admin.site.index_title = "Welcome to the eCommerce"
+
+def estimate_row_count(model, using='default'):
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute(
+                "SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+                [table],
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    return int(row[0]) if row and row[0] is not None else None
+
+class EstimatedCountPaginator(Paginator):
+    # Below this many rows an exact COUNT(*) is cheap enough and more accurate
+    exact_count_threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimate_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= self.exact_count_threshold:
+                return estimate
+        return super().count
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist settings for tables that grow to millions of rows.
+
+    Unfiltered pages use the database's row estimate instead of COUNT(*), the
+    second "full result" count is skipped, and the relations shown in
+    ``list_display`` are joined up front instead of loaded once per row.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_list_select_related(self, request):
+        if self.list_select_related:
+            return self.list_select_related
+        related = []
+        for name in self.get_list_display(request):
+            try:
+                field = self.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if field.many_to_one or field.one_to_one:
+                related.append(name)
+        return tuple(related)
+
+class OrderStatusForm(forms.ModelForm):
+    class Meta:
+        model = Order
+        fields = '__all__'
+
+    def clean_status(self):
+        value = self.cleaned_data['status']
+        current_status = self.instance.status
+        if self.instance.pk and not Order.can_transition(current_status, value):
+            raise forms.ValidationError(f"Cannot change status from {current_status} to {value}")
+        return value
+
 @admin.register(Address)
 class AddressAdmin(admin.ModelAdmin):
     list_display = ('user', 'name', 'city', 'country', 'is_default')
@@ -15,9 +86,9 @@ class AddressAdmin(admin.ModelAdmin):
     list_per_page = 10
 
 @admin.register(Wishlist)
-class WishlistAdmin(admin.ModelAdmin):
+class WishlistAdmin(LargeTableAdmin):
     list_display = ('user', 'product', 'added_at')
-    search_fields = ('user__username', 'product__name')
+    search_fields = ('^user__username', '^product__name')
     list_filter = ('added_at',)
     ordering = ('added_at',)
     raw_id_fields = ('user', 'product')
@@ -33,29 +104,73 @@ class CartAdmin(admin.ModelAdmin):
     list_per_page = 10
 
 @admin.register(CartItem)
-class CartItemAdmin(admin.ModelAdmin):
+class CartItemAdmin(LargeTableAdmin):
     list_display = ('cart', 'product', 'quantity')
-    search_fields = ('cart__user__username', 'product__name')
+    search_fields = ('^cart__user__username', '^product__name')
     ordering = ('cart',)
     raw_id_fields = ('cart', 'product')
     list_per_page = 10
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(LargeTableAdmin):
+    form = OrderStatusForm
     list_display = ('id', 'user', 'total_amount', 'status', 'created_at')
-    search_fields = ('user__username', 'payment_reference')
+    search_fields = ('^user__username', '^payment_reference')
     ordering = ('-created_at',)
     raw_id_fields = ('user', 'coupon')
     list_editable = ('status',)
     list_per_page = 10
 
+    def get_changelist_form(self, request, **kwargs):
+        kwargs.setdefault('form', OrderStatusForm)
+        return super().get_changelist_form(request, **kwargs)
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            return super().save_model(request, obj, form, change)
+        # Status is only ever written by transition(); saving the whole row would
+        # put back the status the form was loaded with over a concurrent change
+        fields = [name for name in form.changed_data if name != 'status']
+        new_status = obj.status
+        with transaction.atomic():
+            if fields:
+                obj.save(update_fields=fields)
+            if 'status' not in form.changed_data:
+                return
+            if obj.transition(new_status, sources=[form.initial['status']]):
+                queue_status_jobs(obj.pk, new_status)
+            else:
+                self.message_user(
+                    request,
+                    f"Order {obj.pk} changed to {obj.status} in the meantime and was not moved to {new_status}",
+                    level=messages.ERROR,
+                )
+
 @admin.register(OrderItem)
-class OrderItemAdmin(admin.ModelAdmin):
+class OrderItemAdmin(LargeTableAdmin):
     list_display = ('order', 'product', 'quantity', 'price')
-    search_fields = ('order__id', 'product__name')
+    search_fields = ('^product__name',)
     ordering = ('order',)
     raw_id_fields = ('order', 'product')
     list_per_page = 10
+
+    def get_search_results(self, request, queryset, search_term):
+        # A numeric term is an order number, looked up through the order_id index
+        if search_term.strip().isdigit():
+            return queryset.filter(order_id=int(search_term)), False
+        return super().get_search_results(request, queryset, search_term)
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'total_amount', 'status', 'created_at', 'archived_at')
+    search_fields = ('^user__username', '^payment_reference')
+    ordering = ('-created_at',)
+    raw_id_fields = ('user',)
+    list_per_page = 10
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('name', 'description')
@@ -63,9 +178,32 @@ class CategoryAdmin(admin.ModelAdmin):
     ordering = ('name',)
     list_per_page = 10
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(LargeTableAdmin):
     list_display = ('name', 'category', 'price', 'stock', 'created_at')
-    search_fields = ('name', 'description')
+    search_fields = ('^name',)
     ordering = ('name',)
     raw_id_fields = ('category',)
-    list_per_page = 10
\ No newline at end of file
+    list_per_page = 10
+
+admin.site.unregister(User)
+
+@admin.register(User)
+class LargeUserAdmin(LargeTableAdmin, UserAdmin):
+    search_fields = ('^username', '=email')
+
+@admin.register(Job)
+class JobAdmin(LargeTableAdmin):
+    list_display = ('id', 'name', 'status', 'attempts', 'run_at', 'created_at')
+    search_fields = ('name',)
+    list_filter = ('status', 'name')
+    ordering = ('-id',)
+    list_per_page = 10
+
+@admin.register(Notification)
+class NotificationAdmin(LargeTableAdmin):
+    list_display = ('user', 'product', 'kind', 'created_at')
+    search_fields = ('^user__username', '^product__name')
+    list_filter = ('kind',)
+    ordering = ('-id',)
+    raw_id_fields = ('user', 'product')
+    list_per_page = 10
@@ -0,0 +1,104 @@
+"""Moving finished orders out of the live order tables.
+
+Orders that reached a terminal status (``STATUSES``) more than ``AFTER`` ago
+are copied into ``ArchivedOrder``, with their items inlined as JSON, and then
+deleted from ``Order``/``OrderItem`` in the same transaction. Each
+``orders.archive`` job moves a single batch of at most ``BATCH_SIZE`` orders,
+locking them with ``SKIP LOCKED`` so that checkout, transitions and other
+workers are never kept waiting, and queues the next batch itself. The delay
+before the next batch grows with the time the last one took, so the archiver
+holds the database for at most ``DUTY_CYCLE`` of the time while the live tables
+are busy and backs off further when they are slow.
+"""
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import jobs
+from .conf import get_settings
+from .models import ArchivedOrder, Coupon, Job, Order, OrderItem
+
+DEFAULTS = {
+    'AFTER': timedelta(days=180),
+    'STATUSES': ['completed', 'refunded', 'cancelled', 'failed'],
+    'BATCH_SIZE': 500,
+    'PAUSE_SECONDS': 1,
+    'DUTY_CYCLE': 0.25,
+}
+
+
+def archive_settings():
+    return get_settings('ORDER_ARCHIVE', DEFAULTS)
+
+
+def archivable(before=None):
+    conf = archive_settings()
+    before = before or timezone.now() - conf['AFTER']
+    return Order.objects.filter(status__in=conf['STATUSES'], created_at__lt=before)
+
+
+def archive_batch(batch_size=None, before=None):
+    """Move up to ``batch_size`` archivable orders into ``ArchivedOrder``; return how many were moved."""
+    batch_size = batch_size or archive_settings()['BATCH_SIZE']
+    with transaction.atomic():
+        orders = list(archivable(before).select_for_update(skip_locked=True).order_by('pk')[:batch_size])
+        if not orders:
+            return 0
+        order_ids = [order.pk for order in orders]
+        coupon_codes = dict(
+            Coupon.objects.filter(pk__in={order.coupon_id for order in orders if order.coupon_id})
+            .values_list('pk', 'code')
+        )
+        items = defaultdict(list)
+        rows = (
+            OrderItem.objects.filter(order_id__in=order_ids).order_by('pk')
+            .values_list('pk', 'order_id', 'product_id', 'product__name', 'quantity', 'price')
+        )
+        for pk, order_id, product_id, product_name, quantity, price in rows:
+            items[order_id].append({
+                'id': pk, 'product': {'id': product_id, 'name': product_name},
+                'quantity': quantity, 'price': str(price),
+            })
+
+        ArchivedOrder.objects.bulk_create([
+            ArchivedOrder(
+                id=order.pk,
+                user_id=order.user_id,
+                total_amount=order.total_amount,
+                status=order.status,
+                items=items[order.pk],
+                shipping_address=order.shipping_address,
+                billing_address=order.billing_address,
+                payment_reference=order.payment_reference,
+                coupon_code=coupon_codes.get(order.coupon_id, ''),
+                discount_applied=order.discount_applied,
+                created_at=order.created_at,
+            )
+            for order in orders
+        ])
+        Order.objects.filter(pk__in=order_ids).delete()
+    return len(orders)
+
+
+def pause_after(elapsed):
+    """Seconds to wait after a batch that took ``elapsed`` seconds."""
+    conf = archive_settings()
+    return max(conf['PAUSE_SECONDS'], elapsed * (1 - conf['DUTY_CYCLE']) / conf['DUTY_CYCLE'])
+
+
+def schedule():
+    """Queue an ``orders.archive`` run unless one is already queued or running."""
+    if Job.objects.filter(name='orders.archive', status__in=['queued', 'running']).exists():
+        return None
+    return jobs.enqueue('orders.archive')
+
+
+@jobs.register('orders.archive')
+def archive_orders():
+    started = time.monotonic()
+    moved = archive_batch()
+    if moved == archive_settings()['BATCH_SIZE']:
+        jobs.enqueue('orders.archive', delay=pause_after(time.monotonic() - started))
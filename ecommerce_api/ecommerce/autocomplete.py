@@ -0,0 +1,312 @@
+"""In-memory autocomplete over product and category names.
+
+Every worker holds a sorted list of keys, one per word start of each name
+(``"wireless mouse"`` is found by ``"wi"`` and by ``"mo"``), normalized by
+``normalize()`` and cut to ``KEY_LENGTH`` characters, each followed by the
+entry it belongs to (``ref()``). A query is two bisections for
+the range of keys starting with it; the entries in that range are ranked by
+popularity, the number of order lines of a product or of the products of a
+category. Short prefixes match too many keys to rank on every keystroke, so
+the ranking of ranges larger than ``SCAN_LIMIT`` is kept per prefix until a
+name under it changes.
+
+The index is built by the ``autocomplete`` warm-up step (or the first query).
+Product and category saves and deletes update it in the worker that made them
+once their transaction commits; the other workers catch up from the catalog
+change feed, and add the order lines of orders placed since, at most every
+``SYNC_SECONDS`` when they serve a query. Queries and updates take the
+index's lock; syncs and builds read the database before taking it.
+"""
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Max
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import warmup
+from .catalog import catalog_version, changes_since
+from .conf import get_settings
+from .models import Category, Order, OrderItem, Product
+
+DEFAULTS = {
+    'LIMIT': 10,
+    'MAX_LIMIT': 50,
+    'MIN_LENGTH': 1,
+    'KEY_LENGTH': 24,
+    'MAX_WORDS': 4,
+    'SCAN_LIMIT': 250,
+    'SYNC_SECONDS': 5,
+    'SETTLE_SECONDS': 60,
+}
+
+KINDS = ('product', 'category')
+SEPARATOR = '\x00'
+LAST_CHAR = chr(0x10FFFF)
+WORD_START = re.compile(r'\w+')
+
+
+def autocomplete_settings():
+    return get_settings('AUTOCOMPLETE', DEFAULTS)
+
+
+def normalize(text):
+    """Case-fold, strip accents and collapse whitespace, so that "Café  Crème" is found by "cafe c"."""
+    text = text.casefold()
+    if not text.isascii():
+        text = ''.join(char for char in unicodedata.normalize('NFKD', text) if not unicodedata.combining(char))
+    return ' '.join(text.split())
+
+
+def ref(kind, pk):
+    # An int takes half the memory of a "p123" string, and names are keyed by it
+    return pk << 1 | KINDS.index(kind)
+
+
+def word_starts(name, max_words):
+    """Return the suffixes of the normalized ``name`` starting at each of its first ``max_words`` words."""
+    name = normalize(name)
+    return [name[match.start():] for match in list(WORD_START.finditer(name))[:max_words]]
+
+
+class AutocompleteIndex:
+    def __init__(self, conf=None):
+        self.conf = conf or autocomplete_settings()
+        self.lock = threading.RLock()
+        self.keys = []
+        self.names = {}
+        self.scores = {}
+        self.top = {}
+        self.version = 0
+        self.orders_until = 0
+        self.synced_at = 0
+
+    def entry_keys(self, entry, name):
+        length = self.conf['KEY_LENGTH']
+        return {f'{start[:length]}{SEPARATOR}{entry}' for start in word_starts(name, self.conf['MAX_WORDS'])}
+
+    def rank_key(self, entry):
+        name = self.names.get(entry, '')
+        return (-self.scores.get(entry, 0), len(name), name, entry)
+
+    def build(self):
+        """Load every name and the order line counts up to now; only swapping them in takes the lock."""
+        version = catalog_version()
+        orders_until = self.settled_orders()
+        names = {}
+        for pk, name in Category.objects.values_list('id', 'name').iterator(chunk_size=10000):
+            names[ref('category', pk)] = name
+        categories = {}
+        for pk, name, category_id in Product.objects.values_list('id', 'name', 'category_id').iterator(chunk_size=10000):
+            names[ref('product', pk)] = name
+            categories[pk] = category_id
+        scores = {}
+        rows = OrderItem.objects.filter(order_id__lte=orders_until).values('product_id').annotate(lines=Count('id'))
+        for row in rows.order_by().iterator(chunk_size=10000):
+            category_id = categories.get(row['product_id'])
+            if category_id is None:
+                continue
+            scores[ref('product', row['product_id'])] = row['lines']
+            scores[ref('category', category_id)] = scores.get(ref('category', category_id), 0) + row['lines']
+
+        with self.lock:
+            self.load(names, scores)
+            self.version, self.orders_until, self.synced_at = version, orders_until, time.monotonic()
+        return self
+
+    def load(self, names, scores):
+        """Replace the contents with ``{ref: name}`` and ``{ref: order lines}``."""
+        keys = [key for entry, name in names.items() for key in self.entry_keys(entry, name)]
+        keys.sort()
+        with self.lock:
+            self.keys, self.names, self.scores, self.top = keys, names, scores, {}
+
+    def settled_orders(self):
+        settled = timezone.now() - timedelta(seconds=self.conf['SETTLE_SECONDS'])
+        return Order.objects.filter(created_at__lt=settled).aggregate(last=Max('id'))['last'] or self.orders_until
+
+    def forget(self, keys):
+        # Cached rankings under any prefix of these keys may have changed
+        for key in keys:
+            start = key.rpartition(SEPARATOR)[0]
+            for end in range(1, len(start) + 1):
+                self.top.pop(start[:end], None)
+
+    def upsert(self, kind, pk, name):
+        entry = ref(kind, pk)
+        with self.lock:
+            old_name = self.names.get(entry)
+            if old_name == name:
+                return
+            old_keys = self.entry_keys(entry, old_name) if old_name is not None else set()
+            new_keys = self.entry_keys(entry, name)
+            for key in old_keys - new_keys:
+                del self.keys[bisect_left(self.keys, key)]
+            for key in new_keys - old_keys:
+                insort(self.keys, key)
+            self.names[entry] = name
+            self.forget(old_keys | new_keys)
+
+    def remove(self, kind, pk):
+        entry = ref(kind, pk)
+        with self.lock:
+            name = self.names.get(entry)
+            if name is None:
+                return
+            keys = self.entry_keys(entry, name)
+            for key in keys:
+                del self.keys[bisect_left(self.keys, key)]
+            del self.names[entry]
+            self.scores.pop(entry, None)
+            self.forget(keys)
+
+    def add_popularity(self, lines):
+        """Add ``{ref: order lines}`` to the scores; a score only grows, so cached rankings are patched, not dropped."""
+        size = self.conf['MAX_LIMIT']
+        with self.lock:
+            for entry, count in lines.items():
+                if entry not in self.names:
+                    continue
+                self.scores[entry] = self.scores.get(entry, 0) + count
+                for key in self.entry_keys(entry, self.names[entry]):
+                    start = key.rpartition(SEPARATOR)[0]
+                    for end in range(1, len(start) + 1):
+                        ranked = self.top.get(start[:end])
+                        if ranked is not None:
+                            entries = ranked if entry in ranked else ranked + [entry]
+                            self.top[start[:end]] = sorted(entries, key=self.rank_key)[:size]
+
+    def sync(self, force=False):
+        """Apply the catalog changes and order lines the other workers recorded since the last sync.
+
+        The database is read outside the lock, so queries keep being served meanwhile; each batch is
+        then applied under it unless another thread has applied it first.
+        """
+        if not force and time.monotonic() - self.synced_at < self.conf['SYNC_SECONDS']:
+            return
+        self.synced_at = time.monotonic()
+        version = self.version
+        # The feed cannot be read from before its first change, so the first one forces a rebuild
+        if version == 0 and catalog_version() > 0:
+            self.build()
+            return
+        while version:
+            changes = changes_since(version)
+            if changes['resync']:
+                self.build()
+                return
+            found = {}
+            for kind, ids in changes['upserts'].items():
+                model = Product if kind == 'product' else Category
+                found[kind] = dict(model.objects.filter(pk__in=ids).values_list('id', 'name'))
+            with self.lock:
+                if self.version != version:
+                    return
+                for kind, ids in changes['deletes'].items():
+                    for pk in ids:
+                        self.remove(kind, pk)
+                for kind, ids in changes['upserts'].items():
+                    for pk in ids:
+                        if pk in found[kind]:
+                            self.upsert(kind, pk, found[kind][pk])
+                        else:
+                            self.remove(kind, pk)
+                self.version = version = changes['next']
+            if not changes['has_more']:
+                break
+
+        orders_until = self.orders_until
+        until = self.settled_orders()
+        if until > orders_until:
+            lines = {}
+            rows = (
+                OrderItem.objects.filter(order_id__gt=orders_until, order_id__lte=until)
+                .values('product_id', 'product__category_id').annotate(lines=Count('id')).order_by()
+            )
+            for row in rows:
+                for entry in (ref('product', row['product_id']), ref('category', row['product__category_id'])):
+                    lines[entry] = lines.get(entry, 0) + row['lines']
+            with self.lock:
+                if self.orders_until == orders_until:
+                    self.add_popularity(lines)
+                    self.orders_until = until
+
+    def suggest(self, query, limit=None):
+        """Return up to ``limit`` ``(kind, id, name)`` entries with a word starting with ``query``, most popular first."""
+        conf = self.conf
+        limit = min(limit or conf['LIMIT'], conf['MAX_LIMIT'])
+        query = normalize(query)
+        if len(query) < conf['MIN_LENGTH']:
+            return []
+        prefix = query[:conf['KEY_LENGTH']]
+        # Updates shift the keys in place, so the range is only valid under the lock. Holding it
+        # costs little: the GIL runs one thread's Python code at a time anyway.
+        with self.lock:
+            low = bisect_left(self.keys, prefix)
+            high = bisect_left(self.keys, prefix + LAST_CHAR, low)
+            if high - low > conf['SCAN_LIMIT'] and prefix == query:
+                ranked = self.top.get(prefix)
+                if ranked is None:
+                    ranked = self.top[prefix] = self.rank(self.keys[low:high], None, conf['MAX_LIMIT'])
+            else:
+                ranked = self.rank(self.keys[low:high], query if prefix != query else None, limit)
+            names = self.names
+            return [(KINDS[entry & 1], entry >> 1, names[entry]) for entry in ranked[:limit] if entry in names]
+
+    def rank(self, keys, query, limit):
+        names = self.names
+        entries = {int(key.rpartition(SEPARATOR)[2]) for key in keys}
+        entries = {entry for entry in entries if entry in names}
+        if query is not None:
+            # Keys are cut to KEY_LENGTH, so longer queries are checked against the full names
+            entries = {
+                entry for entry in entries
+                if any(start.startswith(query) for start in word_starts(names[entry], self.conf['MAX_WORDS']))
+            }
+        return heapq.nsmallest(limit, entries, key=self.rank_key)
+
+
+_index = None
+_build_lock = threading.Lock()
+
+
+def get_index():
+    """Return this worker's index, built on first use and synced with the other workers."""
+    global _index
+    if _index is None:
+        with _build_lock:
+            if _index is None:
+                _index = AutocompleteIndex().build()
+    _index.sync()
+    return _index
+
+
+@warmup.register('autocomplete')
+def build_index():
+    get_index()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Category)
+def name_saved(sender, instance, **kwargs):
+    index = _index
+    if index is not None:
+        kind = 'product' if sender is Product else 'category'
+        transaction.on_commit(lambda: index.upsert(kind, instance.pk, instance.name))
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Category)
+def name_deleted(sender, instance, **kwargs):
+    index = _index
+    if index is not None:
+        kind = 'product' if sender is Product else 'category'
+        pk = instance.pk
+        transaction.on_commit(lambda: index.remove(kind, pk))
@@ -0,0 +1,147 @@
+"""Several API requests in one round trip.
+
+``POST /api/batch/`` carries a list of sub-requests against the API routes.
+The batch request is authenticated once and each sub-request is handed to its
+view directly, authenticated as the same user, without going through the
+middleware or parsing the token again. The views' own permissions and throttles
+still apply to every sub-request.
+
+Sub-requests run in order, except that consecutive reads (``GET``, ``HEAD``,
+``OPTIONS``) run concurrently, on up to ``WORKERS`` threads, each with its own
+database connection. A write therefore sees the effects of everything before
+it, and the reads after it see its effects. Sub-requests not started within
+``TIMEOUT`` seconds of the start of the batch, and concurrent reads not
+finished by then, are answered with 504; such a read finishes in the
+background, but its result is dropped.
+"""
+import io
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.urls import Resolver404, resolve
+from rest_framework.views import APIView
+
+from .conf import get_settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'MAX_REQUESTS': 20,
+    'TIMEOUT': 10,
+    'WORKERS': 4,
+}
+
+METHODS = ('GET', 'HEAD', 'OPTIONS', 'POST', 'PUT', 'PATCH', 'DELETE')
+READS = ('GET', 'HEAD', 'OPTIONS')
+# Headers of the batch request that describe its own body or response, not the sub-requests'
+OWN_HEADERS = ('HTTP_AUTHORIZATION', 'HTTP_ACCEPT', 'HTTP_ACCEPT_ENCODING', 'HTTP_CONTENT_TYPE', 'HTTP_CONTENT_LENGTH')
+
+
+def batch_settings():
+    return get_settings('BATCH', DEFAULTS)
+
+
+def validate(requests):
+    """Return an error message if ``requests`` is not a list of ``{method, path[, body]}`` objects, else None."""
+    if not isinstance(requests, list) or not requests:
+        return 'requests must be a non-empty list of {"method", "path", "body"} objects'
+    limit = batch_settings()['MAX_REQUESTS']
+    if len(requests) > limit:
+        return f'At most {limit} requests per batch'
+    for number, spec in enumerate(requests):
+        if not isinstance(spec, dict) or not isinstance(spec.get('path'), str) or not spec['path'].startswith('/'):
+            return f'Request {number}: path must be an absolute path such as /api/cart/'
+        if str(spec.get('method', 'GET')).upper() not in METHODS:
+            return f"Request {number}: method must be one of {', '.join(METHODS)}"
+    return None
+
+
+def build_request(outer, method, path, body):
+    """Return a WSGI request for ``path`` carrying the client address and headers of ``outer``."""
+    url = urlsplit(path)
+    payload = json.dumps(body, cls=DjangoJSONEncoder).encode() if body is not None else b''
+    environ = {key: value for key, value in outer.META.items() if key not in OWN_HEADERS}
+    environ.update({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': url.path,
+        'SCRIPT_NAME': '',
+        'QUERY_STRING': url.query,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(payload)),
+        'HTTP_ACCEPT': 'application/json',
+        'wsgi.input': io.BytesIO(payload),
+    })
+    return WSGIRequest(environ)
+
+
+def run(outer, spec):
+    """Dispatch one sub-request as the user of ``outer`` and return ``{'status', 'body'}``."""
+    method = str(spec.get('method', 'GET')).upper()
+    request = build_request(outer, method, spec['path'], spec.get('body'))
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return {'status': 404, 'body': {'error': 'Not found'}}
+    view_class = getattr(match.func, 'view_class', None)
+    if view_class is None or not issubclass(view_class, APIView) or not getattr(view_class, 'batchable', True):
+        return {'status': 400, 'body': {'error': 'This path cannot be batched'}}
+
+    if outer.user.is_authenticated:
+        request._force_auth_user = outer.user
+        request._force_auth_token = outer.auth
+    try:
+        response = match.func(request, *match.args, **match.kwargs)
+        if hasattr(response, 'data'):
+            body = response.data
+        else:
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+            body = content.decode(response.charset)
+    except Exception:
+        logger.exception('Batched %s %s failed', method, spec['path'])
+        return {'status': 500, 'body': {'error': 'Internal server error'}}
+    return {'status': response.status_code, 'body': body}
+
+
+def run_in_thread(outer, spec):
+    try:
+        return run(outer, spec)
+    finally:
+        # Connections are per thread and this thread is not reused
+        connections.close_all()
+
+
+def timed_out():
+    return {'status': 504, 'body': {'error': 'Batch time limit reached'}}
+
+
+def run_batch(outer, requests):
+    """Run the sub-requests in order, consecutive reads concurrently, and return their responses in order."""
+    conf = batch_settings()
+    deadline = time.monotonic() + conf['TIMEOUT']
+    responses = []
+    position = 0
+    while position < len(requests):
+        end = position + 1
+        if str(requests[position].get('method', 'GET')).upper() in READS:
+            while end < len(requests) and str(requests[end].get('method', 'GET')).upper() in READS:
+                end += 1
+        group = requests[position:end]
+        position = end
+
+        if time.monotonic() >= deadline:
+            responses.extend(timed_out() for _ in group)
+        elif len(group) == 1:
+            responses.append(run(outer, group[0]))
+        else:
+            executor = ThreadPoolExecutor(max_workers=min(conf['WORKERS'], len(group)))
+            futures = [executor.submit(run_in_thread, outer, spec) for spec in group]
+            wait(futures, timeout=max(0, deadline - time.monotonic()))
+            executor.shutdown(wait=False, cancel_futures=True)
+            responses.extend(future.result() if future.done() and not future.cancelled() else timed_out() for future in futures)
+    return responses
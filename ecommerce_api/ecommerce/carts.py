@@ -0,0 +1,216 @@
+"""Where carts are stored between checkouts.
+
+The cart views go through the backend named in ``CART_STORAGE['BACKEND']``:
+
+``ORMCartBackend``
+    Reads and writes ``Cart``/``CartItem`` rows directly, so every cart change
+    is a database write.
+
+``CacheCartBackend``
+    Keeps each cart in the cache (``CART_STORAGE['CACHE']``), which must be
+    shared by all workers (Redis, Memcached), and only writes it behind to the
+    database: the first change after a save queues a ``carts.persist`` job
+    ``WRITE_BEHIND_SECONDS`` later, so a cart costs at most one database write
+    per interval however often it changes. ``CheckoutView`` persists the cart
+    synchronously before creating the order. A cart missing from the cache is
+    loaded from its last saved rows. Item IDs are the product IDs.
+
+Both backends return carts and items as ``Cart``/``CartItem`` instances so the
+serializers render them the same way; the cache backend's instances are never
+saved.
+"""
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.utils.module_loading import import_string
+
+from . import jobs
+from .conf import get_settings
+from .models import Cart, CartItem, Product
+
+DEFAULTS = {
+    'BACKEND': 'ecommerce.carts.ORMCartBackend',
+    'CACHE': 'default',
+    'TIMEOUT': 7 * 24 * 3600,
+    'WRITE_BEHIND_SECONDS': 300,
+}
+
+
+def cart_settings():
+    return get_settings('CART_STORAGE', DEFAULTS)
+
+
+def get_backend():
+    return import_string(cart_settings()['BACKEND'])()
+
+
+def _with_items(cart, items):
+    # Same as prefetch_related('items'), so that cart.items.all() reads the list
+    queryset = CartItem.objects.none()
+    queryset._result_cache = items
+    queryset._prefetch_done = True
+    cart._prefetched_objects_cache = {'items': queryset}
+    return cart
+
+
+class ORMCartBackend:
+    def get_cart(self, user, queryset=None):
+        """Return the user's cart with its items loaded, or None.
+
+        ``queryset`` lets the caller choose what is loaded with the cart.
+        """
+        if queryset is None:
+            queryset = Cart.objects.prefetch_related('items__product__category')
+        return queryset.filter(user=user).first()
+
+    def get_item(self, user, item_id=None, product=None):
+        items = CartItem.objects.select_related('product__category').filter(cart__user=user)
+        if item_id is not None:
+            return items.filter(pk=item_id).first()
+        return items.filter(product=product).first()
+
+    def save_item(self, user, item):
+        if item.pk is not None:
+            item.save(update_fields=['quantity', 'updated_at'])
+            return item
+        cart, _ = Cart.objects.get_or_create(user=user)
+        item, _ = CartItem.objects.update_or_create(
+            cart=cart, product=item.product, defaults={'quantity': item.quantity}
+        )
+        return item
+
+    def delete_item(self, user, item_id):
+        deleted, _ = CartItem.objects.filter(pk=item_id, cart__user=user).delete()
+        return bool(deleted)
+
+    def clear(self, user):
+        CartItem.objects.filter(cart__user=user).delete()
+
+    def persist(self, user):
+        """Return the stored ``Cart`` row, brought up to date with the backend."""
+        return Cart.objects.filter(user=user).first()
+
+    def discard(self, user):
+        """Forget unsaved cart state once the stored cart has been checked out."""
+
+
+class CacheCartBackend(ORMCartBackend):
+    """Cache-first carts, written behind to the database.
+
+    The cached state is ``{'cart_id', 'created_at', 'items': [[product_id, quantity], ...]}``.
+    Changes are read-modify-write on that value, so two simultaneous changes to
+    the same cart may lose one of them.
+    """
+
+    def __init__(self):
+        conf = cart_settings()
+        self.cache = caches[conf['CACHE']]
+        self.timeout = conf['TIMEOUT']
+        self.write_behind = conf['WRITE_BEHIND_SECONDS']
+
+    def key(self, user):
+        return f'cart:{user.pk}'
+
+    def load(self, user, create=False):
+        state = self.cache.get(self.key(user))
+        if state is not None:
+            return state
+        cart = Cart.objects.filter(user=user).first()
+        if cart is None:
+            if not create:
+                return None
+            cart = Cart.objects.create(user=user)
+        state = {
+            'cart_id': cart.pk,
+            'created_at': cart.created_at,
+            'items': [list(row) for row in cart.items.order_by('pk').values_list('product_id', 'quantity')],
+        }
+        self.cache.add(self.key(user), state, self.timeout)
+        return state
+
+    def store(self, user, state):
+        self.cache.set(self.key(user), state, self.timeout)
+        # Only the first change since the last save queues a write
+        if self.cache.add(f'cart-persist:{user.pk}', True, self.write_behind * 10):
+            jobs.enqueue('carts.persist', {'user_id': user.pk}, delay=self.write_behind)
+
+    def build(self, user, state):
+        products = Product.objects.select_related('category').in_bulk([product_id for product_id, _ in state['items']])
+        cart = Cart(pk=state['cart_id'], user=user, created_at=state['created_at'])
+        items = [
+            CartItem(pk=product_id, cart=cart, product=products[product_id], quantity=quantity)
+            for product_id, quantity in state['items']
+            if product_id in products
+        ]
+        return _with_items(cart, items)
+
+    def get_cart(self, user, queryset=None):
+        state = self.load(user)
+        return self.build(user, state) if state is not None else None
+
+    def get_item(self, user, item_id=None, product=None):
+        state = self.load(user)
+        product_id = item_id if item_id is not None else product.pk
+        quantity = dict(state['items']).get(product_id) if state is not None else None
+        if quantity is None:
+            return None
+        if product is None:
+            product = Product.objects.select_related('category').filter(pk=product_id).first()
+            if product is None:
+                return None
+        return CartItem(pk=product_id, product=product, quantity=quantity)
+
+    def save_item(self, user, item):
+        state = self.load(user, create=True)
+        for row in state['items']:
+            if row[0] == item.product_id:
+                row[1] = item.quantity
+                break
+        else:
+            state['items'].append([item.product_id, item.quantity])
+        self.store(user, state)
+        item.pk = item.product_id
+        return item
+
+    def delete_item(self, user, item_id):
+        state = self.load(user)
+        if state is None or item_id not in dict(state['items']):
+            return False
+        state['items'] = [row for row in state['items'] if row[0] != item_id]
+        self.store(user, state)
+        return True
+
+    def clear(self, user):
+        state = self.load(user)
+        if state is not None and state['items']:
+            state['items'] = []
+            self.store(user, state)
+
+    def persist(self, user):
+        state = self.cache.get(self.key(user))
+        if state is None:
+            return super().persist(user)
+        quantities = dict(state['items'])
+        product_ids = set(Product.objects.filter(pk__in=quantities).values_list('pk', flat=True))
+        with transaction.atomic():
+            cart, _ = Cart.objects.get_or_create(user=user)
+            CartItem.objects.filter(cart=cart).exclude(product_id__in=product_ids).delete()
+            CartItem.objects.bulk_create(
+                [CartItem(cart=cart, product_id=product_id, quantity=quantities[product_id]) for product_id in product_ids],
+                update_conflicts=True,
+                unique_fields=['cart', 'product'] if connection.features.supports_update_conflicts_with_target else None,
+                update_fields=['quantity', 'updated_at'],
+            )
+        return cart
+
+    def discard(self, user):
+        transaction.on_commit(lambda: self.cache.delete(self.key(user)))
+
+
+@jobs.register('carts.persist')
+def persist_cart(user_id):
+    backend = CacheCartBackend()
+    backend.cache.delete(f'cart-persist:{user_id}')
+    user = User.objects.filter(pk=user_id).first()
+    if user is not None:
+        backend.persist(user)
@@ -0,0 +1,115 @@
+"""Catalog change feed.
+
+Every write to a Product or Category appends a CatalogChange row. Once the
+write has committed, the row is given the next ``position`` in the feed by
+``CatalogChange.objects.sequence()``. The writer does that from an on-commit
+hook; readers call it too, but it only locks the feed when a row is still
+unnumbered, so they normally stay read-only.
+Clients keep the last position they have seen and ask for the changes after
+it, so sync traffic follows the rate of change rather than the size of the
+catalog; positions only appear in increasing order, so a cursor never moves
+past a change that is still to come. Old rows are pruned; a cursor older than
+the retained history is told to resync.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .conf import get_settings
+from .models import CatalogChange, Category, Product
+from .signals import products_restocked
+
+DEFAULTS = {
+    'BATCH_SIZE': 500,
+    'RETENTION': timedelta(days=7),
+}
+
+KINDS = {Product: 'product', Category: 'category'}
+
+
+def feed_settings():
+    return get_settings('CATALOG_FEED', DEFAULTS)
+
+
+def catalog_version():
+    """Return the position of the latest committed catalog change."""
+    return CatalogChange.objects.sequence()
+
+
+def sequence_on_commit():
+    transaction.on_commit(CatalogChange.objects.sequence, robust=True)
+
+
+def latest_change():
+    """Return the ``seq`` of the newest catalog change; cheaper than ``catalog_version()``, for cache keys."""
+    return CatalogChange.objects.order_by('-seq').values_list('seq', flat=True).first() or 0
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Category)
+def record_upsert(sender, instance, **kwargs):
+    CatalogChange.objects.create(kind=KINDS[sender], object_id=instance.pk, operation='upsert')
+    sequence_on_commit()
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Category)
+def record_delete(sender, instance, **kwargs):
+    CatalogChange.objects.create(kind=KINDS[sender], object_id=instance.pk, operation='delete')
+    sequence_on_commit()
+
+
+@receiver(products_restocked)
+def record_restock(sender, quantities, **kwargs):
+    CatalogChange.objects.bulk_create([
+        CatalogChange(kind='product', object_id=pk, operation='upsert') for pk in quantities
+    ])
+    sequence_on_commit()
+
+
+def changes_since(since, limit=None):
+    """Return the collapsed changes after ``since``.
+
+    The result holds the upserted and deleted IDs per kind, the cursor to
+    pass next time, whether more changes are waiting, and whether the client
+    has to resync because ``since`` predates the retained history.
+    """
+    conf = feed_settings()
+    limit = min(limit or conf['BATCH_SIZE'], conf['BATCH_SIZE'])
+    version = catalog_version()
+    oldest = (
+        CatalogChange.objects.filter(position__isnull=False)
+        .order_by('position').values_list('position', flat=True).first()
+    )
+    if since <= 0 or (oldest is not None and since < oldest - 1):
+        return {'resync': True, 'next': version}
+
+    rows = list(
+        CatalogChange.objects.filter(position__gt=since)
+        .order_by('position')
+        .values_list('position', 'kind', 'object_id', 'operation')[:limit]
+    )
+    latest = {}
+    for _, kind, object_id, operation in rows:
+        latest[(kind, object_id)] = operation
+
+    upserts = {kind: [] for kind in KINDS.values()}
+    deletes = {kind: [] for kind in KINDS.values()}
+    for (kind, object_id), operation in latest.items():
+        (upserts if operation == 'upsert' else deletes)[kind].append(object_id)
+    return {
+        'resync': False,
+        'next': rows[-1][0] if rows else since,
+        'has_more': len(rows) == limit,
+        'upserts': upserts,
+        'deletes': deletes,
+    }
+
+
+def prune_changes(older_than=None):
+    """Delete changes older than the retention period, always keeping the latest one."""
+    cutoff = timezone.now() - (older_than or feed_settings()['RETENTION'])
+    return CatalogChange.objects.filter(changed_at__lt=cutoff, position__lt=catalog_version()).delete()[0]
@@ -0,0 +1,6 @@
+from django.conf import settings
+
+
+def get_settings(name, defaults):
+    """Return the ``settings.<name>`` dict layered over ``defaults``."""
+    return {**defaults, **getattr(settings, name, {})}
@@ -0,0 +1,220 @@
+"""Combinable product filters and their facet counts.
+
+Filters on category, price bucket, stock and creation date can be combined:
+options within one facet are OR-ed and facets are AND-ed. Each option's count
+applies every *other* selected facet, which is what a storefront shows next to
+an option. All counts come from one GROUP BY category query with conditional
+aggregates, and results are cached under the catalog version so repeated
+requests cost a single cheap lookup until the catalog changes.
+"""
+import hashlib
+import json
+from datetime import datetime, time, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.http import QueryDict
+from django.utils import timezone
+from rest_framework import serializers
+
+from . import warmup
+from .catalog import latest_change
+from .conf import get_settings
+from .models import Product
+
+DEFAULTS = {
+    'PRICE_BUCKETS': [0, 25, 50, 100, 250, 500, 1000],
+    'CREATED_WITHIN_DAYS': [7, 30, 90],
+    'CACHE_TIMEOUT': 300,
+}
+
+FACETS = ('category', 'price', 'in_stock', 'created_within')
+# Further back than any catalog goes, and well within the range of date arithmetic
+MAX_CREATED_WITHIN_DAYS = 36500
+
+
+def facet_settings():
+    return get_settings('PRODUCT_FACETS', DEFAULTS)
+
+
+def price_buckets():
+    bounds = [Decimal(str(bound)) for bound in facet_settings()['PRICE_BUCKETS']]
+    buckets = {}
+    for low, high in zip(bounds, bounds[1:] + [None]):
+        key = f"{low}-{high}" if high is not None else f"{low}-"
+        buckets[key] = (low, high)
+    return buckets
+
+
+def price_q(low, high):
+    q = Q(price__gte=low)
+    if high is not None:
+        q &= Q(price__lt=high)
+    return q
+
+
+def created_cutoff(days):
+    # Whole days keep the filter, and therefore the cache key, stable for a day
+    today = timezone.localdate()
+    return timezone.make_aware(datetime.combine(today - timedelta(days=days), time.min))
+
+
+def _list_param(params, name):
+    values = []
+    for value in params.getlist(name):
+        values.extend(part for part in value.split(',') if part)
+    return values
+
+
+class ProductFilter:
+    """Filters parsed from query parameters.
+
+    Supported parameters: ``category_id`` (repeatable or comma separated),
+    ``price`` (bucket keys such as ``25-50`` or ``500-``), ``min_price``,
+    ``max_price``, ``in_stock`` (``true``/``false``) and ``created_within``
+    (days).
+    """
+
+    def __init__(self, params):
+        try:
+            self.category_ids = sorted({int(value) for value in _list_param(params, 'category_id')})
+        except ValueError:
+            raise serializers.ValidationError({'category_id': 'Category IDs must be integers'})
+
+        buckets = price_buckets()
+        self.price_keys = sorted(set(_list_param(params, 'price')))
+        unknown = [key for key in self.price_keys if key not in buckets]
+        if unknown:
+            raise serializers.ValidationError({'price': f"Unknown price bucket(s): {', '.join(unknown)}"})
+
+        try:
+            self.min_price = Decimal(params['min_price']) if params.get('min_price') else None
+            self.max_price = Decimal(params['max_price']) if params.get('max_price') else None
+        except InvalidOperation:
+            raise serializers.ValidationError({'price': 'min_price and max_price must be numbers'})
+        # Decimal() also parses NaN and Infinity, which the database layer rejects
+        if any(value is not None and not value.is_finite() for value in (self.min_price, self.max_price)):
+            raise serializers.ValidationError({'price': 'min_price and max_price must be numbers'})
+
+        in_stock = params.get('in_stock')
+        if in_stock not in (None, '', 'true', 'false'):
+            raise serializers.ValidationError({'in_stock': "Use 'true' or 'false'"})
+        self.in_stock = {'true': True, 'false': False}.get(in_stock)
+
+        created_within = params.get('created_within')
+        try:
+            self.created_within = int(created_within) if created_within else None
+        except ValueError:
+            raise serializers.ValidationError({'created_within': 'Number of days expected'})
+        if self.created_within is not None and not 0 <= self.created_within <= MAX_CREATED_WITHIN_DAYS:
+            raise serializers.ValidationError(
+                {'created_within': f'Number of days between 0 and {MAX_CREATED_WITHIN_DAYS} expected'}
+            )
+
+    def facet_q(self, facet):
+        if facet == 'category' and self.category_ids:
+            return Q(category_id__in=self.category_ids)
+        if facet == 'price':
+            q = Q()
+            buckets = price_buckets()
+            for key in self.price_keys:
+                q |= price_q(*buckets[key])
+            if self.min_price is not None:
+                q &= Q(price__gte=self.min_price)
+            if self.max_price is not None:
+                q &= Q(price__lte=self.max_price)
+            return q
+        if facet == 'in_stock' and self.in_stock is not None:
+            return Q(stock__gt=0) if self.in_stock else Q(stock=0)
+        if facet == 'created_within' and self.created_within is not None:
+            return Q(created_at__gte=created_cutoff(self.created_within))
+        return Q()
+
+    def q(self, exclude=()):
+        q = Q()
+        for facet in FACETS:
+            if facet not in exclude:
+                q &= self.facet_q(facet)
+        return q
+
+    def apply(self, queryset):
+        return queryset.filter(self.q())
+
+    def cache_key(self):
+        state = [self.category_ids, self.price_keys, self.min_price, self.max_price, self.in_stock, self.created_within]
+        digest = hashlib.md5(json.dumps(state, default=str).encode()).hexdigest()
+        return f"product-facets:{latest_change()}:{timezone.localdate()}:{digest}"
+
+
+def _count(q):
+    return Count('id', filter=q) if q else Count('id')
+
+
+def compute_facets(product_filter):
+    """Compute every facet count with a single aggregate query."""
+    conf = facet_settings()
+    buckets = price_buckets()
+    others = {facet: product_filter.q(exclude=('category', facet)) for facet in FACETS}
+
+    aggregates = {'matches': _count(others['category'])}
+    for index, (low, high) in enumerate(buckets.values()):
+        aggregates[f'price_{index}'] = _count(price_q(low, high) & others['price'])
+    aggregates['in_stock_true'] = _count(Q(stock__gt=0) & others['in_stock'])
+    aggregates['in_stock_false'] = _count(Q(stock=0) & others['in_stock'])
+    for days in conf['CREATED_WITHIN_DAYS']:
+        aggregates[f'created_{days}'] = _count(Q(created_at__gte=created_cutoff(days)) & others['created_within'])
+
+    rows = list(
+        Product.objects.values('category_id', 'category__name').annotate(**aggregates).order_by('category__name')
+    )
+    selected = set(product_filter.category_ids)
+    in_selection = [row for row in rows if not selected or row['category_id'] in selected]
+
+    def total(key):
+        return sum(row[key] for row in in_selection)
+
+    return {
+        'total': total('matches'),
+        'categories': [
+            {
+                'id': row['category_id'],
+                'name': row['category__name'],
+                'count': row['matches'],
+                'selected': row['category_id'] in selected,
+            }
+            for row in rows
+        ],
+        'price': [
+            {
+                'key': key,
+                'min': str(low),
+                'max': str(high) if high is not None else None,
+                'count': total(f'price_{index}'),
+                'selected': key in product_filter.price_keys,
+            }
+            for index, (key, (low, high)) in enumerate(buckets.items())
+        ],
+        'in_stock': [
+            {'key': 'true', 'count': total('in_stock_true'), 'selected': product_filter.in_stock is True},
+            {'key': 'false', 'count': total('in_stock_false'), 'selected': product_filter.in_stock is False},
+        ],
+        'created_within': [
+            {'days': days, 'count': total(f'created_{days}'), 'selected': product_filter.created_within == days}
+            for days in conf['CREATED_WITHIN_DAYS']
+        ],
+    }
+
+
+def facet_counts(product_filter):
+    key = product_filter.cache_key()
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(product_filter)
+        cache.set(key, facets, facet_settings()['CACHE_TIMEOUT'])
+    return facets
+
+
+@warmup.register('facets')
+def prime_facets():
+    facet_counts(ProductFilter(QueryDict()))
@@ -0,0 +1,157 @@
+"""Sparse fieldsets (``?fields=``) and opt-in expansion (``?expand=``).
+
+``fields`` takes dotted paths (``fields=id,items.quantity,items.product.name``)
+and limits the output to them. ``expand`` names relations that should be
+rendered as nested objects. Once either parameter is given, a relation that is
+not expanded is rendered as its primary key. Without either parameter the
+output is unchanged.
+
+The same selection drives the query: ``shape_queryset`` turns the serializer's
+remaining fields into ``only()``, ``select_related()`` and ``Prefetch``
+lookups, so unrequested columns are not selected and unrequested relations are
+neither joined nor prefetched.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+
+
+def _parse_paths(value):
+    return [tuple(part for part in path.strip().split('.') if part) for path in value.split(',') if path.strip()]
+
+
+class Fieldset:
+    def __init__(self, fields=None, expand=()):
+        self.fields = None
+        if fields is not None:
+            self.fields = {}
+            for path in fields:
+                node = self.fields
+                for name in path:
+                    node = node.setdefault(name, {})
+        self.expand = set(expand)
+
+    @classmethod
+    def from_request(cls, request):
+        params = request.query_params
+        if 'fields' not in params and 'expand' not in params:
+            return None
+        fields = _parse_paths(params['fields']) if params.get('fields') else None
+        return cls(fields, _parse_paths(params.get('expand', '')))
+
+    def selected(self, path):
+        """Return the field names selected at ``path``, or None for all of them."""
+        node = self.fields
+        for name in path:
+            if not node:
+                return None
+            node = node.get(name)
+        return set(node) if node else None
+
+    def is_expanded(self, path):
+        if path in self.expand:
+            return True
+        node = self.fields
+        for name in path:
+            if not node:
+                return False
+            node = node.get(name)
+        return bool(node)
+
+
+class SparseFieldsMixin:
+    """Serializer mixin applying the request's Fieldset (``context['fieldset']``).
+
+    ``expandable_fields`` lists the nested relations that are rendered as a
+    primary key unless expanded.
+    """
+    expandable_fields = ()
+
+    def get_fields(self):
+        fields = super().get_fields()
+        fieldset = self.context.get('fieldset')
+        if fieldset is None:
+            return fields
+
+        path = self.field_path()
+        selected = fieldset.selected(path)
+        if selected is not None:
+            fields = {name: field for name, field in fields.items() if name in selected or field.write_only}
+        for name in self.expandable_fields:
+            if name in fields and not fieldset.is_expanded(path + (name,)):
+                fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+        return fields
+
+    def field_path(self):
+        path = []
+        node = self
+        while node.parent is not None:
+            if node.field_name:
+                path.append(node.field_name)
+            node = node.parent
+        return tuple(reversed(path))
+
+
+def serializer_paths(serializer, prefix=''):
+    """Return the ORM lookups needed to render ``serializer``'s readable fields."""
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    hints = getattr(serializer, 'method_field_sources', {})
+    paths = set()
+    for field in serializer._readable_fields:
+        if isinstance(field, serializers.SerializerMethodField):
+            paths |= {prefix + hint for hint in hints.get(field.field_name, ())}
+            continue
+        if field.source == '*':
+            continue
+        lookup = prefix + field.source.replace('.', '__')
+        if isinstance(field, serializers.BaseSerializer):
+            paths.add(lookup)
+            paths |= serializer_paths(field, lookup + '__')
+        else:
+            paths.add(lookup)
+    return paths
+
+
+def _plan(model, paths, prefix=''):
+    groups = {}
+    for path in paths:
+        head, _, rest = path.partition('__')
+        groups.setdefault(head, set())
+        if rest:
+            groups[head].add(rest)
+
+    only, select_related, prefetches = [prefix + model._meta.pk.name], [], []
+    for head, rest in groups.items():
+        try:
+            field = model._meta.get_field(head)
+        except FieldDoesNotExist:
+            # Properties and methods may read any column, so load them all
+            only += [prefix + f.name for f in model._meta.concrete_fields]
+            continue
+        if not field.is_relation:
+            only.append(prefix + head)
+        elif field.concrete and (field.many_to_one or field.one_to_one):
+            only.append(prefix + head)
+            if rest:
+                select_related.append(prefix + head)
+                nested = _plan(field.related_model, rest, prefix + head + '__')
+                only += nested[0]
+                select_related += nested[1]
+                prefetches += nested[2]
+        elif field.one_to_many:
+            related = shape_queryset(field.related_model._default_manager.all(), rest | {field.field.name})
+            prefetches.append(Prefetch(prefix + head, queryset=related))
+        else:
+            prefetches.append(prefix + head)
+    return only, select_related, prefetches
+
+
+def shape_queryset(queryset, paths):
+    only, select_related, prefetches = _plan(queryset.model, paths)
+    queryset = queryset.only(*dict.fromkeys(only))
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetches:
+        queryset = queryset.prefetch_related(*prefetches)
+    return queryset
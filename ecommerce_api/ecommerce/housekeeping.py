@@ -0,0 +1,195 @@
+"""Purging data nothing needs any more.
+
+Each policy selects rows past their retention period:
+
+``cart_items``
+    Items of carts in which nothing changed for ``CART_ITEMS_AFTER``.
+``coupons``
+    Coupons expired for longer than ``EXPIRED_COUPONS_AFTER`` and not used by
+    any live order (archived orders keep the code).
+``wishlists``
+    Wishlist entries older than ``OUT_OF_STOCK_WISHLISTS_AFTER`` for products
+    that are out of stock and have not changed in that time either.
+``jobs``
+    Finished jobs older than ``JOBS_AFTER``.
+``notifications``
+    Notifications older than ``NOTIFICATIONS_AFTER``.
+``catalog_changes``
+    Catalog change feed entries past ``CATALOG_FEED['RETENTION']``.
+``outbox_events``
+    Outbox events older than ``OUTBOX_EVENTS_AFTER`` that every sink in
+    ``OUTBOX['SINKS']`` has received.
+
+Setting a retention to None disables its policy. Rows are deleted by primary
+key, ``BATCH_SIZE`` at a time in short transactions, at no more than
+``ROWS_PER_SECOND`` and at most ``MAX_ROWS`` per policy and run; whatever is
+left is picked up by the next run. ``run()`` returns the rows deleted per
+policy. The ``housekeeping`` command runs it once or in a loop. In the job
+worker the ``housekeeping.run`` job does the same, one batch per job, and
+starts over every ``INTERVAL`` seconds.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import jobs
+from .catalog import feed_settings
+from .conf import get_settings
+from .models import CartItem, CatalogChange, Coupon, Job, Notification, OutboxCursor, OutboxEvent, Wishlist
+from .outbox import outbox_settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'INTERVAL': 3600,
+    'BATCH_SIZE': 500,
+    'ROWS_PER_SECOND': 2000,
+    'MAX_ROWS': 100000,
+    'CART_ITEMS_AFTER': timedelta(days=30),
+    'EXPIRED_COUPONS_AFTER': timedelta(days=90),
+    'OUT_OF_STOCK_WISHLISTS_AFTER': timedelta(days=365),
+    'JOBS_AFTER': timedelta(days=7),
+    'NOTIFICATIONS_AFTER': timedelta(days=90),
+    'OUTBOX_EVENTS_AFTER': timedelta(days=7),
+}
+
+POLICIES = ('cart_items', 'coupons', 'wishlists', 'jobs', 'notifications', 'catalog_changes', 'outbox_events')
+
+
+def housekeeping_settings():
+    return get_settings('HOUSEKEEPING', DEFAULTS)
+
+
+def policies(now=None):
+    """Return ``{name: queryset}`` of the rows each enabled policy would delete."""
+    conf = housekeeping_settings()
+    now = now or timezone.now()
+    selected = {}
+    if conf['CART_ITEMS_AFTER'] is not None:
+        cutoff = now - conf['CART_ITEMS_AFTER']
+        selected['cart_items'] = CartItem.objects.filter(updated_at__lt=cutoff).exclude(
+            cart__items__updated_at__gte=cutoff
+        )
+    if conf['EXPIRED_COUPONS_AFTER'] is not None:
+        selected['coupons'] = Coupon.objects.filter(
+            expiry_date__lt=now - conf['EXPIRED_COUPONS_AFTER'], order__isnull=True
+        )
+    if conf['OUT_OF_STOCK_WISHLISTS_AFTER'] is not None:
+        cutoff = now - conf['OUT_OF_STOCK_WISHLISTS_AFTER']
+        selected['wishlists'] = Wishlist.objects.filter(
+            added_at__lt=cutoff, product__stock=0, product__updated_at__lt=cutoff
+        )
+    if conf['JOBS_AFTER'] is not None:
+        selected['jobs'] = Job.objects.filter(
+            status__in=['done', 'failed'], finished_at__lt=now - conf['JOBS_AFTER']
+        )
+    if conf['NOTIFICATIONS_AFTER'] is not None:
+        selected['notifications'] = Notification.objects.filter(created_at__lt=now - conf['NOTIFICATIONS_AFTER'])
+    if feed_settings()['RETENTION'] is not None:
+        # The latest change is kept so that the feed version never goes backwards
+        selected['catalog_changes'] = CatalogChange.objects.filter(
+            changed_at__lt=now - feed_settings()['RETENTION'], position__lt=CatalogChange.objects.last_position()
+        )
+    if conf['OUTBOX_EVENTS_AFTER'] is not None:
+        sinks = list(outbox_settings()['SINKS'])
+        positions = dict(OutboxCursor.objects.filter(sink__in=sinks).values_list('sink', 'position'))
+        delivered = min((positions.get(sink, 0) for sink in sinks), default=None)
+        selected['outbox_events'] = OutboxEvent.objects.filter(created_at__lt=now - conf['OUTBOX_EVENTS_AFTER'])
+        if delivered is not None:
+            selected['outbox_events'] = selected['outbox_events'].filter(position__lte=delivered)
+    return selected
+
+
+def delete_batch(queryset, batch_size):
+    """Delete up to ``batch_size`` rows of ``queryset`` in one transaction; return (selected, deleted).
+
+    The DELETE applies the policy again, so a row that changed after it was
+    selected, such as a cart item touched in the meantime, is kept.
+    """
+    with transaction.atomic():
+        pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return 0, 0
+        deleted, _ = queryset.filter(pk__in=pks).delete()
+    return len(pks), deleted
+
+
+def pause_after(rows, elapsed, conf):
+    return max(0, rows / conf['ROWS_PER_SECOND'] - elapsed)
+
+
+def purge(queryset, conf=None):
+    """Delete the rows of ``queryset`` in bounded, rate-limited batches and return how many were deleted."""
+    conf = conf or housekeeping_settings()
+    deleted = 0
+    while deleted < conf['MAX_ROWS']:
+        started = time.monotonic()
+        batch_size = min(conf['BATCH_SIZE'], conf['MAX_ROWS'] - deleted)
+        selected, count = delete_batch(queryset, batch_size)
+        deleted += count
+        if selected < batch_size:
+            break
+        time.sleep(pause_after(selected, time.monotonic() - started, conf))
+    return deleted
+
+
+def log_report(report):
+    logger.info('Housekeeping reclaimed %s', ', '.join(f'{name}={rows}' for name, rows in report.items()))
+
+
+def run(names=None, dry_run=False):
+    """Apply the policies (all or ``names``) and return the rows deleted, or that would be, per policy."""
+    conf = housekeeping_settings()
+    report = {}
+    for name, queryset in policies().items():
+        if names and name not in names:
+            continue
+        report[name] = queryset.count() if dry_run else purge(queryset, conf)
+    if not dry_run:
+        log_report(report)
+    return report
+
+
+def schedule(delay=0):
+    """Queue a ``housekeeping.run`` job unless one is already queued or running."""
+    if Job.objects.filter(name='housekeeping.run', status__in=['queued', 'running']).exists():
+        return None
+    return jobs.enqueue('housekeeping.run', delay=delay)
+
+
+def reschedule(**payload):
+    schedule(delay=housekeeping_settings()['INTERVAL'])
+
+
+@jobs.register('housekeeping.run', on_failure=reschedule)
+def run_housekeeping(policy=None, report=None):
+    """Delete one batch per job, so that no job holds a transaction for long, and queue the next one.
+
+    The job walks the policies in order and, after the last one, logs the
+    report and queues the next run ``INTERVAL`` seconds later.
+    """
+    conf = housekeeping_settings()
+    selected_policies = policies()
+    names = list(selected_policies)
+    if not names:
+        jobs.enqueue('housekeeping.run', delay=conf['INTERVAL'])
+        return
+    report = report or {}
+    policy = policy if policy in selected_policies else names[0]
+
+    started = time.monotonic()
+    batch_size = min(conf['BATCH_SIZE'], conf['MAX_ROWS'] - report.get(policy, 0))
+    selected, deleted = delete_batch(selected_policies[policy], batch_size)
+    report[policy] = report.get(policy, 0) + deleted
+    delay = pause_after(selected, time.monotonic() - started, conf)
+
+    if selected == batch_size and report[policy] < conf['MAX_ROWS']:
+        jobs.enqueue('housekeeping.run', {'policy': policy, 'report': report}, delay=delay)
+    elif names.index(policy) + 1 < len(names):
+        jobs.enqueue('housekeeping.run', {'policy': names[names.index(policy) + 1], 'report': report}, delay=delay)
+    else:
+        log_report(report)
+        jobs.enqueue('housekeeping.run', delay=conf['INTERVAL'])
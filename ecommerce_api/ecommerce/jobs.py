@@ -0,0 +1,189 @@
+"""Database-backed background job queue.
+
+Handlers are registered by name with :func:`register` and queued with
+:func:`enqueue`. Because jobs are plain rows, enqueueing inside a
+``transaction.atomic()`` block commits or rolls back together with the
+surrounding changes. Jobs are executed by the ``run_jobs`` management command
+or, when ``JOB_QUEUE['EAGER']`` is set, in-process as soon as the enqueueing
+transaction commits, with failed attempts retried straight away instead of
+after a backoff. Jobs queued with a ``delay`` still wait for ``run_jobs`` in
+eager mode, since running them at once would spin the jobs that reschedule
+themselves (``housekeeping.run``, ``orders.archive``); a warning says so.
+"""
+import logging
+import random
+import time
+import traceback
+from datetime import timedelta
+
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .conf import get_settings
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'EAGER': False,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_SECONDS': 5,
+    'MAX_BACKOFF_SECONDS': 3600,
+    'BATCH_SIZE': 20,
+    'POLL_INTERVAL': 1.0,
+    'LOCK_TIMEOUT': 300,
+}
+
+_registry = {}
+
+
+def queue_settings():
+    return get_settings('JOB_QUEUE', DEFAULTS)
+
+
+def register(name, on_failure=None):
+    """Register ``func`` as the handler for jobs called ``name``.
+
+    ``on_failure`` is called with the job payload once the job has used up
+    all of its attempts.
+    """
+    def decorator(func):
+        _registry[name] = (func, on_failure)
+        return func
+    return decorator
+
+
+def enqueue(name, payload=None, delay=0, max_attempts=None):
+    if name not in _registry:
+        raise KeyError(f"No job handler registered for '{name}'")
+    conf = queue_settings()
+    job = Job.objects.create(
+        name=name,
+        payload=payload or {},
+        run_at=timezone.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or conf['MAX_ATTEMPTS'],
+    )
+    if conf['EAGER']:
+        if delay:
+            logger.warning('Job %s is delayed by %ss and only runs under run_jobs, even with EAGER set', job, delay)
+        else:
+            transaction.on_commit(lambda: run_job(job.pk))
+    return job
+
+
+def backoff(attempts):
+    conf = queue_settings()
+    delay = min(conf['BACKOFF_SECONDS'] * 2 ** (attempts - 1), conf['MAX_BACKOFF_SECONDS'])
+    return delay + random.uniform(0, delay / 10)
+
+
+def claim(limit):
+    """Mark up to ``limit`` due jobs as running and return them."""
+    now = timezone.now()
+    with transaction.atomic():
+        claimed = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status='queued', run_at__lte=now)
+            .order_by('run_at', 'id')[:limit]
+        )
+        Job.objects.filter(pk__in=[job.pk for job in claimed]).update(
+            status='running', locked_at=now, attempts=F('attempts') + 1
+        )
+    for job in claimed:
+        job.status = 'running'
+        job.locked_at = now
+        job.attempts += 1
+    return claimed
+
+
+def execute(job):
+    """Run a claimed job and record its outcome."""
+    func, on_failure = _registry.get(job.name, (None, None))
+    try:
+        if func is None:
+            raise KeyError(f"No job handler registered for '{job.name}'")
+        with transaction.atomic():
+            func(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        now = timezone.now()
+        if func is None or job.attempts >= job.max_attempts:
+            logger.error("Job %s failed permanently after %s attempts", job, job.attempts)
+            Job.objects.filter(pk=job.pk).update(
+                status='failed', last_error=error, locked_at=None, finished_at=now
+            )
+            if on_failure is not None:
+                try:
+                    on_failure(**job.payload)
+                except Exception:
+                    logger.exception("Failure handler of job %s failed", job)
+        else:
+            logger.warning("Job %s failed on attempt %s, retrying", job, job.attempts)
+            delay = 0 if queue_settings()['EAGER'] else backoff(job.attempts)
+            Job.objects.filter(pk=job.pk).update(
+                status='queued', last_error=error, locked_at=None,
+                run_at=now + timedelta(seconds=delay),
+            )
+        return False
+    Job.objects.filter(pk=job.pk).update(status='done', locked_at=None, finished_at=timezone.now())
+    return True
+
+
+def run_job(job_id):
+    """Claim and run a single queued job, returning whether it was run.
+
+    In eager mode there is no worker to pick up a retry, so a failed attempt
+    is retried here until the job succeeds or runs out of attempts.
+    """
+    ran = False
+    while Job.objects.filter(pk=job_id, status='queued').update(
+        status='running', locked_at=timezone.now(), attempts=F('attempts') + 1
+    ):
+        ran = True
+        if execute(Job.objects.get(pk=job_id)) or not queue_settings()['EAGER']:
+            break
+    return ran
+
+
+def run_pending(batch_size=None):
+    """Run the jobs that are currently due and return how many were run."""
+    batch_size = batch_size or queue_settings()['BATCH_SIZE']
+    processed = 0
+    while True:
+        claimed = claim(batch_size)
+        for job in claimed:
+            execute(job)
+        if not claimed:
+            return processed
+        processed += len(claimed)
+
+
+def requeue_stale():
+    """Release jobs whose worker died while running them."""
+    cutoff = timezone.now() - timedelta(seconds=queue_settings()['LOCK_TIMEOUT'])
+    return Job.objects.filter(status='running', locked_at__lt=cutoff).update(
+        status='queued', locked_at=None
+    )
+
+
+class Worker:
+    def __init__(self, batch_size=None, poll_interval=None):
+        conf = queue_settings()
+        self.batch_size = batch_size or conf['BATCH_SIZE']
+        self.poll_interval = poll_interval if poll_interval is not None else conf['POLL_INTERVAL']
+        self.running = False
+
+    def run_once(self):
+        close_old_connections()
+        requeue_stale()
+        return run_pending(self.batch_size)
+
+    def run(self):
+        self.running = True
+        while self.running:
+            if not self.run_once():
+                time.sleep(self.poll_interval)
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,42 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ecommerce.archive import archivable, archive_batch, archive_settings, pause_after, schedule
+
+
+class Command(BaseCommand):
+    help = 'Move finished orders older than the cutoff into the order archive.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help="Archive orders older than this (defaults to ORDER_ARCHIVE['AFTER']).")
+        parser.add_argument('--batch-size', type=int, help="Orders per transaction (defaults to ORDER_ARCHIVE['BATCH_SIZE']).")
+        parser.add_argument('--limit', type=int, help='Stop after roughly this many orders.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the orders that would be archived.')
+        parser.add_argument('--enqueue', action='store_true', help='Queue the orders.archive job instead of running inline.')
+
+    def handle(self, *args, **options):
+        if options['enqueue']:
+            job = schedule()
+            self.stdout.write(self.style.SUCCESS(f'Queued {job}') if job else 'An archive job is already queued')
+            return
+
+        after = timedelta(days=options['days']) if options['days'] else archive_settings()['AFTER']
+        before = timezone.now() - after
+        if options['dry_run']:
+            self.stdout.write(f'{archivable(before).count()} order(s) would be archived')
+            return
+
+        batch_size = options['batch_size'] or archive_settings()['BATCH_SIZE']
+        total = 0
+        while not options['limit'] or total < options['limit']:
+            started = time.monotonic()
+            moved = archive_batch(batch_size, before)
+            total += moved
+            if moved < batch_size:
+                break
+            self.stdout.write(f'{total} order(s) archived')
+            time.sleep(pause_after(time.monotonic() - started))
+        self.stdout.write(self.style.SUCCESS(f'Archived {total} order(s)'))
@@ -0,0 +1,92 @@
+import random
+import resource
+import statistics
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from ecommerce.autocomplete import AutocompleteIndex, autocomplete_settings, ref
+
+WORDS = (
+    'wireless bluetooth usb portable smart mini pro max ultra classic organic cotton leather steel wooden '
+    'kitchen garden outdoor travel gaming office baby kids mens womens sports running yoga camping '
+    'mouse keyboard headphones speaker charger cable laptop tablet phone case lamp chair desk table '
+    'bottle bag backpack jacket shirt shoes socks watch camera lens tripod drone knife pan blender '
+    'vacuum heater fan filter brush towel pillow blanket mattress rug mirror frame candle vase plant'
+).split()
+
+
+class Command(BaseCommand):
+    help = 'Report the memory footprint and query latency of the autocomplete index on synthetic names (no database involved).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--names', type=int, default=1_000_000)
+        parser.add_argument('--categories', type=int, default=1000)
+        parser.add_argument('--queries', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        conf = autocomplete_settings()
+        names, scores = self.generate(rng, options)
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        index = AutocompleteIndex(conf)
+        started = time.perf_counter()
+        index.load(names, scores)
+        self.stdout.write(
+            f'built {len(index.keys):,} keys for {len(names):,} names in {time.perf_counter() - started:.2f}s '
+            f"(KEY_LENGTH={conf['KEY_LENGTH']}, MAX_WORDS={conf['MAX_WORDS']})"
+        )
+
+        keys = sys.getsizeof(index.keys) + sum(sys.getsizeof(key) for key in index.keys)
+        entries = sum(sys.getsizeof(entry) + sys.getsizeof(name) for entry, name in names.items())
+        entries += sys.getsizeof(names) + sys.getsizeof(scores) + sum(sys.getsizeof(score) for score in scores.values())
+        grown = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024
+        self.stdout.write(f'  keys          {keys / 2 ** 20:8.1f} MB  {keys / len(index.keys):6.1f} bytes/key')
+        self.stdout.write(f'  names/scores  {entries / 2 ** 20:8.1f} MB  {entries / len(names):6.1f} bytes/name')
+        self.stdout.write(f'  total         {(keys + entries) / 2 ** 20:8.1f} MB  (peak RSS grew {grown:,.0f} MB while building)')
+
+        samples = rng.sample(list(names.values()), min(options['queries'], len(names)))
+        for length in (1, 2, 3, 5, 8):
+            queries = [name.split()[rng.randrange(min(len(name.split()), conf['MAX_WORDS']))][:length] for name in samples]
+            first = self.time_queries(index, queries)
+            again = self.time_queries(index, queries)
+            self.stdout.write(
+                f'  prefix of {length} chars: p50 {statistics.median(first) * 1e6:7.1f} us, '
+                f'p99 {self.p99(first) * 1e6:8.1f} us; repeated p50 {statistics.median(again) * 1e6:7.1f} us, '
+                f'p99 {self.p99(again) * 1e6:8.1f} us'
+            )
+        self.stdout.write(f'  {len(index.top):,} rankings cached')
+
+        timings = []
+        for number in range(1000):
+            pk = rng.randrange(1, options['names'] - options['categories'])
+            name = f"{names[ref('product', pk)]} renamed {number}"
+            started = time.perf_counter()
+            index.upsert('product', pk, name)
+            timings.append(time.perf_counter() - started)
+        self.stdout.write(f'  rename: p50 {statistics.median(timings) * 1e6:7.1f} us, p99 {self.p99(timings) * 1e6:8.1f} us')
+
+    def generate(self, rng, options):
+        names, scores = {}, {}
+        for pk in range(1, options['categories'] + 1):
+            names[ref('category', pk)] = f'{rng.choice(WORDS).title()} {rng.choice(WORDS)} {pk}'
+        for pk in range(1, options['names'] - options['categories'] + 1):
+            words = rng.choices(WORDS, k=rng.randint(2, 6))
+            names[ref('product', pk)] = ' '.join(words).capitalize() + f' {rng.choice("ABCDEFGHJK")}{pk % 1000}'
+            # Order counts are long-tailed: most products are rarely ordered
+            scores[ref('product', pk)] = int(rng.paretovariate(1.2)) - 1
+        return names, scores
+
+    def time_queries(self, index, queries):
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            index.suggest(query)
+            timings.append(time.perf_counter() - started)
+        return timings
+
+    def p99(self, timings):
+        return sorted(timings)[int(len(timings) * 0.99)]
@@ -0,0 +1,116 @@
+import random
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from ecommerce.carts import get_backend
+from ecommerce.models import Cart, CartItem, Category, Job, Product
+
+BACKENDS = ['ecommerce.carts.ORMCartBackend', 'ecommerce.carts.CacheCartBackend']
+WRITES = ('INSERT', 'UPDATE', 'DELETE')
+
+
+class QueryCounter:
+    def __init__(self):
+        self.queries = self.writes = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        self.writes += sql.lstrip().upper().startswith(WRITES)
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = 'Measure cart operation throughput and database load of each cart storage backend.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--ops', type=int, default=20, help='Cart operations per user.')
+        parser.add_argument('--products', type=int, default=50)
+        parser.add_argument('--cache', default='default', help='CACHES alias for the cache backend.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        run = uuid.uuid4().hex[:8]
+        category = Category.objects.create(name=f'bench-{run}')
+        products = Product.objects.bulk_create([
+            Product(name=f'Bench product {run} {index}', description='', price=10, stock=10 ** 6, category=category)
+            for index in range(options['products'])
+        ])
+        users = []
+        try:
+            for number, backend_path in enumerate(BACKENDS):
+                User.objects.bulk_create([
+                    User(username=f'bench-{run}-{number}-{index}', password='!') for index in range(options['users'])
+                ])
+                users = list(User.objects.filter(username__startswith=f'bench-{run}-{number}-'))
+                Cart.objects.bulk_create([Cart(user=user) for user in users])
+                conf = {'BACKEND': backend_path, 'CACHE': options['cache']}
+                with override_settings(CART_STORAGE=conf):
+                    self.bench(backend_path, users, products, options)
+                User.objects.filter(pk__in=[user.pk for user in users]).delete()
+                users = []
+        finally:
+            Job.objects.filter(name='carts.persist', payload__user_id__in=[user.pk for user in users]).delete()
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+            Product.objects.filter(category=category).delete()
+            category.delete()
+
+    def bench(self, backend_path, users, products, options):
+        backend = get_backend()
+        rng = random.Random(options['seed'])
+        operations = 0
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            started = time.perf_counter()
+            for user in users:
+                for _ in range(options['ops']):
+                    operations += 1
+                    roll = rng.random()
+                    if roll < 0.4:
+                        product = rng.choice(products)
+                        item = backend.get_item(user, product=product) or CartItem(product=product, quantity=0)
+                        item.quantity += 1
+                        backend.save_item(user, item)
+                    elif roll < 0.6:
+                        cart = backend.get_cart(user)
+                        items = list(cart.items.all())
+                        if items:
+                            item = rng.choice(items)
+                            item = backend.get_item(user, item_id=item.pk)
+                            item.quantity += 1
+                            backend.save_item(user, item)
+                    elif roll < 0.9:
+                        cart = backend.get_cart(user)
+                        sum(item.product.price * item.quantity for item in cart.items.all())
+                    elif roll < 0.97:
+                        cart = backend.get_cart(user)
+                        items = list(cart.items.all())
+                        if items:
+                            backend.delete_item(user, rng.choice(items).pk)
+                    else:
+                        backend.clear(user)
+            elapsed = time.perf_counter() - started
+
+        # What the write-behind jobs (or checkout) later cost
+        persist_counter = QueryCounter()
+        with connection.execute_wrapper(persist_counter):
+            started = time.perf_counter()
+            for user in users:
+                backend.persist(user)
+            persist_elapsed = time.perf_counter() - started
+        Job.objects.filter(name='carts.persist', payload__user_id__in=[user.pk for user in users]).delete()
+
+        self.stdout.write(self.style.MIGRATE_HEADING(backend_path))
+        self.stdout.write(
+            f'  {operations} operations in {elapsed:.2f}s: {operations / elapsed:,.0f} ops/s, '
+            f'{counter.queries / operations:.2f} queries/op, {counter.writes / operations:.2f} writes/op'
+        )
+        self.stdout.write(
+            f'  persisting {len(users)} carts: {persist_elapsed:.2f}s, '
+            f'{persist_counter.queries} queries, {persist_counter.writes} writes'
+        )
@@ -0,0 +1,83 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.http import QueryDict
+from django.test.utils import CaptureQueriesContext
+
+from ecommerce.facets import ProductFilter, compute_facets, facet_counts
+from ecommerce.models import Category, Product
+
+QUERIES = [
+    '',
+    'in_stock=true',
+    'category_id=1,2,3&price=25-50,50-100',
+    'price=100-250&in_stock=true&created_within=30',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark facet count latency. Products are generated when the catalog is smaller '
+        'than --products, inside a transaction that is rolled back at the end.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=500000)
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.populate(options['products'], options['categories'], options['seed'])
+            self.stdout.write(f'Catalog: {Product.objects.count()} products, {Category.objects.count()} categories')
+            try:
+                for query in QUERIES:
+                    self.bench(ProductFilter(QueryDict(query)), query, options['runs'])
+            finally:
+                # Neither the generated rows nor the counts cached for them outlive the run
+                for query in QUERIES:
+                    cache.delete(ProductFilter(QueryDict(query)).cache_key())
+                transaction.set_rollback(True)
+
+    def bench(self, product_filter, query, runs):
+        timings = []
+        for _ in range(runs):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                compute_facets(product_filter)
+                timings.append(time.perf_counter() - started)
+        facet_counts(product_filter)
+        started = time.perf_counter()
+        facet_counts(product_filter)
+        cached = time.perf_counter() - started
+        self.stdout.write(
+            f"{query or '(no filters)':50} computed: median {statistics.median(timings) * 1000:8.1f} ms "
+            f"({len(queries.captured_queries)} query)  cached: {cached * 1000:6.2f} ms"
+        )
+
+    def populate(self, products, categories, seed):
+        rng = random.Random(seed)
+        existing = Category.objects.count()
+        Category.objects.bulk_create([
+            Category(name=f'Bench category {index}') for index in range(existing, categories)
+        ])
+        category_ids = list(Category.objects.values_list('pk', flat=True))
+        missing = products - Product.objects.count()
+        batch_size = 5000
+        for start in range(0, max(missing, 0), batch_size):
+            Product.objects.bulk_create([
+                Product(
+                    name=f'Bench product {start + index}',
+                    description='',
+                    price=Decimal(rng.randint(100, 200000)) / 100,
+                    stock=rng.choice([0, rng.randint(1, 500)]),
+                    category_id=rng.choice(category_ids),
+                )
+                for index in range(min(batch_size, missing - start))
+            ])
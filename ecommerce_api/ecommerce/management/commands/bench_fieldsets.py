@@ -0,0 +1,67 @@
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+
+from ecommerce.models import Cart, CartItem, Category, Order, OrderItem, Product, Wishlist
+
+URLS = [
+    '/api/products/filter/?category_id={category}',
+    '/api/products/filter/?category_id={category}&fields=id,name,price',
+    '/api/wishlist/',
+    '/api/wishlist/?fields=id,product.name,product.price',
+    '/api/cart/',
+    '/api/cart/?fields=total_amount,items.quantity,items.product.name',
+    '/api/orders/history/',
+    '/api/orders/history/?fields=id,status,total_amount,items.product.name',
+]
+
+
+class Command(BaseCommand):
+    help = 'Compare payload size and query count of full and sparse (?fields=) responses.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=50, help='Products in the cart, wishlist and each order.')
+        parser.add_argument('--orders', type=int, default=10)
+        parser.add_argument('--keep', action='store_true', help='Keep the generated rows.')
+
+    def handle(self, *args, **options):
+        run = uuid.uuid4().hex[:8]
+        user = User.objects.create_user(f'bench-{run}', password='!')
+        category = Category.objects.create(name=f'bench-{run}')
+        products = Product.objects.bulk_create([
+            Product(name=f'Bench product {run} {index}', description='Lorem ipsum ' * 40, price=10, stock=100,
+                    category=category)
+            for index in range(options['items'])
+        ])
+        cart, _ = Cart.objects.get_or_create(user=user)
+        CartItem.objects.bulk_create([CartItem(cart=cart, product=product, quantity=2) for product in products])
+        Wishlist.objects.bulk_create([Wishlist(user=user, product=product) for product in products])
+        for _ in range(options['orders']):
+            order = Order.objects.create(user=user, total_amount=10 * len(products), status='pending')
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, quantity=1, price=product.price) for product in products
+            ])
+
+        client = APIClient()
+        client.force_authenticate(user)
+        rest_framework = {'DEFAULT_THROTTLE_CLASSES': [], 'DEFAULT_PAGINATION_CLASS': None}
+        try:
+            with override_settings(REST_FRAMEWORK=rest_framework, ALLOWED_HOSTS=['testserver']):
+                for url in URLS:
+                    url = url.format(category=category.pk)
+                    with CaptureQueriesContext(connection) as queries:
+                        response = client.get(url)
+                    self.stdout.write(
+                        f"{url:70} {response.status_code} {len(response.content):>9,} bytes "
+                        f"{len(queries.captured_queries):>3} queries"
+                    )
+        finally:
+            if not options['keep']:
+                Order.objects.filter(user=user).delete()
+                Product.objects.filter(category=category).delete()
+                category.delete()
+                user.delete()
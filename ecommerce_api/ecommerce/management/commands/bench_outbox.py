@@ -0,0 +1,98 @@
+import os
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+
+from ecommerce.models import OutboxCursor, OutboxEvent
+from ecommerce.outbox import Dispatcher
+
+
+class NullSink:
+    """Accepts everything; measures the dispatcher's own cost."""
+
+    def deliver(self, events):
+        pass
+
+
+class AcceptHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Measure outbox publish cost and dispatcher throughput into null, file and local HTTP sinks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=100000)
+        parser.add_argument('--batch-size', type=int, action='append', help="Repeatable; defaults to 100 and 500.")
+        parser.add_argument('--publish', type=int, default=1000, help='Single-event transactions to time.')
+
+    def handle(self, *args, **options):
+        run = uuid.uuid4().hex[:8]
+        topic = f'bench.{run}'
+        server = ThreadingHTTPServer(('127.0.0.1', 0), AcceptHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        directory = tempfile.mkdtemp()
+        try:
+            started = time.perf_counter()
+            for number in range(options['publish']):
+                with transaction.atomic():
+                    OutboxEvent.objects.publish(topic, number, {'order_id': number, 'status': 'processing'})
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"publish: {elapsed / options['publish'] * 1000:.2f} ms per event in its own transaction")
+
+            started = time.perf_counter()
+            for start in range(options['publish'], options['events'], 1000):
+                OutboxEvent.objects.publish_many(topic, [
+                    (number, {'order_id': number, 'status': 'processing', 'previous_status': 'pending'})
+                    for number in range(start, min(start + 1000, options['events']))
+                ])
+            self.stdout.write(f"queued {options['events']:,} events in {time.perf_counter() - started:.1f}s")
+            started = time.perf_counter()
+            OutboxEvent.objects.sequence()
+            self.stdout.write(f"numbered them in commit order in {time.perf_counter() - started:.1f}s")
+            first = OutboxEvent.objects.filter(topic=topic).order_by('position').values_list('position', flat=True).first()
+
+            sinks = {
+                'null': {'BACKEND': f'{__name__}.NullSink'},
+                'file': {'BACKEND': 'ecommerce.outbox.FileSink', 'PATH': os.path.join(directory, 'events.jsonl')},
+                'http': {'BACKEND': 'ecommerce.outbox.HTTPSink', 'URL': f'http://127.0.0.1:{server.server_port}/'},
+            }
+            for batch_size in options['batch_size'] or [100, 500]:
+                for name, sink in sinks.items():
+                    self.bench(name, f'bench-{run}-{name}-{batch_size}', sink, batch_size, first, options['events'])
+        finally:
+            server.shutdown()
+            OutboxCursor.objects.filter(sink__startswith=f'bench-{run}-').delete()
+            OutboxEvent.objects.filter(topic=topic).delete()
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+            os.rmdir(directory)
+
+    def bench(self, label, name, sink, batch_size, first, events):
+        OutboxCursor.objects.create(sink=name, position=first - 1)
+        with override_settings(OUTBOX={'SINKS': {name: sink}}):
+            dispatcher = Dispatcher(batch_size=batch_size)
+            delivered = 0
+            started = time.perf_counter()
+            while delivered < events:
+                handled = dispatcher.run_once()
+                if not handled:
+                    break
+                delivered += handled
+            elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'  {label:5} batch {batch_size:5}: {delivered:,} events in {elapsed:.2f}s, '
+            f'{delivered / elapsed:,.0f} events/s'
+        )
@@ -0,0 +1,109 @@
+import resource
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+
+from ecommerce import recommendations
+from ecommerce.models import Order, Product
+
+np = recommendations.np
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the co-occurrence build and top-K ranking on synthetic order items, or with --database on the order '
+        'items in the database, read the way update() reads them. Writing the recommendations is not timed; '
+        'build_recommendations --full reports the time of every step of a real rebuild.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=10_000_000)
+        parser.add_argument('--products', type=int, default=200_000)
+        parser.add_argument('--basket', type=float, default=4.0, help='Mean items per order.')
+        parser.add_argument('--cluster', type=int, default=1000, help='Products per group bought together.')
+        parser.add_argument('--orders-per-chunk', type=int, help="Defaults to RECOMMENDATIONS['ORDERS_PER_CHUNK'].")
+        parser.add_argument('--top-k', type=int, help="Defaults to RECOMMENDATIONS['TOP_K'].")
+        parser.add_argument('--increment', type=float, default=0.01, help='Share of new orders for the incremental step.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--database', action='store_true',
+            help='Read the order items from the database instead of generating them; nothing is written.',
+        )
+
+    def handle(self, *args, **options):
+        if not recommendations.available():
+            raise CommandError('Recommendations need numpy and scipy: pip install numpy scipy')
+        conf = recommendations.recommendation_settings()
+        orders_per_chunk = options['orders_per_chunk'] or conf['ORDERS_PER_CHUNK']
+        top_k = options['top_k'] or conf['TOP_K']
+        started = time.perf_counter()
+        if options['database']:
+            order_ids, product_ids = self.read(orders_per_chunk)
+            size = (Product.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+        else:
+            order_ids, product_ids = self.generate(options)
+            size = options['products'] + 1
+        orders = np.count_nonzero(np.diff(order_ids)) + 1
+        step = 'read' if options['database'] else 'generate'
+        self.report(step, started, f'{len(order_ids):,} items in {orders:,} orders')
+
+        span = order_ids[-1] + 1 - order_ids[0]
+        split = np.searchsorted(order_ids, order_ids[-1] + 1 - int(span * options['increment']))
+
+        started = time.perf_counter()
+        counts = recommendations.accumulate(None, self.chunks(order_ids[:split], product_ids[:split], orders_per_chunk), size)
+        self.report('count', started, f'{counts.nnz:,} product pairs')
+
+        started = time.perf_counter()
+        rows = np.flatnonzero(np.diff(counts.indptr))
+        ranked = recommendations.top_neighbours(counts, rows, top_k, conf['MIN_COUNT'])
+        self.report('rank', started, f'{len(ranked[0]):,} recommendations for {len(rows):,} products')
+
+        started = time.perf_counter()
+        new_items = order_ids[split:], product_ids[split:]
+        counts = recommendations.accumulate(counts, self.chunks(*new_items, orders_per_chunk), size)
+        rows = np.unique(new_items[1])
+        ranked = recommendations.top_neighbours(counts, rows, top_k, conf['MIN_COUNT'])
+        self.report(
+            'increment', started,
+            f'{len(new_items[0]):,} new items, {len(ranked[0]):,} recommendations for {len(rows):,} products re-ranked',
+        )
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        self.stdout.write(f'peak memory {peak:,.0f} MB')
+
+    def read(self, orders_per_chunk):
+        """Return the order items in the database, read as ``update()`` reads them and sorted by order."""
+        until = Order.objects.aggregate(last=Max('id'))['last'] or 0
+        chunks = list(recommendations.order_item_chunks(0, until, orders_per_chunk))
+        if not sum(len(order_ids) for order_ids, _ in chunks):
+            raise CommandError('There are no order items in the database')
+        order_ids = np.concatenate([order_ids for order_ids, _ in chunks])
+        product_ids = np.concatenate([product_ids for _, product_ids in chunks])
+        order = np.argsort(order_ids, kind='stable')
+        return order_ids[order], product_ids[order]
+
+    def generate(self, options):
+        """Orders of ``1 + Poisson(basket - 1)`` items drawn from one Zipf-weighted group of products each."""
+        rng = np.random.default_rng(options['seed'])
+        sizes = 1 + rng.poisson(options['basket'] - 1, int(options['items'] / options['basket'] * 1.1))
+        sizes = sizes[:np.searchsorted(np.cumsum(sizes), options['items']) + 1]
+        order_ids = np.repeat(np.arange(len(sizes)), sizes)[:options['items']]
+
+        groups = max(1, options['products'] // options['cluster'])
+        group_weights = 1 / np.arange(1, groups + 1)
+        product_weights = 1 / np.arange(1, options['cluster'] + 1) ** 0.8
+        order_groups = rng.choice(groups, size=len(sizes), p=group_weights / group_weights.sum())
+        offsets = rng.choice(options['cluster'], size=len(order_ids), p=product_weights / product_weights.sum())
+        product_ids = 1 + (order_groups[order_ids] * options['cluster'] + offsets) % options['products']
+        return order_ids, product_ids
+
+    def chunks(self, order_ids, product_ids, orders_per_chunk):
+        if not len(order_ids):
+            return
+        bounds = np.searchsorted(order_ids, np.arange(order_ids[0], order_ids[-1] + orders_per_chunk + 1, orders_per_chunk))
+        for low, high in zip(bounds[:-1], bounds[1:]):
+            yield order_ids[low:high], product_ids[low:high]
+
+    def report(self, step, started, detail):
+        self.stdout.write(f'{step:10} {time.perf_counter() - started:8.2f}s  {detail}')
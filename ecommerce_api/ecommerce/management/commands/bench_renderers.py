@@ -0,0 +1,73 @@
+import time
+import tracemalloc
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings
+
+from ecommerce.models import Category, Product
+from ecommerce.renderers import MessagePackRenderer
+
+FORMATS = [
+    ('json', 'application/json'),
+    ('msgpack', 'application/msgpack'),
+    ('ndjson', 'application/x-ndjson'),
+]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark CPU time, bytes on the wire and peak memory per response format on the product list.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=20000)
+        parser.add_argument('--runs', type=int, default=3)
+        parser.add_argument('--keep', action='store_true', help='Keep the generated rows.')
+
+    def handle(self, *args, **options):
+        category = Category.objects.create(name=f'bench-{uuid.uuid4().hex[:8]}')
+        for start in range(0, options['products'], 5000):
+            Product.objects.bulk_create([
+                Product(name=f'Bench product {index}', description='Lorem ipsum dolor sit amet ' * 4,
+                        price=index % 1000 + 0.99, stock=index % 50, category=category)
+                for index in range(start, min(start + 5000, options['products']))
+            ])
+
+        url = f'/api/products/filter/?category_id={category.pk}'
+        client = Client()
+        rest_framework = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_CLASSES': []}
+        try:
+            with override_settings(ALLOWED_HOSTS=['testserver'], REST_FRAMEWORK=rest_framework):
+                for name, media_type in FORMATS:
+                    if name == 'msgpack' and not MessagePackRenderer.available:
+                        self.stdout.write(f'{name:8} skipped, msgpack is not installed')
+                        continue
+                    for encoding in ('identity', 'gzip'):
+                        cpu, size = self.measure(client, url, media_type, encoding, options['runs'])
+                        tracemalloc.start()
+                        self.fetch(client, url, media_type, encoding)
+                        peak = tracemalloc.get_traced_memory()[1]
+                        tracemalloc.stop()
+                        self.stdout.write(
+                            f"{name:8} {encoding:8} cpu {cpu * 1000:8.1f} ms  {size:>12,} bytes  "
+                            f"peak {peak / 2 ** 20:7.1f} MiB"
+                        )
+        finally:
+            if not options['keep']:
+                Product.objects.filter(category=category).delete()
+                category.delete()
+
+    def fetch(self, client, url, media_type, encoding):
+        response = client.get(url, HTTP_ACCEPT=media_type, HTTP_ACCEPT_ENCODING=encoding)
+        if response.streaming:
+            return sum(len(chunk) for chunk in response.streaming_content)
+        return len(response.content)
+
+    def measure(self, client, url, media_type, encoding, runs):
+        timings = []
+        for _ in range(runs):
+            started = time.process_time()
+            size = self.fetch(client, url, media_type, encoding)
+            timings.append(time.process_time() - started)
+        return min(timings), size
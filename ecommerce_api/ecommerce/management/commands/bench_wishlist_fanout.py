@@ -0,0 +1,93 @@
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from ecommerce import jobs
+from ecommerce.models import Category, Job, Notification, Product, Wishlist
+from ecommerce.notifications import notification_settings
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark back-in-stock fan-out for one product wishlisted by many users.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000000)
+        parser.add_argument('--chunk-size', type=int, help='Wishlist rows handled per fan-out job.')
+        parser.add_argument('--insert-batch-size', type=int, default=10000)
+        parser.add_argument('--keep', action='store_true', help='Keep the generated rows.')
+
+    def handle(self, *args, **options):
+        run = uuid.uuid4().hex[:8]
+        batch_size = options['insert_batch_size']
+        category = Category.objects.create(name=f'bench-{run}')
+        product = Product.objects.create(
+            name=f'Bench product {run}', description='', price=100, stock=0, category=category
+        )
+
+        started = time.perf_counter()
+        prefix = f'bench-{run}-'
+        for start in range(0, options['users'], batch_size):
+            end = min(start + batch_size, options['users'])
+            User.objects.bulk_create([User(username=f'{prefix}{i}', password='!') for i in range(start, end)])
+        last_id = 0
+        while True:
+            user_ids = list(
+                User.objects.filter(username__startswith=prefix, pk__gt=last_id)
+                .order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not user_ids:
+                break
+            Wishlist.objects.bulk_create([Wishlist(user_id=user_id, product=product) for user_id in user_ids])
+            last_id = user_ids[-1]
+        self.stdout.write(f"Created {options['users']} wishlist rows in {time.perf_counter() - started:.1f}s")
+
+        conf = notification_settings()
+        if options['chunk_size']:
+            conf['CHUNK_SIZE'] = options['chunk_size']
+        counter = QueryCounter()
+        chunks = 0
+        with override_settings(WISHLIST_NOTIFICATIONS=conf), connection.execute_wrapper(counter):
+            product = Product.objects.get(pk=product.pk)
+            started = time.perf_counter()
+            product.stock = 10
+            product.save()
+            while True:
+                job_ids = list(
+                    Job.objects.filter(name='wishlist.fan_out', status='queued', payload__product_id=product.pk)
+                    .values_list('pk', flat=True)
+                )
+                if not job_ids:
+                    break
+                for job_id in job_ids:
+                    jobs.run_job(job_id)
+                    chunks += 1
+            elapsed = time.perf_counter() - started
+
+        sent = Notification.objects.filter(product=product).count()
+        self.stdout.write(self.style.SUCCESS(
+            f"Fan-out: {sent} notifications in {chunks} chunk(s) of {conf['CHUNK_SIZE']}, "
+            f"{elapsed:.2f}s ({sent / max(elapsed, 1e-9):,.0f}/s), {counter.count} queries "
+            f"({counter.count / max(chunks, 1):.1f} per chunk)"
+        ))
+
+        if not options['keep']:
+            Notification.objects.filter(product=product).delete()
+            Job.objects.filter(name='wishlist.fan_out', payload__product_id=product.pk).delete()
+            Wishlist.objects.filter(product=product).delete()
+            while User.objects.filter(username__startswith=prefix).exists():
+                batch = User.objects.filter(username__startswith=prefix).values_list('pk', flat=True)[:batch_size]
+                User.objects.filter(pk__in=list(batch)).delete()
+            category.delete()
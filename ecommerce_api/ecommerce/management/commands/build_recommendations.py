@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ecommerce import recommendations
+
+
+class Command(BaseCommand):
+    help = 'Add the orders placed since the last run to the co-occurrence matrix and refresh the recommendations.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recount all orders instead of only the new ones.')
+
+    def handle(self, *args, **options):
+        if not recommendations.available():
+            raise CommandError('Recommendations need numpy and scipy: pip install numpy scipy')
+        result = recommendations.update(full=options['full'])
+        if result['orders_until'] <= result['orders_after'] and not result['full']:
+            self.stdout.write('No new orders')
+            return
+        timings = ', '.join(f'{step} {seconds:.2f}s' for step, seconds in result['timings'].items())
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Rebuilt' if result['full'] else 'Updated'} from orders {result['orders_after'] + 1}-{result['orders_until']}: "
+            f"{result['pairs']:,} product pairs, {result['recommendations']:,} recommendations "
+            f"for {result['products']:,} products ({timings})"
+        ))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ecommerce.outbox import Dispatcher, outbox_settings
+
+
+class Command(BaseCommand):
+    help = "Deliver outbox events (order created, status changed) to the sinks in OUTBOX['SINKS']."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Deliver the events that are currently due and exit.')
+        parser.add_argument('--sink', action='append', help='Only deliver to this sink (repeatable).')
+        parser.add_argument('--batch-size', type=int, help='Events per delivery.')
+        parser.add_argument('--poll-interval', type=float, help='Seconds to sleep when no events are waiting.')
+
+    def handle(self, *args, **options):
+        unknown = set(options['sink'] or []) - set(outbox_settings()['SINKS'])
+        if unknown:
+            raise CommandError(f"Unknown sink(s): {', '.join(sorted(unknown))}")
+        dispatcher = Dispatcher(options['sink'], batch_size=options['batch_size'], poll_interval=options['poll_interval'])
+        if not dispatcher.sinks:
+            raise CommandError("No sinks configured in OUTBOX['SINKS']")
+        if options['once']:
+            handled = 0
+            while True:
+                delivered = dispatcher.run_once()
+                if not delivered:
+                    break
+                handled += delivered
+            self.stdout.write(self.style.SUCCESS(f'Handled {handled} event deliveries'))
+            return
+        self.stdout.write(f"Dispatching to {', '.join(dispatcher.sinks)}, press CTRL-C to stop")
+        try:
+            dispatcher.run()
+        except KeyboardInterrupt:
+            dispatcher.stop()
@@ -0,0 +1,461 @@
+import multiprocessing
+import os
+import random
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import timedelta
+
+import django
+from django.apps import apps
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from ecommerce.models import (
+    Address, Cart, CartItem, CatalogChange, Category, Coupon, Order, OrderItem, Product, Wishlist,
+)
+
+ADJECTIVES = ['Classic', 'Compact', 'Deluxe', 'Eco', 'Ergonomic', 'Lightweight', 'Portable', 'Premium', 'Pro',
+              'Rugged', 'Smart', 'Ultra', 'Vintage', 'Wireless']
+NOUNS = ['Backpack', 'Blender', 'Camera', 'Chair', 'Desk Lamp', 'Headphones', 'Jacket', 'Kettle', 'Keyboard',
+         'Monitor', 'Mouse', 'Notebook', 'Phone Case', 'Running Shoes', 'Speaker', 'Sunglasses', 'Watch']
+DEPARTMENTS = ['Books', 'Electronics', 'Fashion', 'Garden', 'Groceries', 'Health', 'Home', 'Kitchen', 'Music',
+               'Office', 'Outdoors', 'Pets', 'Sports', 'Toys']
+FIRST_NAMES = ['Aarav', 'Ana', 'Chen', 'David', 'Fatima', 'Hiro', 'Isabel', 'James', 'Lena', 'Maria', 'Mohammed',
+               'Noah', 'Olga', 'Priya', 'Sofia', 'Tom']
+LAST_NAMES = ['Brown', 'Garcia', 'Ivanova', 'Khan', 'Kim', 'Martin', 'Müller', 'Nguyen', 'Patel', 'Rossi', 'Silva',
+              'Smith', 'Tanaka', 'Wilson']
+CITIES = [('Austin', 'TX'), ('Boston', 'MA'), ('Chicago', 'IL'), ('Denver', 'CO'), ('Miami', 'FL'),
+          ('New York', 'NY'), ('Portland', 'OR'), ('Seattle', 'WA')]
+STREETS = ['Main St', 'Oak Ave', 'Maple Dr', 'Cedar Ln', 'Park Rd', 'Lake View', 'Hill St', 'River Rd']
+# Most orders are old and finished; a few are still moving through fulfilment
+ORDER_STATUSES = [('completed', 45), ('delivered', 20), ('shipped', 5), ('in_transit', 3), ('processing', 4),
+                  ('pending', 5), ('cancelled', 10), ('returned', 4), ('refunded', 2), ('failed', 2)]
+HISTORY = timedelta(days=3 * 365)
+# Tables rows are generated for, keyed by the names used for their ID ranges
+TABLES = {
+    'categories': Category, 'products': Product, 'coupons': Coupon, 'users': User, 'addresses': Address,
+    'carts': Cart, 'cart_items': CartItem, 'wishlists': Wishlist, 'orders': Order, 'order_items': OrderItem,
+}
+SCALES = [
+    ('addresses', 1.5, 'Addresses per user.'),
+    ('cart_items', 1.0, 'Cart items per user (every user has one cart).'),
+    ('wishlists', 4.0, 'Wishlist rows per user.'),
+    ('orders', 3.0, 'Orders per user.'),
+    ('order_items', 3.0, 'Items per order (at least 1).'),
+]
+
+
+def price_for(seed, product_id):
+    # A pure function of the ID so that order items can be priced without reading products back; in cents
+    h = (product_id * 2654435761 + seed * 40503) % 4294967296
+    return 199 + (h % 1000) ** 2 // 10
+
+
+def percentage_for(seed, coupon_id):
+    return 5 + (coupon_id * 7 + seed) % 46
+
+
+def money(cents):
+    return f'{cents // 100}.{cents % 100:02d}'
+
+
+def chunk_counts(plan, users):
+    """Row counts for a chunk of ``users`` users; identical for every full chunk, so ID ranges are known up front."""
+    orders = round(users * plan['orders'])
+    return {
+        'users': users,
+        'addresses': round(users * plan['addresses']),
+        'carts': users,
+        'cart_items': round(users * plan['cart_items']),
+        'wishlists': round(users * plan['wishlists']),
+        'orders': orders,
+        'order_items': max(round(orders * plan['order_items']), orders),
+    }
+
+
+def chunk_rng(plan, kind, index):
+    return random.Random(f"{plan['seed']}:{kind}:{index}")
+
+
+def randoms(rng, count):
+    return [rng.random() for _ in range(count)]
+
+
+def between(rng, low, high, count):
+    """``count`` random integers from ``low`` to ``high`` inclusive."""
+    return rng.choices(range(low, high + 1), k=count)
+
+
+def distinct_pairs(rng, parents, count, products, product_base):
+    # Unique (parent, product) pairs for tables with unique_together constraints
+    count = min(count, len(parents) * products)
+    pairs = set()
+    while len(pairs) < count:
+        missing = count - len(pairs)
+        pairs.update(zip(
+            rng.choices(parents, k=missing), between(rng, product_base + 1, product_base + products, missing)
+        ))
+    return sorted(pairs)
+
+
+def local_now(plan):
+    """``plan['now']`` as a naive datetime in the connection's time zone.
+
+    Generated datetimes are passed as ``isoformat(' ')`` of such values, which
+    is the text Django's SQLite and MySQL backends send for a datetime.
+    """
+    now = plan['now']
+    return timezone.make_naive(now, connection.timezone) if timezone.is_aware(now) else now
+
+
+def between_dates(starts, end, fractions):
+    return [start + (end - start) * fraction for start, fraction in zip(starts, fractions)]
+
+
+def isoformat(values):
+    return [value.isoformat(' ') for value in values]
+
+
+# Set in each worker process by init_worker()
+_write_lock = None
+
+
+def init_worker(lock):
+    global _write_lock
+    if not apps.ready:
+        django.setup()
+    connections.close_all()
+    _write_lock = lock
+
+
+def insert_statement(model, names):
+    """Return the INSERT statement for rows of ``model`` and the values appended to each row.
+
+    Rows are tuples of query parameters for the ``names`` columns (attnames),
+    which skips building model instances and preparing every field per row as
+    bulk_create() does. The other fields get their model default, appended to
+    each row; an auto-incremented primary key is left to the database.
+    """
+    ops = connection.ops
+    given = [model._meta.get_field(name) for name in names]
+    others = [field for field in model._meta.concrete_fields if field not in given and not field.primary_key]
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        ops.quote_name(model._meta.db_table),
+        ', '.join(ops.quote_name(field.column) for field in given + others),
+        ', '.join(['%s'] * (len(given) + len(others))),
+    )
+    return sql, tuple(field.get_db_prep_save(field.get_default(), connection) for field in others)
+
+
+def write(tables, batch_size):
+    """Insert ``(model, names, rows)`` for every table in one transaction, in batches of ``batch_size``."""
+    statements = []
+    for model, names, rows in tables:
+        sql, defaults = insert_statement(model, names)
+        statements.append((sql, [row + defaults for row in rows] if defaults else rows))
+    # Every foreign key points at a row generated before it, so the per-row checks are skipped
+    with _write_lock or nullcontext(), connection.constraint_checks_disabled():
+        with transaction.atomic(), connection.cursor() as cursor:
+            for sql, values in statements:
+                for start in range(0, len(values), batch_size):
+                    cursor.executemany(sql, values[start:start + batch_size])
+    return {model.__name__: len(rows) for model, _, rows in tables}
+
+
+def configure_connection():
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            # Secondary indexes are updated in random order; keep more of their pages in memory (64 MiB)
+            cursor.execute('PRAGMA cache_size = -65536')
+            # SQLite refuses to change the safety level inside a transaction
+            if not connection.in_atomic_block:
+                cursor.execute('PRAGMA synchronous = OFF')
+
+
+def catalog_changes(kind, ids, now):
+    return ('kind', 'object_id', 'operation', 'changed_at'), [(kind, pk, 'upsert', now) for pk in ids]
+
+
+def generate_products(plan, index):
+    configure_connection()
+    rng = chunk_rng(plan, 'products', index)
+    size, base, seed = plan['chunk_size'], plan['base']['products'], plan['seed']
+    start = index * size
+    ids = range(base + start + 1, base + min(start + size, plan['products']) + 1)
+    count = len(ids)
+    now = local_now(plan)
+    created = [now - HISTORY * fraction ** 2 for fraction in randoms(rng, count)]
+    names = zip(rng.choices(ADJECTIVES, k=count), rng.choices(NOUNS, k=count), ids)
+    descriptions = zip(rng.choices(ADJECTIVES, k=count), rng.choices(NOUNS, k=count), ids)
+    stock = [
+        0 if fraction < 0.08 else quantity
+        for fraction, quantity in zip(randoms(rng, count), between(rng, 1, 500, count))
+    ]
+    products = list(zip(
+        ids,
+        [f'{adjective} {noun} {pk}' for adjective, noun, pk in names],
+        [f'{adjective} {noun.lower()} for everyday use. Model {pk}.' for adjective, noun, pk in descriptions],
+        [money(price_for(seed, pk)) for pk in ids],
+        stock,
+        between(rng, plan['base']['categories'] + 1, plan['base']['categories'] + plan['categories'], count),
+        isoformat(created),
+        isoformat(between_dates(created, now, randoms(rng, count))),
+    ))
+    return write([
+        (Product, ('id', 'name', 'description', 'price', 'stock', 'category_id', 'created_at', 'updated_at'), products),
+        (CatalogChange, *catalog_changes('product', ids, now.isoformat(' '))),
+    ], plan['batch_size'])
+
+
+def generate_users(plan, index):
+    configure_connection()
+    rng = chunk_rng(plan, 'users', index)
+    size, base, seed = plan['chunk_size'], plan['base'], plan['seed']
+    now = local_now(plan)
+    start = index * size
+    counts = chunk_counts(plan, min(size, plan['users'] - start))
+    full = chunk_counts(plan, size)
+
+    def first_id(table):
+        return base[table] + index * full[table] + 1
+
+    def ids(table):
+        return range(first_id(table), first_id(table) + counts[table])
+
+    def joined_at(user_ids):
+        return [joined[user_id - user_base] for user_id in user_ids]
+
+    user_ids, user_base = ids('users'), first_id('users')
+    joined = [now - HISTORY * fraction for fraction in randoms(rng, len(user_ids))]
+    users = list(zip(
+        user_ids,
+        [f'user{pk}' for pk in user_ids],
+        [f'user{pk}@example.com' for pk in user_ids],
+        rng.choices(FIRST_NAMES, k=len(user_ids)),
+        rng.choices(LAST_NAMES, k=len(user_ids)),
+        [plan['password']] * len(user_ids),
+        isoformat(joined),
+    ))
+
+    address_ids = ids('addresses')
+    owners = rng.choices(user_ids, k=len(address_ids))
+    has_default = set()
+    addresses = []
+    for pk, user_id, first, last, street, (city, state), postal_code in zip(
+        address_ids, owners, rng.choices(FIRST_NAMES, k=len(owners)), rng.choices(LAST_NAMES, k=len(owners)),
+        rng.choices(STREETS, k=len(owners)), rng.choices(CITIES, k=len(owners)),
+        between(rng, 10000, 99999, len(owners)),
+    ):
+        addresses.append((
+            pk, user_id, f'{first} {last}', f'{pk} {street}', city, state, str(postal_code), 'USA',
+            user_id not in has_default,
+        ))
+        has_default.add(user_id)
+
+    cart_base = first_id('carts') - user_base
+    carts = list(zip([cart_base + user_id for user_id in user_ids], user_ids, isoformat(joined)))
+    pairs = distinct_pairs(rng, [cart[0] for cart in carts], counts['cart_items'], plan['products'], base['products'])
+    cart_items = list(zip(
+        range(first_id('cart_items'), first_id('cart_items') + len(pairs)),
+        [cart_id for cart_id, _ in pairs],
+        [product_id for _, product_id in pairs],
+        between(rng, 1, 3, len(pairs)),
+        isoformat(between_dates(joined_at(cart_id - cart_base for cart_id, _ in pairs), now, randoms(rng, len(pairs)))),
+    ))
+    pairs = distinct_pairs(rng, user_ids, counts['wishlists'], plan['products'], base['products'])
+    wishlists = list(zip(
+        range(first_id('wishlists'), first_id('wishlists') + len(pairs)),
+        [user_id for user_id, _ in pairs],
+        [product_id for _, product_id in pairs],
+        isoformat(between_dates(joined_at(user_id for user_id, _ in pairs), now, randoms(rng, len(pairs)))),
+    ))
+
+    order_ids, order_base = ids('orders'), first_id('orders')
+    item_orders = list(order_ids) + rng.choices(order_ids, k=counts['order_items'] - len(order_ids))
+    item_orders.sort()
+    products = between(rng, base['products'] + 1, base['products'] + plan['products'], len(item_orders))
+    prices = {product_id: price_for(seed, product_id) for product_id in set(products)}
+    price_texts = {product_id: money(price) for product_id, price in prices.items()}
+    subtotals = [0] * len(order_ids)
+    order_items = []
+    for pk, order_id, product_id, quantity in zip(
+        ids('order_items'), item_orders, products, rng.choices((1, 1, 1, 2, 2, 3), k=len(item_orders)),
+    ):
+        subtotals[order_id - order_base] += prices[product_id] * quantity
+        order_items.append((pk, order_id, product_id, quantity, price_texts[product_id]))
+
+    statuses, weights = zip(*ORDER_STATUSES)
+    buyers = rng.choices(user_ids, k=len(order_ids))
+    orders = []
+    for order_id, user_id, subtotal, status, coupon_draw, number, street, (city, state), created in zip(
+        order_ids, buyers, subtotals, rng.choices(statuses, weights, k=len(order_ids)), randoms(rng, len(order_ids)),
+        between(rng, 1, 9999, len(order_ids)), rng.choices(STREETS, k=len(order_ids)),
+        rng.choices(CITIES, k=len(order_ids)),
+        isoformat(between_dates(joined_at(buyers), now, randoms(rng, len(order_ids)))),
+    ):
+        coupon_id, discount = None, 0
+        if plan['coupons'] and coupon_draw < 0.1:
+            coupon_id = base['coupons'] + rng.randint(1, plan['coupons'])
+            discount = (subtotal * percentage_for(seed, coupon_id) + 50) // 100
+        shipping = (subtotal - discount + 5) // 10 if subtotal - discount < 5000 else 0
+        address = f'{number} {street}, {city}, {state}'
+        orders.append((
+            order_id, user_id, status, money(subtotal - discount + shipping), address, address, f'pay_{order_id}',
+            coupon_id, money(discount), created,
+        ))
+
+    return write([
+        (User, ('id', 'username', 'email', 'first_name', 'last_name', 'password', 'date_joined'), users),
+        (Address, ('id', 'user_id', 'name', 'street', 'city', 'state', 'postal_code', 'country', 'is_default'),
+         addresses),
+        (Cart, ('id', 'user_id', 'created_at'), carts),
+        (CartItem, ('id', 'cart_id', 'product_id', 'quantity', 'updated_at'), cart_items),
+        (Wishlist, ('id', 'user_id', 'product_id', 'added_at'), wishlists),
+        (Order, ('id', 'user_id', 'status', 'total_amount', 'shipping_address', 'billing_address',
+                 'payment_reference', 'coupon_id', 'discount_applied', 'created_at'), orders),
+        (OrderItem, ('id', 'order_id', 'product_id', 'quantity', 'price'), order_items),
+    ], plan['batch_size'])
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate reproducible synthetic data for load testing. Rows get explicit IDs after the current '
+        'maximum of each table, so the command can be run on a non-empty database. Every user gets the '
+        'password "password".'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--products', type=int, default=50000)
+        parser.add_argument('--categories', type=int, default=200)
+        parser.add_argument('--coupons', type=int, default=1000)
+        for name, default, help_text in SCALES:
+            parser.add_argument(f"--{name.replace('_', '-')}", type=float, default=default, help=help_text)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Users or products per worker task.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per INSERT batch.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument(
+            '--keep-indexes', action='store_true',
+            help='On SQLite, update indexes row by row even when most rows are new, instead of rebuilding them.',
+        )
+
+    def handle(self, *args, **options):
+        plan = self.plan(options)
+        started = time.perf_counter()
+        totals = {}
+        # A rebuild takes time in proportion to the whole table, so it only pays off when most rows are new
+        new_items = plan['users'] * plan['orders'] * plan['order_items']
+        defer = not options['keep_indexes'] and plan['base']['order_items'] < new_items
+        with self.deferred_indexes() if defer else nullcontext():
+            self.add(totals, self.generate_catalog(plan))
+            # SQLite allows a single writer: workers generate rows in parallel but take turns writing
+            lock = multiprocessing.Lock() if connection.vendor == 'sqlite' else None
+            connections.close_all()
+            with multiprocessing.Pool(options['workers'], initializer=init_worker, initargs=(lock,)) as pool:
+                for counts in pool.imap_unordered(_generate_products, self.tasks(plan, plan['products'])):
+                    self.add(totals, counts)
+                for counts in pool.imap_unordered(_generate_users, self.tasks(plan, plan['users'])):
+                    self.add(totals, counts)
+                    self.stdout.write(f"{totals['User']:,} / {plan['users']:,} users")
+
+        elapsed = time.perf_counter() - started
+        rows = sum(totals.values())
+        for name, count in totals.items():
+            self.stdout.write(f'{name:20} {count:>12,}')
+        self.stdout.write(self.style.SUCCESS(
+            f'{rows:,} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):,.0f} rows/s, {options["workers"]} worker(s))'
+        ))
+
+    def plan(self, options):
+        """Return what every worker needs to generate its chunks: options, ID bases and shared values."""
+        base = {name: model.objects.aggregate(pk=Max('pk'))['pk'] or 0 for name, model in TABLES.items()}
+        plan = {
+            'seed': options['seed'],
+            # Timestamps count back from the start of the day, so a seed reproduces the same rows all day
+            'now': timezone.now().replace(hour=0, minute=0, second=0, microsecond=0),
+            'base': base,
+            'users': options['users'],
+            'products': options['products'],
+            'categories': options['categories'],
+            'coupons': options['coupons'],
+            'chunk_size': options['chunk_size'],
+            'batch_size': options['batch_size'],
+            'password': make_password('password', salt=f"generated{options['seed']}"),
+            **{name: options[name] for name, _, _ in SCALES},
+        }
+        plan['order_items'] = max(plan['order_items'], 1)
+        return plan
+
+    @contextmanager
+    def deferred_indexes(self):
+        """Drop the secondary indexes of the generated tables on SQLite, and rebuild them on exit.
+
+        Building an index over the loaded rows is several times faster than
+        updating it for every row. The primary keys and the unique constraints
+        declared on the tables themselves stay in place; the other unique
+        indexes only hold again once they are rebuilt.
+        """
+        if connection.vendor != 'sqlite':
+            yield
+            return
+        tables = [model._meta.db_table for model in [*TABLES.values(), CatalogChange]]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN (%s)"
+                % ', '.join(['%s'] * len(tables)),
+                tables,
+            )
+            indexes = cursor.fetchall()
+            for name, _ in indexes:
+                cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
+        try:
+            yield
+        finally:
+            started = time.perf_counter()
+            with connection.cursor() as cursor:
+                for _, sql in indexes:
+                    cursor.execute(sql)
+            self.stdout.write(f'Rebuilt {len(indexes)} indexes in {time.perf_counter() - started:.1f}s')
+
+    def generate_catalog(self, plan):
+        configure_connection()
+        rng = chunk_rng(plan, 'catalog', 0)
+        now, base = local_now(plan), plan['base']
+        category_ids = range(base['categories'] + 1, base['categories'] + plan['categories'] + 1)
+        categories = [
+            (pk, f'{DEPARTMENTS[pk % len(DEPARTMENTS)]} {pk}',
+             f'Everything for {DEPARTMENTS[pk % len(DEPARTMENTS)].lower()}', now.isoformat(' '))
+            for pk in category_ids
+        ]
+        coupons = [
+            (pk, f'SAVE{pk:08d}', str(percentage_for(plan['seed'], pk)), rng.choice([None, '50', '100']),
+             (now + timedelta(days=rng.randint(-365, 365))).isoformat(' '), rng.choice([0, 100, 1000]),
+             rng.random() < 0.9)
+            for pk in range(base['coupons'] + 1, base['coupons'] + plan['coupons'] + 1)
+        ]
+        return write([
+            (Category, ('id', 'name', 'description', 'updated_at'), categories),
+            (Coupon, ('id', 'code', 'discount_percentage', 'max_discount', 'expiry_date', 'max_uses', 'is_active'),
+             coupons),
+            (CatalogChange, *catalog_changes('category', category_ids, now.isoformat(' '))),
+        ], plan['batch_size'])
+
+    def tasks(self, plan, total):
+        return [(plan, index) for index in range((total + plan['chunk_size'] - 1) // plan['chunk_size'])]
+
+    def add(self, totals, counts):
+        for name, count in counts.items():
+            totals[name] = totals.get(name, 0) + count
+
+
+def _generate_products(args):
+    return generate_products(*args)
+
+
+def _generate_users(args):
+    return generate_users(*args)
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ecommerce.housekeeping import POLICIES, housekeeping_settings, run, schedule
+
+
+class Command(BaseCommand):
+    help = 'Purge abandoned cart items, expired coupons and other data past its retention period.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--policy', action='append', choices=POLICIES, help='Only apply this policy (repeatable).')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the rows that would be deleted.')
+        parser.add_argument('--loop', action='store_true', help="Keep running every HOUSEKEEPING['INTERVAL'] seconds.")
+        parser.add_argument('--enqueue', action='store_true', help='Run it in the job worker instead (housekeeping.run).')
+
+    def handle(self, *args, **options):
+        if options['enqueue']:
+            job = schedule()
+            self.stdout.write(self.style.SUCCESS(f'Queued {job}') if job else 'Housekeeping is already queued')
+            return
+
+        while True:
+            started = time.monotonic()
+            report = run(options['policy'], dry_run=options['dry_run'])
+            verb = 'would be deleted' if options['dry_run'] else 'deleted'
+            for name, rows in report.items():
+                self.stdout.write(f'  {name:20} {rows:>10,} {verb}')
+            self.stdout.write(self.style.SUCCESS(
+                f'{sum(report.values()):,} row(s) {verb} in {time.monotonic() - started:.1f}s'
+            ))
+            if not options['loop']:
+                return
+            time.sleep(housekeeping_settings()['INTERVAL'])
@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from ecommerce.catalog import prune_changes
+
+
+class Command(BaseCommand):
+    help = 'Delete catalog change feed entries older than the retention period.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help="Retention in days (defaults to CATALOG_FEED['RETENTION']).")
+
+    def handle(self, *args, **options):
+        older_than = timedelta(days=options['days']) if options['days'] else None
+        deleted = prune_changes(older_than)
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} catalog change(s)'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from ecommerce.jobs import Worker
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs such as payment capture and order fulfilment.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run the jobs that are currently due and exit.')
+        parser.add_argument('--batch-size', type=int, help='Number of jobs claimed per round trip.')
+        parser.add_argument('--poll-interval', type=float, help='Seconds to sleep when the queue is empty.')
+
+    def handle(self, *args, **options):
+        worker = Worker(batch_size=options['batch_size'], poll_interval=options['poll_interval'])
+        if options['once']:
+            processed = worker.run_once()
+            self.stdout.write(self.style.SUCCESS(f'Ran {processed} job(s)'))
+            return
+        self.stdout.write('Worker started, press CTRL-C to stop')
+        try:
+            worker.run()
+        except KeyboardInterrupt:
+            worker.stop()
@@ -0,0 +1,86 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter so that nothing is imported or cached yet
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import django
+django.setup()
+setup = time.perf_counter() - started
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+settings.WARMUP = {**getattr(settings, 'WARMUP', {}), 'ENABLED': False}
+started = time.perf_counter()
+application = import_string(settings.WSGI_APPLICATION)
+load = time.perf_counter() - started
+
+from ecommerce.warmup import get, warm_up
+steps = warm_up(application) if sys.argv[1] == 'warm' else {}
+requests = []
+for path in sys.argv[2:]:
+    timings = []
+    for _ in range(2):
+        started = time.perf_counter()
+        status = get(application, path)
+        timings.append(time.perf_counter() - started)
+    requests.append([path, status, timings])
+print(json.dumps({'setup': setup, 'load': load, 'steps': steps, 'requests': requests}))
+"""
+
+
+class Command(BaseCommand):
+    help = 'Measure import time and first-request latency of a fresh worker, with and without warm-up.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', default=['/api/categories/', '/api/products/facets/'])
+        parser.add_argument('--runs', type=int, default=3, help='Fresh processes per mode; medians are reported.')
+        parser.add_argument('--imports', type=int, default=0, help='Also list the N slowest imports.')
+
+    def handle(self, *args, **options):
+        for mode in ('cold', 'warm'):
+            runs = [self.run_child(mode, options['paths']) for _ in range(options['runs'])]
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{mode} worker'))
+            self.stdout.write(f"  django.setup()        {self.median(runs, 'setup'):8.1f} ms")
+            self.stdout.write(f"  WSGI application      {self.median(runs, 'load'):8.1f} ms")
+            for step in runs[0]['steps']:
+                self.stdout.write(f"  warm-up {step:13} {self.median(runs, 'steps', step):8.1f} ms")
+            for index, (path, status, _) in enumerate(runs[0]['requests']):
+                first = statistics.median(run['requests'][index][2][0] for run in runs) * 1000
+                second = statistics.median(run['requests'][index][2][1] for run in runs) * 1000
+                self.stdout.write(f"  GET {path:40} {status[:3]}  first {first:8.1f} ms  then {second:8.1f} ms")
+
+        if options['imports']:
+            self.stdout.write(self.style.MIGRATE_HEADING('slowest imports (self time)'))
+            for self_us, name in self.import_times(options['paths'])[:options['imports']]:
+                self.stdout.write(f'  {self_us / 1000:8.1f} ms  {name}')
+
+    def run_child(self, mode, paths, *flags):
+        result = subprocess.run(
+            [sys.executable, *flags, '-c', CHILD, mode, *paths],
+            cwd=settings.BASE_DIR, env=os.environ.copy(), capture_output=True, text=True,
+        )
+        if result.returncode:
+            raise CommandError(result.stderr)
+        self.stderr_output = result.stderr
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+    def import_times(self, paths):
+        self.run_child('cold', paths, '-X', 'importtime')
+        times = []
+        for line in self.stderr_output.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_us, _, name = line[len('import time:'):].split('|')
+            times.append((int(self_us), name.strip()))
+        return sorted(times, reverse=True)
+
+    def median(self, runs, key, step=None):
+        return statistics.median(run[key][step] if step else run[key] for run in runs) * 1000
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from ecommerce.models import Order
+from ecommerce.transitions import bulk_transition, filter_orders
+
+
+class Command(BaseCommand):
+    help = 'Move many orders to a new status, e.g. processing -> shipped.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('status', choices=[value for value, _ in Order.STATUS_CHOICES])
+        parser.add_argument('--ids', nargs='+', type=int, help='Order IDs to transition.')
+        parser.add_argument('--from-status', choices=[value for value, _ in Order.STATUS_CHOICES])
+        parser.add_argument('--user-id', type=int)
+        parser.add_argument('--created-after', help='ISO 8601 timestamp.')
+        parser.add_argument('--created-before', help='ISO 8601 timestamp.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        criteria = {
+            'status': options['from_status'],
+            'user_id': options['user_id'],
+            'created_after': self.parse_timestamp(options['created_after']),
+            'created_before': self.parse_timestamp(options['created_before']),
+        }
+        has_filter = any(value is not None for value in criteria.values())
+        if bool(options['ids']) == has_filter:
+            raise CommandError('Provide either --ids or at least one filter option')
+
+        if options['ids']:
+            result = bulk_transition(options['status'], order_ids=options['ids'], batch_size=options['batch_size'])
+        else:
+            result = bulk_transition(
+                options['status'], queryset=filter_orders(**criteria), batch_size=options['batch_size']
+            )
+
+        for rejected in result['rejected']:
+            self.stderr.write(f"Order {rejected['id']}: {rejected['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(result['applied'])} order(s) moved to {options['status']}, {len(result['rejected'])} rejected"
+        ))
+
+    def parse_timestamp(self, value):
+        if value is None:
+            return None
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise CommandError(f'Invalid timestamp: {value}')
+        return parsed
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-19 07:59
+
+from django.db import migrations, models
+from django.db.models import F, Max
+
+
+def number_existing_changes(apps, schema_editor):
+    # Cursors handed out so far are sequence numbers; keep them valid as positions
+    CatalogChange = apps.get_model('ecommerce', 'CatalogChange')
+    FeedSequence = apps.get_model('ecommerce', 'FeedSequence')
+    CatalogChange.objects.update(position=F('seq'))
+    last = CatalogChange.objects.aggregate(last=Max('seq'))['last'] or 0
+    FeedSequence.objects.create(name='ecommerce.catalogchange', position=last)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0010_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedSequence',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('position', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='catalogchange',
+            name='position',
+            field=models.PositiveBigIntegerField(blank=True, null=True, unique=True),
+        ),
+        migrations.RunPython(number_existing_changes, migrations.RunPython.noop),
+    ]
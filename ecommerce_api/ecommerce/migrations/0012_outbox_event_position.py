@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-19 09:10
+
+from django.db import migrations, models
+from django.db.models import F, Max
+
+
+def number_existing_events(apps, schema_editor):
+    # Sink cursors hold event IDs so far; keep them valid as positions
+    OutboxEvent = apps.get_model('ecommerce', 'OutboxEvent')
+    FeedSequence = apps.get_model('ecommerce', 'FeedSequence')
+    OutboxEvent.objects.update(position=F('id'))
+    last = OutboxEvent.objects.aggregate(last=Max('id'))['last'] or 0
+    FeedSequence.objects.create(name='ecommerce.outboxevent', position=last)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0011_catalog_change_position'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxevent',
+            name='position',
+            field=models.PositiveBigIntegerField(blank=True, null=True, unique=True),
+        ),
+        migrations.RunPython(number_existing_events, migrations.RunPython.noop),
+    ]
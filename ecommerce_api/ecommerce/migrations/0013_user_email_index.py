@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-19 10:05
+
+from django.db import migrations
+
+INDEX = 'ecommerce_user_email_idx'
+
+
+def add_index(apps, schema_editor):
+    # The user admin searches emails by exact match, and auth_user has no index on them
+    quote = schema_editor.quote_name
+    schema_editor.execute(f"CREATE INDEX {quote(INDEX)} ON {quote('auth_user')} ({quote('email')})")
+
+
+def remove_index(apps, schema_editor):
+    quote = schema_editor.quote_name
+    schema_editor.execute(schema_editor.sql_delete_index % {'name': quote(INDEX), 'table': quote('auth_user')})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('ecommerce', '0012_outbox_event_position'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_index, remove_index),
+    ]
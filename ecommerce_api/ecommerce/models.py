@@ -1,28 +1,66 @@
 # ecommerce/models.py
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
-from django.db.models import F
+from django.db.models import F, Case, When, Value, Sum
+from .signals import products_restocked
 
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
 
+class ProductQuerySet(models.QuerySet):
+    def add_stock(self, quantities):
+        """Add ``{product_id: quantity}`` to stock with a single UPDATE."""
+        if not quantities:
+            return 0
+        increments = Case(
+            *[When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()],
+            default=Value(0),
+            output_field=models.PositiveIntegerField(),
+        )
+        replenished = []
+        if products_restocked.has_listeners(self.model):
+            replenished = list(self.filter(pk__in=list(quantities), stock=0).values_list('pk', flat=True))
+        updated = self.filter(pk__in=list(quantities)).update(
+            stock=F('stock') + increments, updated_at=timezone.now()
+        )
+        products_restocked.send(sender=self.model, quantities=quantities, replenished=replenished)
+        return updated
+
 class Product(models.Model):
-    name = models.CharField(max_length=200)
+    name = models.CharField(max_length=200, db_index=True)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.PositiveIntegerField()
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     image = models.ImageField(upload_to='products/', blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ProductQuerySet.as_manager()
+
+    # Values remembered on load so saves can tell what changed
+    TRACKED_FIELDS = ('price', 'stock')
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {
+            name: getattr(instance, name) for name in cls.TRACKED_FIELDS if name in field_names
+        }
+        return instance
+
+    class Meta:
+        indexes = [models.Index(fields=['category', 'price', 'stock', 'created_at'], name='product_facet_idx')]
+
 class Coupon(models.Model):
     code = models.CharField(max_length=50, unique=True)
     discount_percentage = models.DecimalField(max_digits=5, decimal_places=2)
@@ -61,23 +99,36 @@ class Address(models.Model):
 class Wishlist(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
-    added_at = models.DateTimeField(auto_now_add=True)
+    added_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     class Meta:
         unique_together = ('user', 'product')
+        indexes = [models.Index(fields=['product', 'id'], name='wishlist_product_scan_idx')]
 
 class Cart(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         unique_together = ('cart', 'product')
 
+class OrderQuerySet(models.QuerySet):
+    def restock(self):
+        """Return the stock held by these orders to their products with one aggregated UPDATE."""
+        quantities = dict(
+            OrderItem.objects.filter(order__in=self)
+            .values('product_id')
+            .annotate(total=Sum('quantity'))
+            .values_list('product_id', 'total')
+        )
+        return Product.objects.add_stock(quantities)
+
 class Order(models.Model):
     STATUS_CHOICES = (
         ('pending', 'Pending'),
@@ -96,13 +147,278 @@ class Order(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     shipping_address = models.TextField(blank=True)
     billing_address = models.TextField(blank=True)
-    payment_reference = models.CharField(max_length=100, blank=True, null=True)
+    payment_reference = models.CharField(max_length=100, blank=True, null=True, db_index=True)
     coupon = models.ForeignKey(Coupon, on_delete=models.SET_NULL, null=True, blank=True)
     discount_applied = models.DecimalField(max_digits=10, decimal_places=2, default=0)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    objects = OrderQuerySet.as_manager()
+
+    # Orders in these statuses hold stock taken from their products at checkout
+    STOCK_HOLDING_STATUSES = ['pending', 'processing', 'shipped', 'in_transit', 'delivered', 'completed']
+    # Moving a stock-holding order to one of these statuses puts its stock back
+    RESTOCK_STATUSES = ['cancelled', 'returned', 'failed']
+
+    # Statuses that no longer hold stock; an order in one of them can't take its
+    # stock again, so it may not move back to a stock-holding status
+    RELEASED_STATUSES = ['cancelled', 'returned', 'refunded', 'failed']
+
+    # Statuses an order may not move from when changing to the key status
+    INVALID_TRANSITIONS = {
+        'pending': RELEASED_STATUSES,
+        'processing': RELEASED_STATUSES,
+        'shipped': RELEASED_STATUSES,
+        'in_transit': RELEASED_STATUSES,
+        'delivered': ['pending', 'processing', *RELEASED_STATUSES],
+        'completed': ['pending', 'processing', *RELEASED_STATUSES],
+        'cancelled': ['delivered', 'completed', 'returned', 'refunded'],
+        'returned': ['pending', 'processing', 'cancelled', 'refunded'],
+        'refunded': ['pending', 'processing', 'cancelled'],
+        'failed': ['delivered', 'completed'],
+    }
+
+    @classmethod
+    def can_transition(cls, current_status, new_status):
+        return current_status not in cls.INVALID_TRANSITIONS.get(new_status, [])
+
+    @classmethod
+    def allowed_sources(cls, new_status):
+        return [
+            current_status for current_status, _ in cls.STATUS_CHOICES
+            if current_status != new_status and cls.can_transition(current_status, new_status)
+        ]
+
+    def transition(self, new_status, sources=None):
+        """Move the order to ``new_status`` if it is still in one of ``sources``.
+
+        The change is a single conditional UPDATE on the status column, so when
+        two requests race only one of them succeeds. Stock held by the order is
+        returned when it moves to one of ``RESTOCK_STATUSES``, and an
+        ``order.status_changed`` event is published in the same transaction.
+        Returns whether this call changed the status; on failure ``status`` is
+        refreshed.
+        """
+        if sources is None:
+            sources = self.allowed_sources(new_status)
+        orders = Order.objects.filter(pk=self.pk)
+        with transaction.atomic():
+            if new_status in self.RESTOCK_STATUSES:
+                held = [value for value in sources if value in self.STOCK_HOLDING_STATUSES]
+                released = [value for value in sources if value not in held]
+                updated = held and orders.filter(status__in=held).update(status=new_status)
+                if updated:
+                    orders.restock()
+                    sources = held
+                elif released:
+                    updated = orders.filter(status__in=released).update(status=new_status)
+                    sources = released
+            else:
+                updated = orders.filter(status__in=sources).update(status=new_status)
+            if updated:
+                OutboxEvent.objects.publish('order.status_changed', self.pk, {
+                    'order_id': self.pk,
+                    'status': new_status,
+                    # Only known for sure when a single source status could match
+                    'previous_status': sources[0] if len(sources) == 1 else None,
+                })
+
+        if updated:
+            self.status = new_status
+        else:
+            self.refresh_from_db(fields=['status'])
+        return bool(updated)
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
+
+class Job(models.Model):
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_at'])]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk}"
+
+class Notification(models.Model):
+    KIND_CHOICES = (
+        ('back_in_stock', 'Back in stock'),
+        ('price_drop', 'Price drop'),
+    )
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    message = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at']),
+            models.Index(fields=['product', 'kind', 'created_at']),
+        ]
+
+    def __str__(self):
+        return self.message
+
+class FeedSequence(models.Model):
+    """The last position handed out in a feed; its row lock orders ``FeedQuerySet.sequence()`` calls."""
+    name = models.CharField(max_length=100, primary_key=True)
+    position = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} at {self.position}"
+
+class FeedQuerySet(models.QuerySet):
+    """Rows of a feed that readers page through in commit order.
+
+    Primary keys are handed out on insert, so a reader paging by key can pass a
+    key whose transaction commits later and then never see that row. Rows are
+    instead given a ``position`` once they are committed, by ``sequence()``
+    under a lock on the feed's ``FeedSequence`` row: positions have no gaps and
+    a position only becomes visible after all the lower ones.
+    """
+    def last_position(self):
+        """Return the last position handed out, without taking any lock."""
+        name = self.model._meta.label_lower
+        return FeedSequence.objects.using(self.db).filter(name=name).values_list('position', flat=True).first() or 0
+
+    def sequence(self, batch_size=1000):
+        """Number the committed rows that have no position yet and return the last position.
+
+        The feed's lock is only taken when there is something to number, so
+        callers that find every row numbered stay read-only.
+        """
+        if not self.filter(position__isnull=True).exists():
+            return self.last_position()
+        name = self.model._meta.label_lower
+        while True:
+            with transaction.atomic(using=self.db):
+                counter = FeedSequence.objects.using(self.db).select_for_update().get_or_create(name=name)[0]
+                # Rows locked by a transaction that is still open are left for a later call
+                ids = list(
+                    self.select_for_update(skip_locked=True).filter(position__isnull=True)
+                    .order_by('pk').values_list('pk', flat=True)[:batch_size]
+                )
+                if ids:
+                    # One UPDATE per run of consecutive keys, which is usually the whole batch
+                    start = 0
+                    for end in range(1, len(ids) + 1):
+                        if end == len(ids) or ids[end] != ids[end - 1] + 1:
+                            self.filter(pk__gte=ids[start], pk__lte=ids[end - 1]).update(
+                                position=F('pk') + (counter.position + 1 - ids[start])
+                            )
+                            counter.position += end - start
+                            start = end
+                    counter.save(update_fields=['position'])
+            if len(ids) < batch_size:
+                return counter.position
+
+class CatalogChange(models.Model):
+    KIND_CHOICES = (
+        ('product', 'Product'),
+        ('category', 'Category'),
+    )
+    OPERATION_CHOICES = (
+        ('upsert', 'Upsert'),
+        ('delete', 'Delete'),
+    )
+    seq = models.BigAutoField(primary_key=True)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    operation = models.CharField(max_length=10, choices=OPERATION_CHOICES)
+    changed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    # Commit order, assigned by CatalogChange.objects.sequence(); the feed cursor
+    position = models.PositiveBigIntegerField(null=True, blank=True, unique=True)
+
+    objects = FeedQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.seq}: {self.operation} {self.kind} {self.object_id}"
+
+class ArchivedOrder(models.Model):
+    """A finished order moved out of the live tables by ``ecommerce.archive``.
+
+    Keeps the original order ID. Items are stored inline as a JSON list, with the
+    product name as it was when the order was archived.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    items = models.JSONField(default=list)
+    shipping_address = models.TextField(blank=True)
+    billing_address = models.TextField(blank=True)
+    payment_reference = models.CharField(max_length=100, blank=True, null=True, db_index=True)
+    coupon_code = models.CharField(max_length=50, blank=True)
+    discount_applied = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'created_at'])]
+
+    def __str__(self):
+        return f"Archived order {self.id}"
+
+class ProductRecommendation(models.Model):
+    """One of the top neighbours of ``product``, precomputed by ``ecommerce.recommendations``."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('product', 'rank')
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.recommended_id} (#{self.rank})"
+
+class OutboxEventQuerySet(FeedQuerySet):
+    def publish(self, topic, key, payload):
+        """Record an event; call it inside the transaction that makes the change it describes."""
+        return self.create(topic=topic, key=str(key), payload=payload)
+
+    def publish_many(self, topic, events):
+        """Record ``(key, payload)`` events of one topic with a single INSERT."""
+        return self.bulk_create([OutboxEvent(topic=topic, key=str(key), payload=payload) for key, payload in events])
+
+class OutboxEvent(models.Model):
+    """An event for downstream systems, delivered by ``ecommerce.outbox`` in ``position`` order."""
+    topic = models.CharField(max_length=100)
+    key = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    # Commit order, assigned by OutboxEvent.objects.sequence(); the sinks' cursor
+    position = models.PositiveBigIntegerField(null=True, blank=True, unique=True)
+
+    objects = OutboxEventQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.id}: {self.topic} {self.key}"
+
+class OutboxCursor(models.Model):
+    """The position of the last event ``ecommerce.outbox`` delivered to a sink."""
+    sink = models.CharField(max_length=100, primary_key=True)
+    position = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.sink} at {self.position}"
@@ -0,0 +1,150 @@
+"""Back-in-stock and price-drop notifications for wishlisted products.
+
+Product changes are detected on save (against the values loaded from the
+database) and on bulk restocks (``products_restocked``). Each change queues a
+``wishlist.fan_out`` job which walks the product's wishlist rows in primary key
+order, one chunk per job, so a product wishlisted by millions of users never
+turns into one long transaction. Recipients are deduplicated and rate limited
+per user before the notifications are stored and handed to the configured sink.
+"""
+import json
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import Count
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import jobs
+from .conf import get_settings
+from .models import Notification, Product, Wishlist
+from .signals import products_restocked
+
+DEFAULTS = {
+    'SINK': 'ecommerce.notifications.DatabaseSink',
+    'FILE_PATH': 'notifications.jsonl',
+    'CHUNK_SIZE': 1000,
+    'DEDUPE_WINDOW': timedelta(days=1),
+    'RATE_LIMIT': 5,
+    'RATE_WINDOW': timedelta(days=1),
+}
+
+
+def notification_settings():
+    return get_settings('WISHLIST_NOTIFICATIONS', DEFAULTS)
+
+
+class DatabaseSink:
+    """Keeps the stored Notification rows as the users' inbox."""
+
+    def deliver(self, notifications):
+        pass
+
+
+class FileSink:
+    """Appends one JSON object per notification to ``FILE_PATH``."""
+
+    def __init__(self, path=None):
+        self.path = path or notification_settings()['FILE_PATH']
+
+    def deliver(self, notifications):
+        with open(self.path, 'a', encoding='utf-8') as stream:
+            for notification in notifications:
+                stream.write(json.dumps({
+                    'user_id': notification.user_id,
+                    'product_id': notification.product_id,
+                    'kind': notification.kind,
+                    'message': notification.message,
+                    'created_at': notification.created_at.isoformat(),
+                }) + '\n')
+
+
+def get_sink():
+    return import_string(notification_settings()['SINK'])()
+
+
+def build_message(product, kind, old_price=None, new_price=None):
+    if kind == 'back_in_stock':
+        return f"{product.name} is back in stock"
+    return f"{product.name} dropped in price from {old_price} to {new_price}"
+
+
+def notify_users(product, kind, user_ids, old_price=None, new_price=None):
+    """Store and deliver notifications for ``user_ids``, skipping duplicates and users over their rate limit."""
+    conf = notification_settings()
+    now = timezone.now()
+    notified = set(
+        Notification.objects.filter(
+            product=product, kind=kind, user_id__in=user_ids, created_at__gte=now - conf['DEDUPE_WINDOW']
+        ).values_list('user_id', flat=True)
+    )
+    recent_counts = dict(
+        Notification.objects.filter(user_id__in=user_ids, created_at__gte=now - conf['RATE_WINDOW'])
+        .values('user_id')
+        .annotate(total=Count('id'))
+        .values_list('user_id', 'total')
+    )
+    message = build_message(product, kind, old_price, new_price)
+    notifications = Notification.objects.bulk_create([
+        Notification(user_id=user_id, product=product, kind=kind, message=message, created_at=now)
+        for user_id in user_ids
+        if user_id not in notified and recent_counts.get(user_id, 0) < conf['RATE_LIMIT']
+    ])
+    get_sink().deliver(notifications)
+    return notifications
+
+
+@jobs.register('wishlist.fan_out')
+def fan_out(product_id, kind, after_id=0, old_price=None, new_price=None):
+    chunk_size = notification_settings()['CHUNK_SIZE']
+    rows = list(
+        Wishlist.objects.filter(product_id=product_id, pk__gt=after_id)
+        .order_by('pk')
+        .values_list('pk', 'user_id')[:chunk_size]
+    )
+    if not rows:
+        return
+    product = Product.objects.only('name').get(pk=product_id)
+    notify_users(product, kind, [user_id for _, user_id in rows], old_price, new_price)
+    if len(rows) == chunk_size:
+        jobs.enqueue('wishlist.fan_out', {
+            'product_id': product_id, 'kind': kind, 'after_id': rows[-1][0],
+            'old_price': old_price, 'new_price': new_price,
+        })
+
+
+def is_plain_value(value):
+    # F() expressions assigned before save() have no comparable value
+    return not hasattr(value, 'resolve_expression')
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_loaded_values', None)
+    if created or not previous:
+        return
+    old_stock, new_stock = previous.get('stock'), instance.stock
+    old_price, new_price = previous.get('price'), instance.price
+    instance._loaded_values = {
+        name: getattr(instance, name) for name in Product.TRACKED_FIELDS if is_plain_value(getattr(instance, name))
+    }
+
+    changes = []
+    if old_stock == 0 and is_plain_value(new_stock) and new_stock > 0:
+        changes.append({'kind': 'back_in_stock'})
+    if old_price is not None and is_plain_value(new_price) and Decimal(new_price) < old_price:
+        changes.append({'kind': 'price_drop', 'old_price': str(old_price), 'new_price': str(new_price)})
+    if changes and Wishlist.objects.filter(product=instance).exists():
+        for change in changes:
+            jobs.enqueue('wishlist.fan_out', {'product_id': instance.pk, **change})
+
+
+@receiver(products_restocked)
+def products_replenished(sender, replenished, **kwargs):
+    if not replenished:
+        return
+    wishlisted = Wishlist.objects.filter(product_id__in=replenished).values_list('product_id', flat=True).distinct()
+    for product_id in wishlisted:
+        jobs.enqueue('wishlist.fan_out', {'product_id': product_id, 'kind': 'back_in_stock'})
@@ -0,0 +1,198 @@
+"""Delivery of outbox events to downstream systems.
+
+Order changes record an ``OutboxEvent`` in the same transaction as the change
+itself (``OutboxEvent.objects.publish()``), so an event exists exactly when its
+change was committed, and requests never wait for a downstream system. The
+``dispatch_outbox`` command then delivers the events to every sink in
+``OUTBOX['SINKS']``:
+
+    OUTBOX = {
+        'SINKS': {
+            'warehouse': {'BACKEND': 'ecommerce.outbox.HTTPSink', 'URL': 'https://wms.example.com/events'},
+            'analytics': {'BACKEND': 'ecommerce.outbox.FileSink', 'PATH': '/var/log/shop/events.jsonl',
+                          'TOPICS': ['order.created']},
+        },
+    }
+
+Each sink has its own cursor (``OutboxCursor``) and receives the events in
+the order their transactions committed, ``BATCH_SIZE`` per call, one batch at
+a time. The cursor only moves once the sink has accepted a batch, so delivery
+is at least once: after a failure or a crash the batch is delivered again, and
+consumers should ignore event IDs they have already seen. A failing sink is retried with exponential
+backoff without holding up the others; a sink that is overloaded raises
+``Backpressure`` (the HTTP sink does on 429 and 503, honouring
+``Retry-After``) to be left alone for a while. Events wait in the table
+meanwhile.
+
+IDs are handed out on insert, so an event can commit after one with a higher
+ID; a cursor on IDs would pass it and never deliver it. Before reading, the
+dispatcher therefore numbers the committed events with
+``OutboxEvent.objects.sequence()`` and the cursors hold those positions. Run a
+single dispatcher.
+"""
+import json
+import logging
+import os
+import time
+import urllib.error
+import urllib.request
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .conf import get_settings
+from .models import OutboxCursor, OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'SINKS': {},
+    'BATCH_SIZE': 500,
+    'POLL_INTERVAL': 1.0,
+    'BACKOFF_SECONDS': 1,
+    'MAX_BACKOFF_SECONDS': 300,
+}
+
+
+def outbox_settings():
+    return get_settings('OUTBOX', DEFAULTS)
+
+
+class Backpressure(Exception):
+    """Raised by a sink that cannot take more events right now."""
+
+    def __init__(self, retry_after=None):
+        super().__init__(f'Sink asked to retry after {retry_after} seconds' if retry_after else 'Sink is busy')
+        self.retry_after = retry_after
+
+
+class FileSink:
+    """Appends events as JSON lines to ``path``; a local stand-in for a real consumer."""
+
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.fsync = fsync
+
+    def deliver(self, events):
+        with open(self.path, 'a', encoding='utf-8') as stream:
+            stream.writelines(json.dumps(event, cls=DjangoJSONEncoder) + '\n' for event in events)
+            stream.flush()
+            if self.fsync:
+                os.fsync(stream.fileno())
+
+
+class HTTPSink:
+    """POSTs ``{"events": [...]}`` to ``url``; any 2xx response accepts the batch."""
+
+    def __init__(self, url, timeout=10, headers=None):
+        self.url = url
+        self.timeout = timeout
+        self.headers = {'Content-Type': 'application/json', **(headers or {})}
+
+    def deliver(self, events):
+        body = json.dumps({'events': events}, cls=DjangoJSONEncoder).encode()
+        request = urllib.request.Request(self.url, data=body, headers=self.headers, method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+        except urllib.error.HTTPError as exc:
+            if exc.code in (429, 503):
+                retry_after = exc.headers.get('Retry-After')
+                raise Backpressure(int(retry_after) if retry_after and retry_after.isdigit() else None) from exc
+            raise
+
+
+def get_sinks(names=None):
+    """Return ``{name: (sink, topics)}`` for the configured sinks (or those of ``names``)."""
+    sinks = {}
+    for name, options in outbox_settings()['SINKS'].items():
+        if names and name not in names:
+            continue
+        options = dict(options)
+        backend = import_string(options.pop('BACKEND'))
+        topics = options.pop('TOPICS', None)
+        sinks[name] = (backend(**{key.lower(): value for key, value in options.items()}), topics)
+    return sinks
+
+
+def pending(position, limit):
+    """Return ``(position, event)`` for the next ``limit`` committed events after ``position``.
+
+    ``event`` is the dict sinks receive.
+    """
+    OutboxEvent.objects.sequence()
+    rows = (
+        OutboxEvent.objects.filter(position__gt=position)
+        .order_by('position').values('position', 'id', 'topic', 'key', 'payload', 'created_at')[:limit]
+    )
+    events = []
+    for event in rows:
+        event['created_at'] = event['created_at'].isoformat()
+        events.append((event.pop('position'), event))
+    return events
+
+
+class Dispatcher:
+    def __init__(self, sinks=None, batch_size=None, poll_interval=None):
+        conf = outbox_settings()
+        self.conf = conf
+        self.sinks = get_sinks(sinks)
+        self.batch_size = batch_size or conf['BATCH_SIZE']
+        self.poll_interval = poll_interval if poll_interval is not None else conf['POLL_INTERVAL']
+        self.positions = {}
+        self.failures = {name: 0 for name in self.sinks}
+        self.retry_at = {name: 0 for name in self.sinks}
+        self.running = False
+
+    def position(self, name):
+        if name not in self.positions:
+            self.positions[name] = OutboxCursor.objects.get_or_create(sink=name)[0].position
+        return self.positions[name]
+
+    def backoff(self, name):
+        self.failures[name] += 1
+        return min(self.conf['BACKOFF_SECONDS'] * 2 ** (self.failures[name] - 1), self.conf['MAX_BACKOFF_SECONDS'])
+
+    def drain(self, name):
+        """Deliver the next batch to one sink; return how many events its cursor moved past."""
+        sink, topics = self.sinks[name]
+        rows = pending(self.position(name), self.batch_size)
+        if not rows:
+            return 0
+        events = [event for _, event in rows]
+        selected = [event for event in events if topics is None or event['topic'] in topics]
+        try:
+            if selected:
+                sink.deliver(selected)
+        except Backpressure as exc:
+            delay = exc.retry_after or self.backoff(name)
+            logger.info('Outbox sink %s is busy, pausing it for %ss', name, delay)
+            self.retry_at[name] = time.monotonic() + delay
+            return 0
+        except Exception:
+            delay = self.backoff(name)
+            logger.warning('Outbox sink %s failed on events %s-%s, retrying in %ss',
+                           name, events[0]['id'], events[-1]['id'], delay, exc_info=True)
+            self.retry_at[name] = time.monotonic() + delay
+            return 0
+        self.failures[name] = 0
+        OutboxCursor.objects.filter(sink=name).update(position=rows[-1][0], updated_at=timezone.now())
+        self.positions[name] = rows[-1][0]
+        return len(events)
+
+    def run_once(self):
+        """Deliver one batch to every sink that is not backing off; return the events handled."""
+        close_old_connections()
+        now = time.monotonic()
+        return sum(self.drain(name) for name in self.sinks if self.retry_at[name] <= now)
+
+    def run(self):
+        self.running = True
+        while self.running:
+            if not self.run_once():
+                time.sleep(self.poll_interval)
+
+    def stop(self):
+        self.running = False
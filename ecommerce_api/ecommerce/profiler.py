@@ -0,0 +1,229 @@
+"""Per-request SQL profiling.
+
+Staff get a signed token from ``POST /api/profiler/token/`` and send it in the
+``X-Profile-Queries`` header. The request is then served as usual, but every
+SQL statement is recorded with its duration, the project stack frames that
+issued it and the serializer field being rendered at the time. Statements
+repeated with different parameters are reported as N+1 candidates, identical
+ones as duplicates, and the slowest SELECTs are EXPLAINed. The report is
+stored in the cache and its ID returned in the ``X-Query-Profile`` header.
+
+``SAMPLE_RATE`` profiles a fraction of all requests (warm-up requests aside)
+and stores their reports silently. Requests that are neither sampled nor carry the header only pay for
+a header lookup; with ``ENABLED`` off the middleware is removed entirely.
+Queries run while a streaming response is being consumed are not captured.
+"""
+import random
+import re
+import sys
+import time
+import uuid
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, connections
+from django.utils import timezone
+from rest_framework.serializers import BaseSerializer
+
+from .conf import get_settings
+from .warmup import is_warmup_request
+
+DEFAULTS = {
+    'ENABLED': True,
+    'HEADER': 'X-Profile-Queries',
+    'TOKEN_MAX_AGE': 3600,
+    'SAMPLE_RATE': 0.0,
+    'REPEAT_THRESHOLD': 3,
+    'EXPLAIN_SLOWEST': 3,
+    'STACK_DEPTH': 5,
+    'CAPTURE_PARAMS': False,
+    'STORE_TIMEOUT': 24 * 3600,
+    'KEEP_RECENT': 100,
+}
+
+TOKEN_SALT = 'ecommerce.profiler'
+RECENT_KEY = 'query-profile:recent'
+IN_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)+\s*\)')
+
+
+def profiler_settings():
+    return get_settings('QUERY_PROFILER', DEFAULTS)
+
+
+def make_token(user):
+    return signing.dumps({'user': user.pk}, salt=TOKEN_SALT)
+
+
+def check_token(token):
+    """Return whether ``token`` is valid and was issued to a user who is still active staff."""
+    try:
+        data = signing.loads(token, salt=TOKEN_SALT, max_age=profiler_settings()['TOKEN_MAX_AGE'])
+    except signing.BadSignature:
+        return False
+    return User.objects.filter(pk=data['user'], is_staff=True, is_active=True).exists()
+
+
+def shape(sql):
+    """Collapse ``IN (%s, %s, ...)`` lists so that the same statement with different list lengths groups together."""
+    return IN_LIST.sub('(...)', sql)
+
+
+def origin(depth):
+    """Return the innermost project frames and the serializer field being rendered, if any."""
+    project = str(settings.BASE_DIR)
+    stack, field = [], None
+    frame = sys._getframe(2)
+    while frame is not None:
+        code = frame.f_code
+        if field is None and code.co_name == 'to_representation' and 'field' in frame.f_locals:
+            serializer = frame.f_locals.get('self')
+            if isinstance(serializer, BaseSerializer):
+                field = f"{type(serializer).__name__}.{frame.f_locals['field'].field_name}"
+        filename = code.co_filename
+        if (len(stack) < depth and filename.startswith(project) and 'site-packages' not in filename
+                and filename != __file__):
+            stack.append(f"{filename[len(project) + 1:]}:{frame.f_lineno} in {code.co_name}")
+        frame = frame.f_back
+    return stack, field
+
+
+class QueryRecorder:
+    def __init__(self, alias, conf):
+        self.alias = alias
+        self.conf = conf
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - started) * 1000
+            stack, field = origin(self.conf['STACK_DEPTH'])
+            self.queries.append({
+                'alias': self.alias, 'sql': sql, 'params': params, 'many': many,
+                'ms': round(duration, 3), 'stack': stack, 'field': field,
+            })
+
+
+def explain(query):
+    connection = connections[query['alias']]
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"{connection.ops.explain_query_prefix()} {query['sql']}", query['params'])
+            return [' '.join(str(value) for value in row) for row in cursor.fetchall()]
+    except DatabaseError as exc:
+        return [f'EXPLAIN failed: {exc}']
+
+
+def analyse(queries, conf):
+    by_shape, by_statement = defaultdict(list), defaultdict(int)
+    for query in queries:
+        by_shape[shape(query['sql'])].append(query)
+        if not query['many']:
+            by_statement[(query['sql'], repr(query['params']))] += 1
+
+    repeated = [
+        {
+            'sql': sql, 'count': len(group), 'ms': round(sum(query['ms'] for query in group), 3),
+            'stack': group[0]['stack'], 'field': group[0]['field'],
+        }
+        for sql, group in by_shape.items()
+        if len(group) >= conf['REPEAT_THRESHOLD']
+    ]
+    duplicates = [
+        {'sql': sql, 'count': count}
+        for (sql, _), count in by_statement.items()
+        if count > 1
+    ]
+    slowest = sorted(
+        (query for query in queries if not query['many'] and query['sql'].lstrip()[:6].upper() == 'SELECT'),
+        key=lambda query: query['ms'], reverse=True,
+    )[:conf['EXPLAIN_SLOWEST']]
+    explained = [{'sql': query['sql'], 'ms': query['ms'], 'plan': explain(query)} for query in slowest]
+    return (
+        sorted(repeated, key=lambda entry: entry['ms'], reverse=True),
+        sorted(duplicates, key=lambda entry: entry['count'], reverse=True),
+        explained,
+    )
+
+
+def store_report(report):
+    conf = profiler_settings()
+    cache.set(f"query-profile:{report['id']}", report, conf['STORE_TIMEOUT'])
+    recent = [report['id']] + [pk for pk in cache.get(RECENT_KEY, []) if pk != report['id']]
+    cache.set(RECENT_KEY, recent[:conf['KEEP_RECENT']], conf['STORE_TIMEOUT'])
+
+
+def get_report(report_id):
+    return cache.get(f'query-profile:{report_id}')
+
+
+def recent_reports():
+    reports = cache.get_many([f'query-profile:{pk}' for pk in cache.get(RECENT_KEY, [])])
+    return sorted(reports.values(), key=lambda report: report['started_at'], reverse=True)
+
+
+class QueryProfilerMiddleware:
+    def __init__(self, get_response):
+        conf = profiler_settings()
+        if not conf['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.meta_key = 'HTTP_' + conf['HEADER'].upper().replace('-', '_')
+        self.sample_rate = conf['SAMPLE_RATE']
+
+    def __call__(self, request):
+        token = request.META.get(self.meta_key)
+        requested = token is not None and check_token(token)
+        sampled = self.sample_rate and not is_warmup_request(request) and random.random() < self.sample_rate
+        if not requested and not sampled:
+            return self.get_response(request)
+        return self.profile(request, attach=requested)
+
+    def profile(self, request, attach):
+        conf = profiler_settings()
+        recorders = [QueryRecorder(connection.alias, conf) for connection in connections.all()]
+        started_at = timezone.now()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for recorder in recorders:
+                stack.enter_context(connections[recorder.alias].execute_wrapper(recorder))
+            response = self.get_response(request)
+        duration = (time.perf_counter() - started) * 1000
+
+        queries = [query for recorder in recorders for query in recorder.queries]
+        repeated, duplicates, explained = analyse(queries, conf)
+        match = request.resolver_match
+        view_class = getattr(match.func, 'view_class', None) if match else None
+        report = {
+            'id': uuid.uuid4().hex,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'view': view_class.__name__ if view_class else (match.view_name if match else None),
+            'status': response.status_code,
+            'sampled': not attach,
+            'started_at': started_at.isoformat(),
+            'duration_ms': round(duration, 3),
+            'db_ms': round(sum(query['ms'] for query in queries), 3),
+            'query_count': len(queries),
+            'repeated': repeated,
+            'duplicates': duplicates,
+            'explain': explained,
+            'queries': [
+                {**query, 'params': repr(query['params']) if conf['CAPTURE_PARAMS'] else None}
+                for query in queries
+            ],
+        }
+        store_report(report)
+
+        if attach:
+            response['X-Query-Profile'] = report['id']
+            response['X-Query-Count'] = str(report['query_count'])
+            response['Server-Timing'] = f"db;dur={report['db_ms']};desc=\"{report['query_count']} queries\""
+        return response
@@ -0,0 +1,219 @@
+""""Frequently bought together" recommendations.
+
+Order items are read in ranges of order IDs and turned into a sparse
+order x product basket matrix ``B`` per chunk; ``B.T @ B`` counts, for every
+pair of products, the orders containing both. The counts are summed into a
+product x product matrix that is saved to ``MATRIX_PATH`` together with the
+last order ID it includes, so later runs only add the orders placed since
+(``update()``). The ``TOP_K`` products bought most often with each product
+whose counts changed are then written to ``ProductRecommendation``, which the
+recommendations endpoint reads with a single indexed query.
+
+Orders are only counted once they are ``SETTLE_SECONDS`` old, so that orders
+still being committed are never skipped. Orders deleted or archived after they
+were counted stay counted until the next ``update(full=True)``.
+
+Requires the optional ``numpy`` and ``scipy`` packages.
+"""
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .conf import get_settings
+from .models import Order, OrderItem, Product, ProductRecommendation
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+DEFAULTS = {
+    'TOP_K': 10,
+    'MIN_COUNT': 2,
+    'MATRIX_PATH': None,
+    'ORDERS_PER_CHUNK': 250000,
+    'WRITE_BATCH_SIZE': 1000,
+    'SETTLE_SECONDS': 60,
+}
+
+
+def recommendation_settings():
+    conf = get_settings('RECOMMENDATIONS', DEFAULTS)
+    if conf['MATRIX_PATH'] is None:
+        conf['MATRIX_PATH'] = os.path.join(settings.BASE_DIR, 'recommendations.npz')
+    return conf
+
+
+def available():
+    return np is not None
+
+
+def cooccurrence(order_ids, product_ids, size):
+    """Return the ``size`` x ``size`` matrix counting the orders that contain each pair of products."""
+    orders, rows = np.unique(order_ids, return_inverse=True)
+    baskets = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, product_ids)), shape=(len(orders), size)
+    )
+    # A product ordered twice (two lines) in one order still counts once
+    baskets.data[:] = 1
+    counts = (baskets.T @ baskets).tocsr()
+    counts.setdiag(0)
+    counts.eliminate_zeros()
+    return counts
+
+
+def accumulate(counts, chunks, size):
+    """Add the co-occurrences of each ``(order_ids, product_ids)`` chunk to ``counts``."""
+    if counts is None:
+        counts = sparse.csr_matrix((size, size), dtype=np.int32)
+    elif counts.shape[0] < size:
+        counts.resize((size, size))
+    for order_ids, product_ids in chunks:
+        if len(order_ids):
+            counts = counts + cooccurrence(order_ids, product_ids, size)
+    return counts
+
+
+def top_neighbours(counts, rows, k, min_count=1, alive=None):
+    """Return ``(product, neighbour, rank, score)`` arrays of the ``k`` strongest neighbours of each of ``rows``.
+
+    Ties are broken by the lower product ID. ``alive`` masks products that
+    must not be recommended.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    block = counts[rows]
+    lengths = np.diff(block.indptr)
+    products = np.repeat(rows, lengths)
+    neighbours = block.indices.astype(np.int64)
+    scores = block.data
+    keep = scores >= min_count
+    if alive is not None:
+        keep &= alive[neighbours]
+    products, neighbours, scores = products[keep], neighbours[keep], scores[keep]
+
+    order = np.lexsort((neighbours, -scores, products))
+    products, neighbours, scores = products[order], neighbours[order], scores[order]
+    starts = np.flatnonzero(np.r_[True, products[1:] != products[:-1]])
+    ranks = np.arange(len(products)) - np.repeat(starts, np.diff(np.r_[starts, len(products)]))
+    top = ranks < k
+    return products[top], neighbours[top], ranks[top] + 1, scores[top]
+
+
+def load_matrix(path):
+    if not os.path.exists(path):
+        return None, 0
+    with np.load(path) as stored:
+        counts = sparse.csr_matrix((stored['data'], stored['indices'], stored['indptr']), shape=tuple(stored['shape']))
+        return counts, int(stored['watermark'])
+
+
+def save_matrix(path, counts, watermark):
+    temporary = f'{path}.tmp.npz'
+    np.savez(
+        temporary, data=counts.data, indices=counts.indices, indptr=counts.indptr,
+        shape=np.array(counts.shape), watermark=np.array(watermark),
+    )
+    os.replace(temporary, path)
+
+
+def order_item_chunks(after, until, orders_per_chunk):
+    """Yield ``(order_ids, product_ids)`` arrays for orders ``after`` < id <= ``until``, a range of orders at a time."""
+    for low in range(after, until, orders_per_chunk):
+        rows = OrderItem.objects.filter(
+            order_id__gt=low, order_id__lte=min(low + orders_per_chunk, until)
+        ).values_list('order_id', 'product_id')
+        items = np.array(list(rows.iterator(chunk_size=10000)), dtype=np.int64).reshape(-1, 2)
+        yield items[:, 0], items[:, 1]
+
+
+def write_recommendations(products, neighbours, ranks, scores, rows, batch_size):
+    """Replace the stored recommendations of ``rows``, ``batch_size`` products per transaction.
+
+    ``products`` must be sorted, as returned by ``top_neighbours()``.
+    """
+    rows = np.asarray(rows)
+    bounds = np.searchsorted(products, rows)
+    written = 0
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        low = bounds[start]
+        high = bounds[start + batch_size] if start + batch_size < len(rows) else len(products)
+        with transaction.atomic():
+            ProductRecommendation.objects.filter(product_id__in=batch.tolist()).delete()
+            ProductRecommendation.objects.bulk_create([
+                ProductRecommendation(product_id=product, recommended_id=neighbour, rank=rank, score=score)
+                for product, neighbour, rank, score in zip(
+                    products[low:high].tolist(), neighbours[low:high].tolist(),
+                    ranks[low:high].tolist(), scores[low:high].tolist(),
+                )
+            ])
+        written += high - low
+    return written
+
+
+def update(full=False):
+    """Add the orders placed since the last run (or all orders) and refresh the affected recommendations.
+
+    Returns a dict of what was done and how long each step took.
+    """
+    if not available():
+        raise RuntimeError('Recommendations need the numpy and scipy packages')
+    conf = recommendation_settings()
+    timings = {}
+    started = time.perf_counter()
+
+    counts, watermark = (None, 0) if full else load_matrix(conf['MATRIX_PATH'])
+    if counts is None:
+        full, watermark = True, 0
+    until = Order.objects.filter(
+        created_at__lt=timezone.now() - timedelta(seconds=conf['SETTLE_SECONDS'])
+    ).aggregate(last=Max('id'))['last'] or watermark
+    size = (Product.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+    if counts is not None:
+        size = max(size, counts.shape[0])
+
+    touched = []
+
+    def chunks():
+        for order_ids, product_ids in order_item_chunks(watermark, until, conf['ORDERS_PER_CHUNK']):
+            touched.append(np.unique(product_ids))
+            yield order_ids, product_ids
+
+    counts = accumulate(counts, chunks(), size)
+    timings['count'] = time.perf_counter() - started
+
+    step = time.perf_counter()
+    if full:
+        rows = np.flatnonzero(np.diff(counts.indptr))
+    else:
+        rows = np.unique(np.concatenate(touched)) if touched else np.array([], dtype=np.int64)
+    alive = np.zeros(size, dtype=bool)
+    product_ids = np.fromiter(Product.objects.values_list('id', flat=True).iterator(), dtype=np.int64)
+    # Products created since ``size`` was read have no counts yet
+    alive[product_ids[product_ids < size]] = True
+    rows = rows[alive[rows]]
+    products, neighbours, ranks, scores = top_neighbours(counts, rows, conf['TOP_K'], conf['MIN_COUNT'], alive)
+    timings['rank'] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    if full:
+        stale = np.setdiff1d(
+            np.fromiter(ProductRecommendation.objects.values_list('product_id', flat=True).distinct().iterator(), dtype=np.int64),
+            rows,
+        )
+        for start in range(0, len(stale), conf['WRITE_BATCH_SIZE']):
+            ProductRecommendation.objects.filter(product_id__in=stale[start:start + conf['WRITE_BATCH_SIZE']].tolist()).delete()
+    written = write_recommendations(products, neighbours, ranks, scores, rows, conf['WRITE_BATCH_SIZE'])
+    save_matrix(conf['MATRIX_PATH'], counts, until)
+    timings['write'] = time.perf_counter() - step
+
+    return {
+        'full': full, 'orders_after': watermark, 'orders_until': until, 'pairs': counts.nnz,
+        'products': len(rows), 'recommendations': written, 'timings': timings,
+    }
@@ -0,0 +1,67 @@
+"""Additional response formats, picked from the ``Accept`` header.
+
+``application/msgpack`` renders MessagePack (requires the optional ``msgpack``
+package) and ``application/x-ndjson`` renders one JSON document per line. List
+views using ``NDJSONStreamMixin`` send NDJSON as a streaming response, encoding
+rows as the queryset is iterated instead of building the whole body first.
+"""
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+    available = msgpack is not None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=JSONEncoder().default, use_bin_type=True)
+
+
+class NDJSONRenderer(BaseRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+    buffer_size = 8192
+    encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+    def encode(self, row):
+        return self.encoder.encode(row).encode() + b'\n'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        return b''.join(self.encode(row) for row in rows)
+
+    def stream(self, rows):
+        """Encode ``rows`` lazily, yielding about ``buffer_size`` bytes at a time."""
+        buffer = []
+        size = 0
+        for row in rows:
+            line = self.encode(row)
+            buffer.append(line)
+            size += len(line)
+            if size >= self.buffer_size:
+                yield b''.join(buffer)
+                buffer, size = [], 0
+        if buffer:
+            yield b''.join(buffer)
+
+
+class ContentNegotiation(DefaultContentNegotiation):
+    """Skips renderers whose optional dependency is not installed."""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        renderers = [renderer for renderer in renderers if getattr(renderer, 'available', True)]
+        return super().select_renderer(request, renderers, format_suffix)
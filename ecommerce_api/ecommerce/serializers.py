@@ -1,8 +1,10 @@
 from rest_framework import serializers
-from .models import Category, Product, Coupon, Address, Wishlist, Cart, CartItem, Order, OrderItem
+from .models import Category, Product, Coupon, Address, Wishlist, Cart, CartItem, Order, OrderItem, ArchivedOrder, ProductRecommendation
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.db import transaction
+from .fieldsets import SparseFieldsMixin
+from .tasks import queue_status_jobs
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -23,23 +25,32 @@ class UserSerializer(serializers.ModelSerializer):
         instance.save()
         return instance
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
-        fields = ['id', 'name', 'description']
+        fields = ['id', 'name', 'description', 'updated_at']
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
     category_id = serializers.PrimaryKeyRelatedField(
         queryset=Category.objects.all(), source='category', write_only=True
     )
     image = serializers.ImageField(required=False)
 
+    expandable_fields = ('category',)
+
     class Meta:
         model = Product
-        fields = ['id', 'name', 'description', 'price', 'stock', 'category', 'category_id', 'image', 'created_at']
+        fields = ['id', 'name', 'description', 'price', 'stock', 'category', 'category_id', 'image', 'created_at', 'updated_at']
+
+class ProductRecommendationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    product = ProductSerializer(source='recommended', read_only=True)
+
+    class Meta:
+        model = ProductRecommendation
+        fields = ['product', 'score']
 
-class CouponSerializer(serializers.ModelSerializer):
+class CouponSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Coupon
         fields = ['id', 'code', 'discount_percentage', 'max_discount', 'expiry_date', 'is_active']
@@ -54,30 +65,36 @@ class AddressSerializer(serializers.ModelSerializer):
             Address.objects.filter(user=self.context['request'].user, is_default=True).update(is_default=False)
         return data
 
-class WishlistSerializer(serializers.ModelSerializer):
+class WishlistSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     product_id = serializers.PrimaryKeyRelatedField(
         queryset=Product.objects.all(), source='product', write_only=True
     )
 
+    expandable_fields = ('product',)
+
     class Meta:
         model = Wishlist
         fields = ['id', 'product', 'product_id', 'added_at']
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     product_id = serializers.PrimaryKeyRelatedField(
         queryset=Product.objects.all(), source='product', write_only=True
     )
 
+    expandable_fields = ('product',)
+
     class Meta:
         model = CartItem
         fields = ['id', 'product', 'product_id', 'quantity']
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
     total_amount = serializers.SerializerMethodField()
 
+    method_field_sources = {'total_amount': ('items__quantity', 'items__product__price')}
+
     class Meta:
         model = Cart
         fields = ['id', 'user', 'items', 'total_amount', 'created_at']
@@ -85,21 +102,25 @@ class CartSerializer(serializers.ModelSerializer):
     def get_total_amount(self, obj):
         return sum(item.product.price * item.quantity for item in obj.items.all())
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     product_id = serializers.PrimaryKeyRelatedField(
         queryset=Product.objects.all(), source='product', write_only=True
     )
 
+    expandable_fields = ('product',)
+
     class Meta:
         model = OrderItem
         fields = ['id', 'product', 'product_id', 'quantity', 'price']
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
     status = serializers.ChoiceField(choices=Order.STATUS_CHOICES)
     coupon = CouponSerializer(read_only=True)
 
+    expandable_fields = ('coupon',)
+
     class Meta:
         model = Order
         fields = ['id', 'user', 'total_amount', 'status', 'items', 'shipping_address', 'billing_address', 'payment_reference', 'coupon', 'discount_applied', 'created_at']
@@ -108,20 +129,66 @@ class OrderSerializer(serializers.ModelSerializer):
         instance = self.instance
         if instance:
             current_status = instance.status
-            invalid_transitions = {
-                'delivered': ['pending', 'processing'],
-                'completed': ['pending', 'processing', 'failed'],
-                'cancelled': ['delivered', 'completed', 'returned', 'refunded'],
-                'returned': ['pending', 'processing', 'cancelled', 'refunded'],
-                'refunded': ['pending', 'processing', 'cancelled'],
-                'failed': ['delivered', 'completed'],
-            }
-            if value in invalid_transitions and current_status in invalid_transitions[value]:
+            if not Order.can_transition(current_status, value):
                 raise serializers.ValidationError(f"Cannot change status from {current_status} to {value}")
         return value
 
+    def update(self, instance, validated_data):
+        current_status = instance.status
+        new_status = validated_data.pop('status', current_status)
+        with transaction.atomic():
+            # Only the given fields are written: status is left to transition(), and a
+            # full save would write back the status this instance was loaded with
+            for name, value in validated_data.items():
+                setattr(instance, name, value)
+            if validated_data:
+                instance.save(update_fields=list(validated_data))
+            if new_status != current_status:
+                if not instance.transition(new_status, sources=[current_status]):
+                    raise serializers.ValidationError(
+                        {'status': f"Cannot change status from {instance.status} to {new_status}"}
+                    )
+                queue_status_jobs(instance.pk, new_status)
+        return instance
+
+class ArchivedOrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """Renders an archived order in the shape of ``OrderSerializer``; item products carry only ``id`` and ``name``."""
+    coupon = serializers.SerializerMethodField()
+    archived = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ArchivedOrder
+        fields = ['id', 'user', 'total_amount', 'status', 'items', 'shipping_address', 'billing_address', 'payment_reference', 'coupon', 'discount_applied', 'created_at', 'archived', 'archived_at']
+
+    def get_coupon(self, obj):
+        return {'code': obj.coupon_code} if obj.coupon_code else None
+
+    def get_archived(self, obj):
+        return True
+
 class CheckoutSerializer(serializers.Serializer):
     shipping_address_id = serializers.PrimaryKeyRelatedField(queryset=Address.objects.all())
     billing_address_id = serializers.PrimaryKeyRelatedField(queryset=Address.objects.all())
     payment_reference = serializers.CharField(max_length=100, required=False, allow_blank=True)
     coupon_code = serializers.CharField(max_length=50, required=False, allow_blank=True)
+
+class OrderFilterSerializer(serializers.Serializer):
+    status = serializers.ChoiceField(choices=Order.STATUS_CHOICES, required=False)
+    user_id = serializers.IntegerField(required=False)
+    created_after = serializers.DateTimeField(required=False)
+    created_before = serializers.DateTimeField(required=False)
+
+    def validate(self, data):
+        if not data:
+            raise serializers.ValidationError("At least one filter is required")
+        return data
+
+class BulkOrderTransitionSerializer(serializers.Serializer):
+    status = serializers.ChoiceField(choices=Order.STATUS_CHOICES)
+    order_ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, allow_empty=False)
+    filter = OrderFilterSerializer(required=False)
+
+    def validate(self, data):
+        if ('order_ids' in data) == ('filter' in data):
+            raise serializers.ValidationError("Provide either order_ids or filter")
+        return data
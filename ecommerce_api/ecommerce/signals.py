@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent by Product.objects.add_stock() with ``quantities`` ({product_id: added})
+# and ``replenished`` (IDs of products that were out of stock before the update).
+products_restocked = Signal()
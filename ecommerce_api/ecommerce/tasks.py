@@ -0,0 +1,59 @@
+import logging
+import random  # For simulating payment failure
+
+from django.db import transaction
+
+from . import jobs
+from .models import Order
+
+logger = logging.getLogger(__name__)
+
+
+def queue_status_jobs(order_id, status):
+    """Queue the jobs that follow an order moving to ``status``.
+
+    Every path that changes an order's status calls this in the same
+    transaction, so the customer is notified and refunds are paid whether the
+    change came from the API, the admin or a bulk transition.
+    """
+    if status == 'refunded':
+        jobs.enqueue('payment.refund', {'order_id': order_id})
+    jobs.enqueue('order.notify', {'order_id': order_id, 'status': status})
+
+
+def fail_order(order_id):
+    with transaction.atomic():
+        if Order(pk=order_id).transition('failed', sources=['pending']):
+            queue_status_jobs(order_id, 'failed')
+
+
+@jobs.register('payment.capture', on_failure=fail_order)
+def capture_payment(order_id):
+    order = Order.objects.select_for_update().get(pk=order_id)
+    if order.status != 'pending':
+        return
+
+    # Simulate payment processing (10% chance of the payment being declined)
+    if random.random() < 0.1:
+        logger.info("Payment declined for order %s", order_id)
+        fail_order(order_id)
+        return
+
+    jobs.enqueue('order.fulfil', {'order_id': order_id})
+
+
+@jobs.register('order.fulfil')
+def fulfil_order(order_id):
+    if Order(pk=order_id).transition('processing', sources=['pending']):
+        queue_status_jobs(order_id, 'processing')
+
+
+@jobs.register('payment.refund')
+def refund_payment(order_id):
+    order = Order.objects.get(pk=order_id)
+    logger.info("Refunding payment %s for order %s", order.payment_reference, order_id)
+
+
+@jobs.register('order.notify')
+def notify_order_status(order_id, status):
+    logger.info("Order %s is now %s", order_id, status)
@@ -1,3 +1,1567 @@
-from django.test import TestCase
+import gzip
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock, skipUnless
+from urllib.error import HTTPError
 
-# Create your tests here.
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.db.models import Count, F, Q
+from django.forms import model_to_dict
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from . import archive, autocomplete, batch, carts, housekeeping, jobs, outbox, profiler, recommendations, transitions, warmup
+from .admin import OrderStatusForm
+from .catalog import catalog_version, changes_since, prune_changes
+from .management.commands import generate_data
+from .models import (
+    Address, ArchivedOrder, CatalogChange, Cart, CartItem, Category, Coupon, Job, Notification, Order, OrderItem, OutboxCursor,
+    OutboxEvent, Product, ProductRecommendation, Wishlist,
+)
+from .renderers import MessagePackRenderer
+from .serializers import OrderSerializer
+
+calls = []
+
+
+@jobs.register('test.record')
+def record(value):
+    calls.append(value)
+
+
+def flaky_failed(value, failures):
+    calls.append(('failed', value))
+
+
+@jobs.register('test.flaky', on_failure=flaky_failed)
+def flaky(value, failures):
+    calls.append(value)
+    if calls.count(value) <= failures:
+        raise ValueError(f'attempt {calls.count(value)} failed')
+
+
+def broken_failure_handler(value, failures):
+    raise RuntimeError('failure handler is broken')
+
+
+@jobs.register('test.doomed', on_failure=broken_failure_handler)
+def doomed(value, failures):
+    raise ValueError('always fails')
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueue_unknown_job(self):
+        with self.assertRaises(KeyError):
+            jobs.enqueue('test.missing')
+        self.assertFalse(Job.objects.exists())
+
+    def test_claim_takes_due_jobs_only(self):
+        due = jobs.enqueue('test.record', {'value': 1})
+        jobs.enqueue('test.record', {'value': 2}, delay=60)
+
+        claimed = jobs.claim(10)
+
+        self.assertEqual([job.pk for job in claimed], [due.pk])
+        due.refresh_from_db()
+        self.assertEqual((due.status, due.attempts), ('running', 1))
+        self.assertEqual(jobs.claim(10), [])
+
+    def test_run_pending(self):
+        job = jobs.enqueue('test.record', {'value': 'a'})
+
+        self.assertEqual(jobs.run_pending(), 1)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(calls, ['a'])
+
+    def test_failed_attempt_is_retried_after_backoff(self):
+        job = jobs.enqueue('test.flaky', {'value': 'b', 'failures': 1})
+
+        jobs.run_pending()
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertIn('attempt 1 failed', job.last_error)
+        self.assertGreater(job.run_at, timezone.now())
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now() - timedelta(seconds=1))
+        jobs.run_pending()
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('done', 2))
+        self.assertEqual(calls, ['b', 'b'])
+
+    def test_failure_after_last_attempt(self):
+        job = jobs.enqueue('test.flaky', {'value': 'c', 'failures': 5}, max_attempts=1)
+
+        jobs.run_pending()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(calls, ['c', ('failed', 'c')])
+
+    def test_broken_failure_handler_does_not_stop_the_worker(self):
+        doomed_job = jobs.enqueue('test.doomed', {'value': 'd', 'failures': 1}, max_attempts=1)
+        job = jobs.enqueue('test.record', {'value': 'e'})
+
+        with self.assertLogs('ecommerce.jobs', 'ERROR') as logs:
+            self.assertEqual(jobs.Worker().run_once(), 2)
+
+        doomed_job.refresh_from_db()
+        job.refresh_from_db()
+        self.assertEqual((doomed_job.status, job.status), ('failed', 'done'))
+        self.assertTrue(any('Failure handler' in line for line in logs.output))
+
+    def test_requeue_stale(self):
+        job = jobs.enqueue('test.record', {'value': 'f'})
+        Job.objects.filter(pk=job.pk).update(status='running', locked_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(jobs.requeue_stale(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'queued')
+
+    @override_settings(JOB_QUEUE={'EAGER': True})
+    def test_eager_mode_runs_on_commit_and_retries(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            job = jobs.enqueue('test.flaky', {'value': 'g', 'failures': 2})
+            self.assertEqual(calls, [])
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('done', 3))
+        self.assertEqual(calls, ['g', 'g', 'g'])
+
+    @override_settings(JOB_QUEUE={'EAGER': True})
+    def test_eager_mode_gives_up_after_last_attempt(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            job = jobs.enqueue('test.flaky', {'value': 'h', 'failures': 5}, max_attempts=2)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertEqual(calls, ['h', 'h', ('failed', 'h')])
+
+    @override_settings(JOB_QUEUE={'EAGER': True})
+    def test_eager_mode_warns_about_delayed_jobs(self):
+        with self.assertLogs('ecommerce.jobs', 'WARNING') as logs, self.captureOnCommitCallbacks(execute=True):
+            job = jobs.enqueue('test.record', {'value': 'h'}, delay=60)
+        self.assertIn('only runs under run_jobs', logs.output[0])
+        self.assertEqual(calls, [])
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'queued')
+
+
+class AdminChangelistQueryTests(TestCase):
+    rows = 25
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        category = Category.objects.create(name='Tools')
+        for number in range(cls.rows):
+            user = User.objects.create_user(f'customer{number}')
+            product = Product.objects.create(
+                name=f'Hammer {number}', description='', price=10, stock=5, category=category
+            )
+            Order.objects.create(user=user, total_amount=10)
+            CartItem.objects.create(cart=Cart.objects.create(user=user), product=product)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def assertChangelistQueries(self, url, queries):
+        # The session, the admin user, one count and the page with its relations joined
+        with self.assertNumQueries(queries):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['cl'].result_list)
+
+    def test_order_changelist(self):
+        self.assertChangelistQueries('/admin/ecommerce/order/', 4)
+
+    def test_product_changelist(self):
+        self.assertChangelistQueries('/admin/ecommerce/product/', 4)
+
+    def test_user_changelist(self):
+        # Plus the groups offered by the list filter
+        self.assertChangelistQueries('/admin/auth/user/', 5)
+
+    def test_cart_item_changelist(self):
+        self.assertChangelistQueries('/admin/ecommerce/cartitem/', 4)
+
+    def test_search_changelists(self):
+        self.assertChangelistQueries('/admin/ecommerce/order/?q=customer1', 4)
+        self.assertChangelistQueries('/admin/ecommerce/cartitem/?q=hammer', 4)
+
+    def test_searches_match_prefixes_only(self):
+        # A leading wildcard rules out the indexes
+        for url in ('/admin/ecommerce/product/?q=hammer', '/admin/auth/user/?q=customer1',
+                    '/admin/auth/user/?q=admin@example.com'):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            self.assertFalse([query for query in queries if "LIKE '%" in query['sql']], url)
+        response = self.client.get('/admin/auth/user/?q=admin@example.com')
+        self.assertEqual([user.username for user in response.context['cl'].result_list], ['admin'])
+        response = self.client.get('/admin/ecommerce/product/', {'q': '"hammer 2"'})
+        self.assertEqual([product.name for product in response.context['cl'].result_list], ['Hammer 2', 'Hammer 20',
+                         'Hammer 21', 'Hammer 22', 'Hammer 23', 'Hammer 24'])
+
+    def test_unfiltered_count_uses_estimate(self):
+        with mock.patch('ecommerce.admin.estimate_row_count', return_value=2_000_000):
+            with self.assertNumQueries(3):
+                response = self.client.get('/admin/ecommerce/order/')
+            self.assertEqual(response.context['cl'].result_count, 2_000_000)
+
+            response = self.client.get('/admin/ecommerce/order/?status__exact=pending')
+            self.assertEqual(response.context['cl'].result_count, self.rows)
+
+
+class OrderStatusRaceTests(TestCase):
+    """A request holding an order loaded before a concurrent status change."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('buyer')
+        self.order = Order.objects.create(user=self.user, total_amount=10, shipping_address='Old street')
+        self.stale = Order.objects.get(pk=self.order.pk)
+        # Another request cancels the order after this one loaded it
+        Order.objects.get(pk=self.order.pk).transition('cancelled', sources=['pending'])
+
+    def test_serializer_update_keeps_concurrent_status(self):
+        serializer = OrderSerializer(self.stale, data={'shipping_address': 'New street'}, partial=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.status, self.order.shipping_address), ('cancelled', 'New street'))
+
+    def test_serializer_stale_transition_is_rejected(self):
+        serializer = OrderSerializer(
+            self.stale, data={'status': 'processing', 'shipping_address': 'New street'}, partial=True
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with self.assertRaises(ValidationError):
+            serializer.save()
+
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.status, self.order.shipping_address), ('cancelled', 'Old street'))
+        self.assertEqual(OutboxEvent.objects.filter(topic='order.status_changed').count(), 1)
+        self.assertFalse(Job.objects.filter(name='order.notify').exists())
+
+    def save_in_admin(self, **changes):
+        data = {key: '' if value is None else value for key, value in model_to_dict(self.stale).items()}
+        data.update(changes)
+        form = OrderStatusForm(data, instance=self.stale)
+        self.assertTrue(form.is_valid(), form.errors)
+        model_admin = admin.site._registry[Order]
+        with mock.patch.object(model_admin, 'message_user') as message_user:
+            model_admin.save_model(None, form.save(commit=False), form, change=True)
+        self.order.refresh_from_db()
+        return message_user
+
+    def test_admin_edit_keeps_concurrent_status(self):
+        message_user = self.save_in_admin(shipping_address='New street')
+
+        self.assertEqual((self.order.status, self.order.shipping_address), ('cancelled', 'New street'))
+        message_user.assert_not_called()
+
+    def test_admin_stale_transition_is_reported(self):
+        message_user = self.save_in_admin(status='processing')
+
+        self.assertEqual(self.order.status, 'cancelled')
+        self.assertIn('changed to cancelled in the meantime', message_user.call_args.args[1])
+
+
+class OrderBulkTransitionTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user('ops', is_staff=True)
+        self.buyer = User.objects.create_user('buyer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        category = Category.objects.create(name='Kitchen')
+        self.pan = Product.objects.create(name='Pan', description='', price=30, stock=5, category=category)
+        self.pot = Product.objects.create(name='Pot', description='', price=40, stock=5, category=category)
+        self.orders = [self.create_order(status) for status in ('pending', 'processing', 'delivered', 'pending')]
+
+    def create_order(self, status):
+        order = Order.objects.create(user=self.buyer, total_amount=70, status=status)
+        OrderItem.objects.create(order=order, product=self.pan, quantity=1, price=30)
+        OrderItem.objects.create(order=order, product=self.pot, quantity=2, price=40)
+        return order
+
+    def post(self, data):
+        return self.client.post('/api/orders/bulk-transition/', data, format='json')
+
+    def queued(self, name):
+        return sorted(
+            (job.payload['order_id'], job.payload.get('status')) for job in Job.objects.filter(name=name)
+        )
+
+    def test_requires_either_order_ids_or_filter(self):
+        ids = [order.pk for order in self.orders]
+        for data in ({'status': 'cancelled'}, {'status': 'cancelled', 'order_ids': ids, 'filter': {'status': 'pending'}}):
+            response = self.post(data)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Provide either order_ids or filter', str(response.data))
+        self.assertEqual(self.post({'status': 'cancelled', 'order_ids': []}).status_code, 400)
+        self.assertFalse(Order.objects.filter(status='cancelled').exists())
+
+    def test_admin_only(self):
+        self.client.force_authenticate(self.buyer)
+
+        response = self.post({'status': 'cancelled', 'order_ids': [self.orders[0].pk]})
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(Order.objects.get(pk=self.orders[0].pk).status, 'pending')
+
+    def test_reports_rejected_orders(self):
+        pending, processing, delivered, _ = self.orders
+
+        response = self.post({'status': 'cancelled', 'order_ids': [pending.pk, delivered.pk, 999999, processing.pk]})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['applied'], [pending.pk, processing.pk])
+        self.assertEqual(response.data['rejected'], [
+            {'id': delivered.pk, 'status': 'delivered', 'error': 'Cannot change status from delivered to cancelled'},
+            {'id': 999999, 'status': None, 'error': 'Order not found'},
+        ])
+        self.assertEqual(Order.objects.get(pk=delivered.pk).status, 'delivered')
+
+    def test_cancel_restocks_with_one_aggregated_update(self):
+        with mock.patch.object(Product.objects, 'add_stock', wraps=Product.objects.add_stock) as add_stock:
+            response = self.post({'status': 'cancelled', 'filter': {'status': 'pending'}})
+
+        self.assertEqual(len(response.data['applied']), 2)
+        add_stock.assert_called_once_with({self.pan.pk: 2, self.pot.pk: 4})
+        self.assertEqual(
+            list(Product.objects.order_by('pk').values_list('stock', flat=True)), [7, 9]
+        )
+        self.assertEqual(
+            OutboxEvent.objects.filter(topic='order.status_changed', payload__previous_status='pending').count(), 2
+        )
+
+    def test_released_orders_cannot_take_stock_again(self):
+        order = Order.objects.get(pk=self.orders[0].pk)
+        self.assertTrue(order.transition('cancelled'))
+        for new_status in ('pending', 'processing', 'shipped', 'delivered'):
+            self.assertFalse(order.transition(new_status))
+            serializer = OrderSerializer(order, data={'status': new_status}, partial=True)
+            self.assertFalse(serializer.is_valid())
+
+        result = transitions.bulk_transition('pending', order_ids=[order.pk])
+
+        self.assertEqual(result['applied'], [])
+        self.assertEqual(Order.objects.get(pk=order.pk).status, 'cancelled')
+        self.assertEqual(list(Product.objects.order_by('pk').values_list('stock', flat=True)), [6, 7])
+
+    def test_works_through_batches(self):
+        ids = [order.pk for order in self.orders]
+        with mock.patch.object(transitions, '_transition_batch', wraps=transitions._transition_batch) as batch:
+            result = transitions.bulk_transition('cancelled', order_ids=ids + ids[:1], batch_size=2)
+
+        self.assertEqual([call.args[0] for call in batch.call_args_list], [ids[:2], ids[2:]])
+        self.assertEqual(result['applied'], [ids[0], ids[1], ids[3]])
+        self.assertEqual([order['id'] for order in result['rejected']], [ids[2]])
+
+    def test_queues_status_jobs_for_each_applied_order(self):
+        returned = [self.create_order('returned') for _ in range(2)]
+
+        self.post({'status': 'refunded', 'order_ids': [order.pk for order in returned] + [self.orders[0].pk]})
+
+        self.assertEqual(self.queued('payment.refund'), [(order.pk, None) for order in returned])
+        self.assertEqual(self.queued('order.notify'), [(order.pk, 'refunded') for order in returned])
+
+    def test_admin_transition_queues_status_jobs(self):
+        order = self.create_order('returned')
+        data = {key: '' if value is None else value for key, value in model_to_dict(order).items()}
+        form = OrderStatusForm({**data, 'status': 'refunded'}, instance=order)
+        self.assertTrue(form.is_valid(), form.errors)
+
+        admin.site._registry[Order].save_model(None, form.save(commit=False), form, change=True)
+
+        self.assertEqual(self.queued('payment.refund'), [(order.pk, None)])
+        self.assertEqual(self.queued('order.notify'), [(order.pk, 'refunded')])
+
+
+class WishlistNotificationTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Garden')
+        self.product = Product.objects.create(name='Rake', description='', price=20, stock=0, category=self.category)
+        self.users = [User.objects.create_user(f'gardener{number}') for number in range(5)]
+        for user in self.users:
+            Wishlist.objects.create(user=user, product=self.product)
+
+    def update_product(self, **changes):
+        product = Product.objects.get(pk=self.product.pk)
+        for name, value in changes.items():
+            setattr(product, name, value)
+        product.save()
+        jobs.run_pending()
+
+    def test_back_in_stock(self):
+        self.update_product(stock=3)
+
+        notifications = Notification.objects.filter(product=self.product, kind='back_in_stock')
+        self.assertEqual(
+            sorted(notifications.values_list('user_id', flat=True)), sorted(user.pk for user in self.users)
+        )
+        self.assertEqual(notifications.first().message, 'Rake is back in stock')
+
+    def test_price_drop(self):
+        self.update_product(price=Decimal('15.00'))
+
+        notification = Notification.objects.filter(kind='price_drop').first()
+        self.assertEqual(notification.message, 'Rake dropped in price from 20.00 to 15.00')
+        self.assertEqual(Notification.objects.count(), 5)
+
+    def test_price_rise_and_stock_change_in_stock_do_not_notify(self):
+        self.update_product(price=Decimal('25.00'))
+        Product.objects.filter(pk=self.product.pk).update(stock=2)
+        self.update_product(stock=4)
+
+        self.assertFalse(Notification.objects.exists())
+        self.assertFalse(Job.objects.exists())
+
+    @override_settings(WISHLIST_NOTIFICATIONS={'CHUNK_SIZE': 2})
+    def test_fan_out_in_chunks(self):
+        self.update_product(stock=3)
+
+        self.assertEqual(Notification.objects.count(), 5)
+        self.assertEqual(Job.objects.filter(name='wishlist.fan_out', status='done').count(), 3)
+
+    def test_duplicates_are_skipped(self):
+        self.update_product(stock=3)
+        Product.objects.filter(pk=self.product.pk).update(stock=0)
+        self.update_product(stock=1)
+
+        self.assertEqual(Notification.objects.count(), 5)
+
+    @override_settings(WISHLIST_NOTIFICATIONS={'RATE_LIMIT': 1})
+    def test_rate_limit(self):
+        self.update_product(stock=3)
+        self.update_product(price=Decimal('10.00'))
+
+        self.assertEqual(Notification.objects.filter(kind='price_drop').count(), 0)
+        self.assertEqual(Notification.objects.count(), 5)
+
+    def test_bulk_restock(self):
+        Product.objects.add_stock({self.product.pk: 2})
+        jobs.run_pending()
+
+        self.assertEqual(Notification.objects.filter(kind='back_in_stock').count(), 5)
+
+
+class CatalogFeedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Kitchen')
+        self.cursor = catalog_version()
+
+    def test_changes_since(self):
+        kettle = Product.objects.create(name='Kettle', description='', price=30, stock=1, category=self.category)
+        kettle.stock = 2
+        kettle.save()
+        toaster = Product.objects.create(name='Toaster', description='', price=40, stock=1, category=self.category)
+        toaster_id = toaster.pk
+        toaster.delete()
+
+        changes = changes_since(self.cursor)
+
+        self.assertEqual(changes['upserts'], {'product': [kettle.pk], 'category': []})
+        self.assertEqual(changes['deletes'], {'product': [toaster_id], 'category': []})
+        self.assertEqual(changes['next'], catalog_version())
+        self.assertFalse(changes['has_more'])
+        self.assertEqual(changes_since(changes['next'])['upserts'], {'product': [], 'category': []})
+
+    def test_paging(self):
+        for number in range(5):
+            Category.objects.create(name=f'Aisle {number}')
+
+        first = changes_since(self.cursor, limit=3)
+        second = changes_since(first['next'], limit=3)
+
+        self.assertTrue(first['has_more'])
+        self.assertFalse(second['has_more'])
+        self.assertEqual(len(first['upserts']['category']) + len(second['upserts']['category']), 5)
+
+    def test_late_commit_is_not_skipped(self):
+        # A change recorded by a transaction that is still open: its seq is taken, its row not visible yet
+        open_change = CatalogChange.objects.create(kind='product', object_id=99, operation='delete')
+        CatalogChange.objects.filter(pk=open_change.pk).delete()
+        Category.objects.create(name='Cellar')
+        cursor = changes_since(self.cursor)['next']
+
+        CatalogChange.objects.create(seq=open_change.seq, kind='product', object_id=99, operation='delete')
+        changes = changes_since(cursor)
+
+        self.assertLess(open_change.seq, CatalogChange.objects.order_by('-seq').first().seq)
+        self.assertEqual(changes['deletes']['product'], [99])
+        self.assertEqual(changes['next'], cursor + 1)
+
+    def test_resync(self):
+        Category.objects.create(name='Larder')
+        self.assertEqual(changes_since(0), {'resync': True, 'next': catalog_version()})
+
+        CatalogChange.objects.update(changed_at=timezone.now() - timedelta(days=30))
+        Category.objects.create(name='Scullery')
+        self.assertEqual(prune_changes(), 2)
+        self.assertTrue(changes_since(self.cursor)['resync'])
+
+    def test_writers_number_their_changes_and_readers_stay_read_only(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Pantry')
+        self.assertFalse(CatalogChange.objects.filter(position__isnull=True).exists())
+
+        with CaptureQueriesContext(connection) as queries:
+            changes_since(self.cursor)
+            catalog_version()
+        self.assertFalse([query['sql'] for query in queries if not query['sql'].startswith('SELECT')])
+
+    def test_housekeeping_does_not_number_changes(self):
+        CatalogChange.objects.create(kind='product', object_id=1, operation='delete')
+
+        housekeeping.policies()
+
+        self.assertTrue(CatalogChange.objects.filter(position__isnull=True).exists())
+
+    def test_endpoint(self):
+        Product.objects.create(name='Whisk', description='', price=5, stock=1, category=self.category)
+
+        response = self.client.get('/api/products/changes/', {'since': self.cursor})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([product['name'] for product in response.json()['products']], ['Whisk'])
+        self.assertEqual(response.json()['next'], catalog_version())
+
+
+class ProductFacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tools = Category.objects.create(name='Tools')
+        self.toys = Category.objects.create(name='Toys')
+        for name, price, stock, category in [
+            ('Saw', 30, 2, self.tools), ('Drill', 120, 0, self.tools), ('Kite', 10, 5, self.toys),
+        ]:
+            Product.objects.create(name=name, description='', price=price, stock=stock, category=category)
+        Product.objects.filter(name='Drill').update(created_at=timezone.now() - timedelta(days=60))
+
+    def get(self, path, **params):
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_combined_filters(self):
+        products = self.get('/api/products/filter/', category_id=self.tools.pk, in_stock='true')
+        self.assertEqual([product['name'] for product in products], ['Saw'])
+
+        products = self.get('/api/products/filter/', price='0-25,100-250')
+        self.assertEqual(sorted(product['name'] for product in products), ['Drill', 'Kite'])
+
+    def test_counts_apply_the_other_facets(self):
+        facets = self.get('/api/products/facets/', category_id=self.tools.pk, in_stock='true')
+
+        self.assertEqual(facets['total'], 1)
+        self.assertEqual(
+            {category['name']: (category['count'], category['selected']) for category in facets['categories']},
+            {'Tools': (1, True), 'Toys': (1, False)},
+        )
+        # The stock options count the selected category only, ignoring the stock filter itself
+        self.assertEqual([option['count'] for option in facets['in_stock']], [1, 1])
+        self.assertEqual({window['days']: window['count'] for window in facets['created_within']}, {7: 1, 30: 1, 90: 1})
+
+    def test_counts_follow_catalog_changes(self):
+        self.assertEqual(self.get('/api/products/facets/')['total'], 3)
+        Product.objects.create(name='Ball', description='', price=3, stock=1, category=self.toys)
+        self.assertEqual(self.get('/api/products/facets/')['total'], 4)
+
+    def test_invalid_parameters(self):
+        for params in [
+            {'category_id': 'x'}, {'price': '1-2'}, {'in_stock': 'maybe'}, {'min_price': 'cheap'},
+            {'created_within': 'week'}, {'created_within': '-1'}, {'created_within': '99999999999'},
+            {'max_price': 'NaN'}, {'min_price': 'Infinity'}, {'min_price': '-inf'}, {'max_price': 'sNaN'},
+        ]:
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/api/products/facets/', params).status_code, 400)
+                self.assertEqual(self.client.get('/api/products/filter/', params).status_code, 400)
+
+
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Audio', description='Speakers and more')
+        self.products = [
+            Product.objects.create(name=f'Speaker {number}', description='Loud', price=50, stock=3, category=category)
+            for number in range(3)
+        ]
+        self.user = User.objects.create_user('listener')
+        cart = Cart.objects.create(user=self.user)
+        for product in self.products:
+            CartItem.objects.create(cart=cart, product=product, quantity=2)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_without_parameters_output_is_unchanged(self):
+        product = self.client.get('/api/products/').json()[0]
+        self.assertEqual(product['category']['name'], 'Audio')
+        self.assertIn('description', product)
+
+    def test_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            products = self.client.get('/api/products/', {'fields': 'id,name'}).json()
+
+        self.assertEqual([set(product) for product in products], [{'id', 'name'}] * 3)
+        self.assertNotIn('description', queries.captured_queries[-1]['sql'])
+        self.assertNotIn('ecommerce_category', queries.captured_queries[-1]['sql'])
+
+    def test_unexpanded_relation_is_a_key(self):
+        products = self.client.get('/api/products/', {'fields': 'id,category'}).json()
+        self.assertEqual(products[0]['category'], self.products[0].category_id)
+
+        products = self.client.get('/api/products/', {'fields': 'id,category.name', 'expand': 'category'}).json()
+        self.assertEqual(products[0]['category'], {'name': 'Audio'})
+
+    def test_nested_fields_on_cart(self):
+        # The cart, then its items joined to the two product columns needed
+        with self.assertNumQueries(2):
+            cart = self.client.get('/api/cart/', {'fields': 'total_amount,items.quantity,items.product.name'}).json()
+
+        self.assertEqual(set(cart), {'total_amount', 'items'})
+        self.assertEqual(cart['items'][0], {'quantity': 2, 'product': {'name': 'Speaker 0'}})
+        self.assertEqual(Decimal(cart['total_amount']), 300)
+
+    def test_expand_only(self):
+        item = self.client.get('/api/cart/', {'expand': 'items.product'}).json()['items'][0]
+        self.assertEqual(item['product']['name'], 'Speaker 0')
+        self.assertEqual(item['product']['category'], self.products[0].category_id)
+
+
+class ResponseFormatTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Books')
+        self.products = [
+            Product.objects.create(name=f'Novel {number}', description='A long story ' * 10, price=12, stock=4,
+                                   category=category)
+            for number in range(15)
+        ]
+        self.user = User.objects.create_user('reader', password='Secret-pass-123')
+        for product in self.products:
+            Wishlist.objects.create(user=self.user, product=product)
+        self.client = APIClient()
+
+    def stream(self, response):
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_ndjson_streams_the_whole_unpaginated_list(self):
+        response = self.client.get('/api/products/', {'fields': 'id,name'}, HTTP_ACCEPT='application/x-ndjson')
+
+        rows = sorted(self.stream(response), key=lambda row: row['id'])
+        self.assertEqual(rows, [{'id': product.pk, 'name': product.name} for product in self.products])
+        self.assertIn('Accept', response['Vary'])
+
+    def test_ndjson_follows_pagination(self):
+        self.client.force_authenticate(self.user)
+        as_json = self.client.get('/api/wishlist/', {'page': 2}).json()
+
+        response = self.client.get('/api/wishlist/', {'page': 2}, HTTP_ACCEPT='application/x-ndjson')
+
+        self.assertEqual(self.stream(response), as_json['results'])
+        self.assertEqual(len(as_json['results']), 5)
+        self.assertEqual(response['Link'], '<http://testserver/api/wishlist/>; rel="prev"')
+        response = self.client.get('/api/wishlist/', HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual(response['Link'], '<http://testserver/api/wishlist/?page=2>; rel="next"')
+
+    def test_msgpack(self):
+        if not MessagePackRenderer.available:
+            self.skipTest('msgpack is not installed')
+        import msgpack
+
+        response = self.client.get('/api/products/', {'fields': 'id,price'}, HTTP_ACCEPT='application/msgpack')
+
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content)[0], {'id': self.products[0].pk, 'price': '12.00'})
+
+    def test_lists_are_gzipped(self):
+        response = self.client.get('/api/products/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))), 15)
+
+        response = self.client.get('/api/products/', HTTP_ACCEPT='application/x-ndjson', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(len(gzip.decompress(b''.join(response.streaming_content)).splitlines()), 15)
+
+    def test_token_responses_are_not_gzipped(self):
+        credentials = {'username': 'reader', 'password': 'Secret-pass-123'}
+        for path in ('/api/login/', '/api/token/'):
+            with self.subTest(path=path):
+                response = self.client.post(path, credentials, format='json', HTTP_ACCEPT_ENCODING='gzip')
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn('Content-Encoding', response)
+                self.assertIn('access', response.json())
+
+
+@override_settings(WARMUP={'ENABLED': True, 'REQUESTS': ['/api/categories/']})
+class WarmupTests(TestCase):
+    def warm_up(self):
+        # Only the self-requests: the other steps build process-wide state such as the autocomplete index
+        with mock.patch.object(warmup, '_steps', []):
+            return warmup.warm_up(get_wsgi_application())
+
+    def test_requests_bypass_throttles(self):
+        with mock.patch('rest_framework.throttling.SimpleRateThrottle.allow_request', return_value=True) as allow:
+            timings = self.warm_up()
+            self.assertIn('requests', timings)
+            allow.assert_not_called()
+
+            self.assertEqual(self.client.get('/api/categories/').status_code, 200)
+            allow.assert_called()
+
+    @override_settings(QUERY_PROFILER={'SAMPLE_RATE': 1.0})
+    def test_requests_are_not_profiled(self):
+        with mock.patch('ecommerce.profiler.store_report') as store_report:
+            self.warm_up()
+            store_report.assert_not_called()
+
+            self.client.get('/api/categories/')
+            store_report.assert_called_once()
+
+    def test_status_of_requests(self):
+        self.assertEqual(warmup.get(get_wsgi_application(), '/api/categories/'), '200 OK')
+
+    def test_connections_are_kept_unless_disabled(self):
+        with mock.patch.object(warmup.connections, 'close_all') as close_all:
+            self.warm_up()
+            close_all.assert_not_called()
+            with override_settings(WARMUP={'KEEP_CONNECTIONS': False}):
+                self.warm_up()
+            close_all.assert_called_once()
+
+    def test_disabled_by_default(self):
+        with override_settings(WARMUP={}):
+            self.assertFalse(warmup.warmup_settings()['ENABLED'])
+
+
+@override_settings(HOUSEKEEPING={'ROWS_PER_SECOND': 1000000})
+class HousekeepingTests(TestCase):
+    def setUp(self):
+        self.long_ago = timezone.now() - timedelta(days=400)
+        self.user = User.objects.create_user('shopper', password='pw')
+        category = Category.objects.create(name='Kitchen')
+        self.products = [
+            Product.objects.create(name=f'Pan {number}', description='', price=Decimal('10.00'), stock=0, category=category)
+            for number in range(3)
+        ]
+
+    def test_stale_carts_are_emptied_unless_any_item_changed(self):
+        stale = Cart.objects.create(user=self.user)
+        other = User.objects.create_user('browser', password='pw')
+        active = Cart.objects.create(user=other)
+        for cart in (stale, active):
+            for product in self.products[:2]:
+                CartItem.objects.create(cart=cart, product=product)
+        CartItem.objects.update(updated_at=self.long_ago)
+        CartItem.objects.filter(cart=active, product=self.products[0]).update(updated_at=timezone.now())
+
+        self.assertEqual(housekeeping.run(['cart_items']), {'cart_items': 2})
+        self.assertFalse(CartItem.objects.filter(cart=stale).exists())
+        self.assertEqual(CartItem.objects.filter(cart=active).count(), 2)
+
+    def test_expired_coupons_and_out_of_stock_wishlists(self):
+        Coupon.objects.create(code='OLD', discount_percentage=10, expiry_date=self.long_ago)
+        Coupon.objects.create(code='NEW', discount_percentage=10, expiry_date=timezone.now())
+        Wishlist.objects.create(user=self.user, product=self.products[0])
+        Wishlist.objects.create(user=self.user, product=self.products[1])
+        Wishlist.objects.update(added_at=self.long_ago)
+        Product.objects.filter(pk=self.products[0].pk).update(updated_at=self.long_ago)
+
+        self.assertEqual(housekeeping.run(['coupons', 'wishlists']), {'coupons': 1, 'wishlists': 1})
+        self.assertQuerysetEqual(Coupon.objects.values_list('code', flat=True), ['NEW'])
+        self.assertQuerysetEqual(Wishlist.objects.values_list('product', flat=True), [self.products[1].pk])
+
+    def test_rows_changed_after_selection_are_kept(self):
+        cart = Cart.objects.create(user=self.user)
+        for product in self.products[:2]:
+            CartItem.objects.create(cart=cart, product=product)
+        CartItem.objects.update(updated_at=self.long_ago)
+
+        def select_then_touch(pks):
+            # The shopper changes the cart between the SELECT and the DELETE
+            selected = list(pks)
+            CartItem.objects.filter(product=self.products[0]).update(updated_at=timezone.now())
+            return selected
+
+        stale = housekeeping.policies()['cart_items']
+        with mock.patch('ecommerce.housekeeping.list', side_effect=select_then_touch, create=True):
+            selected, deleted = housekeeping.delete_batch(stale, 10)
+
+        self.assertEqual((selected, deleted), (2, 0))
+        self.assertEqual(CartItem.objects.filter(cart=cart).count(), 2)
+
+    @override_settings(OUTBOX={'SINKS': {'a': {'BACKEND': 'ecommerce.outbox.FileSink'},
+                                          'b': {'BACKEND': 'ecommerce.outbox.FileSink'}}})
+    def test_outbox_events_wait_for_every_sink(self):
+        for number in range(3):
+            OutboxEvent.objects.publish('order.created', number, {})
+        OutboxEvent.objects.update(created_at=self.long_ago)
+        last = OutboxEvent.objects.sequence()
+        OutboxCursor.objects.create(sink='a', position=last)
+        self.assertEqual(housekeeping.run(['outbox_events']), {'outbox_events': 0})
+
+        OutboxCursor.objects.create(sink='b', position=last - 2)
+        self.assertEqual(housekeeping.run(['outbox_events']), {'outbox_events': 1})
+        self.assertEqual(OutboxEvent.objects.count(), 2)
+
+    @override_settings(HOUSEKEEPING={'BATCH_SIZE': 2, 'MAX_ROWS': 3, 'ROWS_PER_SECOND': 1000000})
+    def test_batches_and_row_limit(self):
+        Notification.objects.bulk_create(
+            Notification(user=self.user, product=self.products[0], kind='price_drop', message='Cheaper')
+            for _ in range(5)
+        )
+        Notification.objects.update(created_at=self.long_ago)
+
+        self.assertEqual(housekeeping.run(['notifications'], dry_run=True), {'notifications': 5})
+        self.assertEqual(Notification.objects.count(), 5)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(housekeeping.run(['notifications']), {'notifications': 3})
+        self.assertEqual(Notification.objects.count(), 2)
+        self.assertEqual(sum(query['sql'].startswith('DELETE') for query in queries), 2)
+        self.assertEqual(housekeeping.run(['notifications']), {'notifications': 2})
+
+    def test_job_deletes_one_batch_and_queues_the_next(self):
+        Notification.objects.create(user=self.user, product=self.products[0], kind='price_drop', message='Cheaper')
+        Notification.objects.update(created_at=self.long_ago)
+        names = list(housekeeping.policies())
+
+        housekeeping.run_housekeeping(policy='notifications')
+        self.assertFalse(Notification.objects.exists())
+        follow_up = Job.objects.get(name='housekeeping.run')
+        self.assertEqual(follow_up.payload, {
+            'policy': names[names.index('notifications') + 1], 'report': {'notifications': 1},
+        })
+        self.assertIsNone(housekeeping.schedule())
+
+
+class GenerateDataTests(TestCase):
+    def generate(self, *args):
+        """Run every chunk of the command in this process, as the worker pool would."""
+        command = generate_data.Command()
+        options = vars(command.create_parser('manage.py', 'generate_data').parse_args([
+            '--users', '30', '--products', '20', '--categories', '3', '--coupons', '5', '--chunk-size', '10', *args,
+        ]))
+        plan = command.plan(options)
+        totals = {}
+        command.add(totals, command.generate_catalog(plan))
+        for task in command.tasks(plan, plan['products']):
+            command.add(totals, generate_data.generate_products(*task))
+        for task in command.tasks(plan, plan['users']):
+            command.add(totals, generate_data.generate_users(*task))
+        return plan, totals
+
+    def test_rows_are_consistent(self):
+        plan, totals = self.generate()
+        self.assertEqual(totals, {
+            'Category': 3, 'Coupon': 5, 'CatalogChange': 23, 'Product': 20, 'User': 30, 'Address': 45, 'Cart': 30,
+            'CartItem': 30, 'Wishlist': 120, 'Order': 90, 'OrderItem': 270,
+        })
+        self.assertEqual(User.objects.count(), 30)
+        self.assertFalse(Order.objects.annotate(item_count=Count('items')).filter(item_count=0).exists())
+        self.assertFalse(CartItem.objects.filter(
+            Q(updated_at__lt=F('cart__user__date_joined')) | Q(updated_at__gt=plan['now'])
+        ).exists())
+        self.assertTrue(self.client.login(username=User.objects.first().username, password='password'))
+
+    def test_same_seed_same_rows(self):
+        def rows(plan):
+            # The second run gets IDs after the first run's, and prices follow the product ID
+            items = OrderItem.objects.filter(order__pk__gt=plan['base']['orders']).order_by('pk')
+            return [(product - plan['base']['products'], quantity, status)
+                    for product, quantity, status in items.values_list('product', 'quantity', 'order__status')]
+
+        first = rows(self.generate('--seed', '7')[0])
+        plan, _ = self.generate('--seed', '7')
+        self.assertEqual(plan['base']['products'], 20)
+        self.assertEqual(rows(plan), first)
+
+
+    @skipUnless(connection.vendor == 'sqlite', 'Indexes are only deferred on SQLite')
+    def test_indexes_are_rebuilt_after_loading(self):
+        def indexes():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'ecommerce_wishlist'"
+                )
+                return sorted(cursor.fetchall())
+
+        before = indexes()
+        with generate_data.Command(stdout=StringIO()).deferred_indexes():
+            self.assertEqual(indexes(), [])
+            self.generate()
+
+        self.assertEqual(indexes(), before)
+        self.assertEqual(Wishlist.objects.count(), 120)
+
+class QueryProfilerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_user('staff', password='pw', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+        category = Category.objects.create(name='Kitchen')
+        Product.objects.create(name='Pan', description='', price=Decimal('10.00'), stock=1, category=category)
+
+    def token(self):
+        response = self.client.post('/api/profiler/token/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['token']
+
+    def test_token_header_attaches_a_stored_report(self):
+        response = self.client.get('/api/products/', HTTP_X_PROFILE_QUERIES=self.token())
+        self.assertEqual(response.status_code, 200)
+        report = self.client.get(f"/api/profiler/reports/{response['X-Query-Profile']}/").json()
+        self.assertEqual(report['path'], '/api/products/')
+        self.assertEqual(report['query_count'], int(response['X-Query-Count']))
+        self.assertGreater(report['query_count'], 0)
+        self.assertFalse(report['sampled'])
+        self.assertIsNone(report['queries'][0]['params'])
+        self.assertEqual([entry['id'] for entry in self.client.get('/api/profiler/reports/').json()], [report['id']])
+
+    def test_invalid_or_revoked_tokens_are_ignored(self):
+        token = self.token()
+        response = self.client.get('/api/products/', HTTP_X_PROFILE_QUERIES=token + 'x')
+        self.assertNotIn('X-Query-Profile', response)
+
+        User.objects.filter(pk=self.staff.pk).update(is_staff=False)
+        response = self.client.get('/api/products/', HTTP_X_PROFILE_QUERIES=token)
+        self.assertNotIn('X-Query-Profile', response)
+        self.assertEqual(profiler.recent_reports(), [])
+
+    def test_only_staff_get_tokens(self):
+        shopper = User.objects.create_user('shopper', password='pw')
+        self.client.force_authenticate(shopper)
+        self.assertEqual(self.client.post('/api/profiler/token/').status_code, 403)
+        self.assertEqual(self.client.get('/api/profiler/reports/').status_code, 403)
+
+    def test_repeated_statements_are_reported_as_n_plus_one(self):
+        def query(sql, params):
+            return {'alias': 'default', 'sql': sql, 'params': params, 'many': False, 'ms': 1.0,
+                    'stack': ['ecommerce/views.py:1 in get'], 'field': 'CartSerializer.items'}
+
+        item = 'SELECT * FROM "ecommerce_product" WHERE "ecommerce_product"."id" = %s'
+        batch = 'SELECT * FROM "ecommerce_product" WHERE "ecommerce_product"."id" IN (%s, %s)'
+        queries = [query(item, (pk,)) for pk in (1, 2, 3)] + [query(item, (1,))]
+        queries += [query(batch, (1, 2)), query(batch.replace('%s, %s', '%s, %s, %s'), (1, 2, 3))]
+
+        repeated, duplicates, explained = profiler.analyse(queries, profiler.profiler_settings())
+        self.assertEqual([(entry['sql'], entry['count']) for entry in repeated], [(item, 4)])
+        self.assertEqual(repeated[0]['field'], 'CartSerializer.items')
+        self.assertEqual(duplicates, [{'sql': item, 'count': 2}])
+        self.assertEqual(len(explained), 3)
+        self.assertEqual(profiler.shape(batch), profiler.shape(batch.replace('%s, %s', '%s, %s, %s')))
+
+
+class OrderArchiveTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shopper', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Kitchen')
+        self.pan = Product.objects.create(name='Pan', description='', price=Decimal('10.00'), stock=5, category=category)
+        self.coupon = Coupon.objects.create(code='SAVE10', discount_percentage=10, expiry_date=timezone.now())
+        self.long_ago = timezone.now() - timedelta(days=365)
+
+    def order(self, status='completed', created_at=None, **fields):
+        order = Order.objects.create(user=self.user, total_amount=Decimal('18.00'), status=status,
+                                     shipping_address='1 Main St', payment_reference='pay_1', **fields)
+        OrderItem.objects.create(order=order, product=self.pan, quantity=2, price=Decimal('10.00'))
+        Order.objects.filter(pk=order.pk).update(created_at=created_at or self.long_ago)
+        return order
+
+    def test_round_trip_keeps_the_order_shape(self):
+        order = self.order(coupon=self.coupon, discount_applied=Decimal('2.00'))
+        live = self.client.get(f'/api/orders/{order.pk}/').json()
+
+        self.assertEqual(archive.archive_batch(), 1)
+        self.assertFalse(Order.objects.filter(pk=order.pk).exists())
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertEqual(self.client.get(f'/api/orders/{order.pk}/').status_code, 404)
+        archived = self.client.get(f'/api/orders/{order.pk}/?include_archived=true').json()
+
+        self.assertTrue(archived.pop('archived'))
+        self.assertIsNotNone(archived.pop('archived_at'))
+        self.assertEqual(archived.pop('coupon'), {'code': 'SAVE10'})
+        live.pop('coupon')
+        live_items, archived_items = live.pop('items'), archived.pop('items')
+        self.assertEqual(archived, live)
+        self.assertEqual(
+            [{**item, 'product': {'id': item['product']['id'], 'name': item['product']['name']}} for item in live_items],
+            archived_items,
+        )
+
+    def test_only_old_finished_orders_are_archived(self):
+        old = self.order()
+        self.order(status='delivered')
+        self.order(created_at=timezone.now())
+        self.assertEqual(archive.archive_batch(), 1)
+        self.assertQuerysetEqual(ArchivedOrder.objects.values_list('pk', flat=True), [old.pk])
+        self.assertEqual(archive.archive_batch(), 0)
+
+    def test_history_lists_archived_orders_after_live_ones(self):
+        archived = self.order()
+        archive.archive_batch()
+        live = self.order(status='delivered')
+        other = User.objects.create_user('other', password='pw')
+        ArchivedOrder.objects.create(id=10 ** 6, user=other, total_amount=1, status='completed', created_at=self.long_ago)
+
+        self.assertEqual([row['id'] for row in self.client.get('/api/orders/history/').json()], [live.pk])
+        history = self.client.get('/api/orders/history/?include_archived=true').json()
+        self.assertEqual([(row['id'], row.get('archived', False)) for row in history], [(live.pk, False), (archived.pk, True)])
+        self.assertEqual(self.client.get(f'/api/orders/{10 ** 6}/?include_archived=true').status_code, 404)
+
+    @override_settings(ORDER_ARCHIVE={'BATCH_SIZE': 2, 'PAUSE_SECONDS': 30})
+    def test_job_queues_the_next_batch_while_batches_are_full(self):
+        for _ in range(3):
+            self.order()
+        archive.archive_orders()
+        follow_up = Job.objects.get(name='orders.archive')
+        self.assertGreaterEqual(follow_up.run_at, timezone.now() + timedelta(seconds=29))
+
+        follow_up.delete()
+        archive.archive_orders()
+        self.assertFalse(Job.objects.exists())
+        self.assertEqual(ArchivedOrder.objects.count(), 3)
+
+
+class CartBackendTestsMixin:
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shopper', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Kitchen')
+        self.pan = Product.objects.create(name='Pan', description='', price=Decimal('10.00'), stock=3, category=category)
+        self.pot = Product.objects.create(name='Pot', description='', price=Decimal('20.00'), stock=3, category=category)
+
+    def add(self, product, quantity=1):
+        return self.client.post('/api/cart/add/', {'product_id': product.pk, 'quantity': quantity}, format='json')
+
+    def cart(self):
+        response = self.client.get('/api/cart/')
+        if response.status_code == 404:
+            return None
+        return {item['product']['name']: item['quantity'] for item in response.json()['items']}
+
+    def test_item_changes(self):
+        self.assertIsNone(self.cart())
+        item = self.add(self.pan).json()
+        self.assertEqual(self.add(self.pan).json()['id'], item['id'])
+        self.add(self.pot, 2)
+        self.assertEqual(self.cart(), {'Pan': 2, 'Pot': 2})
+
+        self.assertEqual(self.add(self.pan, 2).status_code, 400)
+        update = f"/api/cart/items/{item['id']}/"
+        self.assertEqual(self.client.patch(update, {'action': 'increment'}, format='json').json()['quantity'], 3)
+        self.assertEqual(self.client.patch(update, {'action': 'increment'}, format='json').status_code, 400)
+        self.client.patch(update, {'action': 'decrement'}, format='json')
+        self.assertEqual(self.cart(), {'Pan': 2, 'Pot': 2})
+
+        self.assertEqual(self.client.delete(f"/api/cart/items/{item['id']}/delete/").status_code, 204)
+        self.assertEqual(self.client.delete(f"/api/cart/items/{item['id']}/delete/").status_code, 404)
+        self.assertEqual(self.cart(), {'Pot': 2})
+        self.client.delete('/api/cart/clear/')
+        self.assertEqual(self.cart(), {})
+
+    def test_carts_are_per_user(self):
+        item = self.add(self.pan).json()
+        other = User.objects.create_user('other', password='pw')
+        self.client.force_authenticate(other)
+        self.assertIsNone(self.cart())
+        self.assertEqual(self.client.patch(f"/api/cart/items/{item['id']}/", {'action': 'increment'}, format='json').status_code, 404)
+        self.assertEqual(self.client.delete(f"/api/cart/items/{item['id']}/delete/").status_code, 404)
+
+    def test_checkout_orders_the_cart_and_empties_it(self):
+        address = Address.objects.create(user=self.user, name='Home', street='1 Main St', city='Austin', state='TX',
+                                         postal_code='78701', country='USA')
+        self.add(self.pan, 2)
+        self.add(self.pot)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/checkout/', {
+                'shipping_address_id': address.pk, 'billing_address_id': address.pk,
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get()
+        self.assertEqual(sorted(order.items.values_list('product__name', 'quantity')), [('Pan', 2), ('Pot', 1)])
+        self.assertEqual(self.cart(), {})
+        self.assertFalse(CartItem.objects.exists())
+
+
+class ORMCartBackendTests(CartBackendTestsMixin, TestCase):
+    def test_changes_are_written_through(self):
+        self.add(self.pan, 2)
+        self.assertEqual(list(CartItem.objects.values_list('product', 'quantity')), [(self.pan.pk, 2)])
+
+
+@override_settings(CART_STORAGE={'BACKEND': 'ecommerce.carts.CacheCartBackend', 'WRITE_BEHIND_SECONDS': 60})
+class CacheCartBackendTests(CartBackendTestsMixin, TestCase):
+    def test_changes_are_written_behind_once_per_interval(self):
+        self.add(self.pan)
+        self.add(self.pan)
+        self.add(self.pot)
+        self.assertFalse(CartItem.objects.exists())
+        job = Job.objects.get(name='carts.persist')
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=50))
+
+        carts.persist_cart(**job.payload)
+        self.assertEqual(sorted(CartItem.objects.values_list('product', 'quantity')), [(self.pan.pk, 2), (self.pot.pk, 1)])
+        self.client.delete(f'/api/cart/items/{self.pan.pk}/delete/')
+        self.assertEqual(Job.objects.filter(name='carts.persist').count(), 2)
+        carts.persist_cart(**job.payload)
+        self.assertEqual(list(CartItem.objects.values_list('product', 'quantity')), [(self.pot.pk, 1)])
+
+    def test_cart_missing_from_the_cache_is_loaded_from_its_rows(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.pan, quantity=2)
+        self.assertEqual(self.cart(), {'Pan': 2})
+        self.add(self.pot)
+        self.assertEqual(self.cart(), {'Pan': 2, 'Pot': 1})
+        self.assertEqual(CartItem.objects.count(), 1)
+
+
+@skipUnless(recommendations.available(), 'needs numpy and scipy')
+class RecommendationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, directory)
+        self.matrix_path = os.path.join(directory, 'recommendations.npz')
+        self.addCleanup(lambda: os.path.exists(self.matrix_path) and os.remove(self.matrix_path))
+        self.settings = override_settings(RECOMMENDATIONS={
+            'MATRIX_PATH': self.matrix_path, 'SETTLE_SECONDS': 0, 'MIN_COUNT': 1, 'TOP_K': 2,
+        })
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+        self.user = User.objects.create_user('shopper', password='pw')
+        category = Category.objects.create(name='Kitchen')
+        self.pan, self.pot, self.lid, self.oil = (
+            Product.objects.create(name=name, description='', price=Decimal('10.00'), stock=9, category=category)
+            for name in ('Pan', 'Pot', 'Lid', 'Oil')
+        )
+
+    def order(self, *products):
+        order = Order.objects.create(user=self.user, total_amount=Decimal('10.00'), status='completed')
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product=product, quantity=1, price=Decimal('10.00')) for product in products
+        )
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(seconds=1))
+        return order
+
+    def recommended(self, product):
+        response = APIClient().get(f'/api/products/{product.pk}/recommendations/')
+        return [(row['product']['name'], row['score']) for row in response.json()]
+
+    def test_cooccurrence_counts_each_order_once(self):
+        np = recommendations.np
+        counts = recommendations.cooccurrence(np.array([1, 1, 1, 2, 2]), np.array([1, 2, 2, 1, 3]), 4)
+        self.assertEqual(counts.toarray().tolist(), [[0, 0, 0, 0], [0, 0, 1, 1], [0, 1, 0, 0], [0, 1, 0, 0]])
+
+    def test_top_neighbours_rank_by_count_then_id(self):
+        np, sparse = recommendations.np, recommendations.sparse
+        counts = sparse.csr_matrix(np.array([[0, 3, 1, 3], [3, 0, 0, 0], [1, 0, 0, 0], [3, 0, 0, 0]], dtype=np.int32))
+        products, neighbours, ranks, scores = recommendations.top_neighbours(counts, [0, 1], k=2)
+        self.assertEqual(list(zip(products, neighbours, ranks, scores)), [(0, 1, 1, 3), (0, 3, 2, 3), (1, 0, 1, 3)])
+
+        alive = np.array([True, False, True, True])
+        products, neighbours, _, _ = recommendations.top_neighbours(counts, [0], k=2, min_count=2, alive=alive)
+        self.assertEqual(neighbours.tolist(), [3])
+
+    def test_products_created_during_an_update_are_skipped(self):
+        self.order(self.pan, self.lid)
+        order_item_chunks = recommendations.order_item_chunks
+
+        def chunks_while_a_product_is_added(*args):
+            Product.objects.create(name='Wok', description='', price=Decimal('10.00'), stock=9, category=self.pan.category)
+            yield from order_item_chunks(*args)
+
+        with mock.patch.object(recommendations, 'order_item_chunks', chunks_while_a_product_is_added):
+            report = recommendations.update()
+
+        self.assertEqual(report['products'], 2)
+        self.assertEqual(self.recommended(self.pan), [('Lid', 1)])
+
+    def test_update_adds_new_orders_to_the_saved_counts(self):
+        self.order(self.pan, self.lid)
+        self.order(self.pan, self.lid, self.oil)
+        report = recommendations.update()
+        self.assertTrue(report['full'])
+        self.assertEqual(self.recommended(self.pan), [('Lid', 2), ('Oil', 1)])
+        oil_rows = ProductRecommendation.objects.filter(product=self.oil).order_by('pk').values_list('pk', flat=True)
+        oil = list(oil_rows)
+
+        self.order(self.pan, self.pot)
+        last = self.order(self.pan, self.pot)
+        report = recommendations.update()
+        self.assertFalse(report['full'])
+        self.assertEqual(report['orders_until'], last.pk)
+        # Pot and Lid tie; Pot has the lower ID
+        self.assertEqual(self.recommended(self.pan), [('Pot', 2), ('Lid', 2)])
+        self.assertEqual(self.recommended(self.pot), [('Pan', 2)])
+        # Oil's counts did not change, so its stored recommendations were left alone
+        self.assertQuerysetEqual(oil_rows, oil)
+        self.assertEqual(self.recommended(self.oil), [('Pan', 1), ('Lid', 1)])
+        self.assertEqual(recommendations.update()['products'], 0)
+
+    def test_full_update_drops_deleted_orders_and_products(self):
+        first = self.order(self.pan, self.lid)
+        self.order(self.pan, self.oil)
+        recommendations.update()
+        first.delete()
+        self.oil.delete()
+        recommendations.update(full=True)
+        self.assertEqual(self.recommended(self.pan), [])
+        self.assertFalse(ProductRecommendation.objects.exists())
+
+
+class AutocompleteTests(TestCase):
+    def index(self, names, scores=None, **conf):
+        index = autocomplete.AutocompleteIndex({**autocomplete.DEFAULTS, **conf})
+        index.load(
+            {autocomplete.ref('product', pk): name for pk, name in names.items()},
+            {autocomplete.ref('product', pk): score for pk, score in (scores or {}).items()},
+        )
+        return index
+
+    def names(self, suggestions):
+        return [name for _, _, name in suggestions]
+
+    def test_word_starts_rank_by_popularity_then_length(self):
+        index = self.index(
+            {1: 'Wireless Mouse', 2: 'Mouse Pad', 3: 'Gaming Mouse', 4: 'Crème Brûlée Torch', 5: 'Housewares'},
+            {3: 7, 2: 1},
+        )
+        self.assertEqual(self.names(index.suggest('mo')), ['Gaming Mouse', 'Mouse Pad', 'Wireless Mouse'])
+        self.assertEqual(self.names(index.suggest('ouse')), [])
+        self.assertEqual(self.names(index.suggest('  MOUSE   p')), ['Mouse Pad'])
+        self.assertEqual(self.names(index.suggest('creme bru')), ['Crème Brûlée Torch'])
+        self.assertEqual(self.names(index.suggest('mo', limit=1)), ['Gaming Mouse'])
+        self.assertEqual(index.suggest('m', limit=1)[0], ('product', 3, 'Gaming Mouse'))
+        self.assertEqual(index.suggest(''), [])
+
+    def test_queries_longer_than_keys_check_the_full_name(self):
+        index = self.index({1: 'Stainless steel pan', 2: 'Stainless steel pot'}, KEY_LENGTH=8)
+        self.assertEqual(self.names(index.suggest('stainless steel po')), ['Stainless steel pot'])
+
+    def test_updates_refresh_cached_rankings(self):
+        index = self.index({pk: f'Pan {pk}' for pk in range(1, 6)}, {1: 1}, SCAN_LIMIT=2)
+        self.assertEqual(self.names(index.suggest('pan', limit=2)), ['Pan 1', 'Pan 2'])
+        self.assertIn('pan', index.top)
+
+        index.add_popularity({autocomplete.ref('product', 4): 5})
+        self.assertEqual(self.names(index.suggest('pan', limit=2)), ['Pan 4', 'Pan 1'])
+        index.upsert('product', 4, 'Wok 4')
+        self.assertEqual(self.names(index.suggest('pan', limit=2)), ['Pan 1', 'Pan 2'])
+        self.assertEqual(self.names(index.suggest('wok')), ['Wok 4'])
+        index.remove('product', 1)
+        index.upsert('product', 6, 'Pan 0')
+        self.assertEqual(self.names(index.suggest('pan', limit=2)), ['Pan 0', 'Pan 2'])
+        self.assertEqual(len(index.keys), 2 * 5)
+
+    def test_queries_during_updates(self):
+        index = self.index({pk: f'Pan {pk}' for pk in range(200)}, SCAN_LIMIT=50)
+        errors, done = [], threading.Event()
+
+        def rename():
+            try:
+                for round_number in range(3000):
+                    for pk in range(0, 200, 7):
+                        if round_number % 2:
+                            index.upsert('product', pk, f'Pan {pk}')
+                        else:
+                            index.remove('product', pk)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                done.set()
+
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval, interval)
+        writer = threading.Thread(target=rename)
+        writer.start()
+        try:
+            while not done.is_set():
+                for query in ('pan', 'pan 1', 'pan 19'):
+                    for _, pk, name in index.suggest(query, limit=50):
+                        self.assertEqual(name, f'Pan {pk}')
+                        self.assertTrue(name.lower().startswith(query))
+        finally:
+            writer.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(index.suggest('pan', limit=50)), 50)
+
+    def test_endpoint_builds_the_index_from_the_database(self):
+        cache.clear()
+        category = Category.objects.create(name='Kitchen')
+        Product.objects.create(name='Kitchen scale', description='', price=Decimal('10.00'), stock=1, category=category)
+        with mock.patch.object(autocomplete, '_index', None):
+            response = APIClient().get('/api/autocomplete/', {'q': 'kit'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                [(row['type'], row['name']) for row in response.json()['results']],
+                [('category', 'Kitchen'), ('product', 'Kitchen scale')],
+            )
+            self.assertEqual(APIClient().get('/api/autocomplete/', {'q': 'kit', 'limit': 'x'}).status_code, 400)
+            for limit in ('0', '-3'):
+                self.assertEqual(APIClient().get('/api/autocomplete/', {'q': 'kit', 'limit': limit}).status_code, 400)
+
+    def test_sync_reads_the_database_outside_the_lock(self):
+        category = Category.objects.create(name='Kitchen')
+        with self.captureOnCommitCallbacks(execute=True):
+            pan = Product.objects.create(name='Pan', description='', price=Decimal('10.00'), stock=1, category=category)
+        index = autocomplete.AutocompleteIndex({**autocomplete.DEFAULTS, 'SETTLE_SECONDS': 0}).build()
+        with self.captureOnCommitCallbacks(execute=True):
+            pan.name = 'Wok'
+            pan.save()
+            Product.objects.create(name='Pot', description='', price=Decimal('10.00'), stock=1, category=category)
+        order = Order.objects.create(user=User.objects.create_user('shopper'), total_amount=10)
+        OrderItem.objects.create(order=order, product=pan, quantity=1, price=10)
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(seconds=1))
+
+        locked = []
+
+        def check(execute, sql, params, many, context):
+            locked.append(index.lock._is_owned())
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(check):
+            index.sync(force=True)
+        self.assertTrue(locked)
+        self.assertNotIn(True, locked)
+        self.assertEqual(self.names(index.suggest('wo')), ['Wok'])
+        self.assertEqual(self.names(index.suggest('p')), ['Pot'])
+        self.assertEqual(index.scores[autocomplete.ref('product', pan.pk)], 1)
+
+
+class BatchTests(TransactionTestCase):
+    # Consecutive reads run on threads with their own connections, which only see committed rows
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shopper', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Kitchen')
+        self.pan = Product.objects.create(name='Pan', description='', price=Decimal('10.00'), stock=3, category=category)
+
+    def batch(self, *requests):
+        response = self.client.post('/api/batch/', {'requests': list(requests)}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return [(sub['status'], sub['body']) for sub in response.json()['responses']]
+
+    def test_writes_are_seen_by_later_requests(self):
+        responses = self.batch(
+            {'method': 'GET', 'path': '/api/cart/'},
+            {'method': 'POST', 'path': '/api/cart/add/', 'body': {'product_id': self.pan.pk, 'quantity': 2}},
+            {'method': 'GET', 'path': '/api/cart/?fields=items'},
+            {'method': 'GET', 'path': f'/api/products/{self.pan.pk}/'},
+        )
+        self.assertEqual([status for status, _ in responses], [404, 201, 200, 200])
+        self.assertEqual([item['quantity'] for item in responses[2][1]['items']], [2])
+        self.assertEqual(responses[3][1]['name'], 'Pan')
+
+    def test_sub_requests_run_as_the_batch_user(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.batch({'path': '/api/cart/'}, {'path': '/api/categories/'})[0][0], 401)
+
+    def test_paths_that_cannot_be_batched(self):
+        responses = self.batch(
+            {'path': '/api/batch/', 'method': 'POST', 'body': {'requests': []}},
+            {'path': '/admin/'},
+            {'path': '/api/nowhere/'},
+        )
+        self.assertEqual([status for status, _ in responses], [400, 400, 404])
+
+    @override_settings(BATCH={'MAX_REQUESTS': 2})
+    def test_invalid_batches(self):
+        for requests in (None, [], [{'path': 'api/cart/'}], [{'path': '/api/cart/', 'method': 'TRACE'}],
+                         [{'path': '/api/cart/'}] * 3):
+            response = self.client.post('/api/batch/', {'requests': requests}, format='json')
+            self.assertEqual(response.status_code, 400, requests)
+
+    @override_settings(BATCH={'TIMEOUT': 0.5})
+    def test_requests_past_the_time_limit_get_504(self):
+        run, finished = batch.run, threading.Event()
+
+        def slow_run(outer, spec):
+            if not spec['path'].endswith('?slow'):
+                return run(outer, spec)
+            time.sleep(1)
+            try:
+                return run(outer, spec)
+            finally:
+                finished.set()
+
+        with mock.patch.object(batch, 'run', slow_run):
+            responses = self.batch(
+                {'path': '/api/categories/'},
+                {'path': '/api/categories/?slow'},
+                {'method': 'POST', 'path': '/api/cart/add/', 'body': {'product_id': self.pan.pk}},
+            )
+        self.assertEqual([status for status, _ in responses], [200, 504, 504])
+        self.assertFalse(CartItem.objects.exists())
+        # The late read still finishes in the background
+        self.assertTrue(finished.wait(5))
+
+
+class SinkHandler(BaseHTTPRequestHandler):
+    # Set by the test: (status, headers) of the next responses
+    replies = []
+    received = []
+
+    def do_POST(self):
+        self.received.append(json.loads(self.rfile.read(int(self.headers['Content-Length']))))
+        status, headers = self.replies.pop(0)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class RecordingSink:
+    def __init__(self, fail=None):
+        self.batches = []
+        self.fail = fail
+
+    def deliver(self, events):
+        if self.fail is not None:
+            raise self.fail
+        self.batches.append([event['key'] for event in events])
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, directory)
+        self.path = os.path.join(directory, 'events.jsonl')
+        self.addCleanup(lambda: os.path.exists(self.path) and os.remove(self.path))
+        logging.disable(logging.WARNING)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def publish(self, *keys, topic='order.created'):
+        for key in keys:
+            OutboxEvent.objects.publish(topic, key, {'order_id': key})
+
+    def dispatcher(self, sinks, **options):
+        """Return a dispatcher to ``RecordingSink``s configured by ``{name: options}``, and the sinks."""
+        sinks = {name: {'BACKEND': f'{__name__}.RecordingSink', **sink} for name, sink in sinks.items()}
+        with override_settings(OUTBOX={'SINKS': sinks}):
+            dispatcher = outbox.Dispatcher(**options)
+        return dispatcher, {name: sink for name, (sink, _) in dispatcher.sinks.items()}
+
+    def test_file_sink_appends_json_lines(self):
+        self.publish(1, 2)
+        with override_settings(OUTBOX={'SINKS': {'file': {'BACKEND': 'ecommerce.outbox.FileSink', 'PATH': self.path,
+                                                           'FSYNC': False}}}):
+            dispatcher = outbox.Dispatcher()
+            self.assertEqual(dispatcher.run_once(), 2)
+            self.publish(3)
+            self.assertEqual(dispatcher.run_once(), 1)
+            self.assertEqual(dispatcher.run_once(), 0)
+        with open(self.path, encoding='utf-8') as stream:
+            events = [json.loads(line) for line in stream]
+        self.assertEqual([event['key'] for event in events], ['1', '2', '3'])
+        self.assertEqual(set(events[0]), {'id', 'topic', 'key', 'payload', 'created_at'})
+        self.assertEqual(events[0]['payload'], {'order_id': 1})
+        self.assertEqual(OutboxCursor.objects.get(sink='file').position, OutboxEvent.objects.sequence())
+
+    def test_http_sink_statuses(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), SinkHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        SinkHandler.received = []
+        SinkHandler.replies = [(204, {}), (429, {'Retry-After': '7'}), (503, {}), (500, {})]
+        sink = outbox.HTTPSink(f'http://127.0.0.1:{server.server_port}/', headers={'Authorization': 'Token x'})
+        events = [{'id': 1, 'topic': 'order.created', 'key': '1', 'payload': {}, 'created_at': '2026-10-19T00:00:00'}]
+
+        sink.deliver(events)
+        self.assertEqual(SinkHandler.received, [{'events': events}])
+        with self.assertRaises(outbox.Backpressure) as raised:
+            sink.deliver(events)
+        self.assertEqual(raised.exception.retry_after, 7)
+        with self.assertRaises(outbox.Backpressure) as raised:
+            sink.deliver(events)
+        self.assertIsNone(raised.exception.retry_after)
+        with self.assertRaises(HTTPError):
+            sink.deliver(events)
+
+    def test_each_sink_has_its_own_cursor_and_topics(self):
+        self.publish(1, 2)
+        self.publish(3, topic='order.status_changed')
+        self.publish(4)
+        dispatcher, sinks = self.dispatcher({'all': {}, 'created': {'TOPICS': ['order.created']}}, batch_size=3)
+        self.assertEqual(dispatcher.run_once(), 6)
+        self.assertEqual(dispatcher.run_once(), 2)
+        self.assertEqual(sinks['all'].batches, [['1', '2', '3'], ['4']])
+        # The cursor moves past events of other topics too
+        self.assertEqual(sinks['created'].batches, [['1', '2'], ['4']])
+        self.assertEqual(dispatcher.run_once(), 0)
+
+    def test_failing_sinks_back_off_without_holding_up_the_others(self):
+        self.publish(1, 2)
+        dispatcher, sinks = self.dispatcher({
+            'healthy': {}, 'failing': {'FAIL': ValueError('down')}, 'busy': {'FAIL': outbox.Backpressure(30)},
+        })
+        now = time.monotonic()
+        self.assertEqual(dispatcher.run_once(), 2)
+        self.assertEqual(sinks['healthy'].batches, [['1', '2']])
+        self.assertEqual(OutboxCursor.objects.get(sink='failing').position, 0)
+        self.assertAlmostEqual(dispatcher.retry_at['failing'] - now, dispatcher.conf['BACKOFF_SECONDS'], delta=1)
+        self.assertAlmostEqual(dispatcher.retry_at['busy'] - now, 30, delta=1)
+
+        sinks['failing'].fail = None
+        dispatcher.retry_at['failing'] = 0
+        self.assertEqual(dispatcher.run_once(), 2)
+        self.assertEqual(sinks['failing'].batches, [['1', '2']])
+        self.assertEqual(dispatcher.failures['failing'], 0)
+
+    def test_positions_follow_keys_across_gaps(self):
+        start = OutboxEvent.objects.sequence()
+        for pk in (3, 1, 2, 7, 8, 5):
+            OutboxEvent.objects.create(id=pk, topic='order.created', key=str(pk))
+        self.assertEqual(OutboxEvent.objects.sequence(batch_size=4), start + 6)
+        self.assertEqual(
+            list(OutboxEvent.objects.order_by('position').values_list('id', 'position')),
+            [(pk, start + number) for number, pk in enumerate((1, 2, 3, 5, 7, 8), 1)],
+        )
+
+    def test_events_committed_after_higher_ids_are_delivered(self):
+        dispatcher, sinks = self.dispatcher({'sink': {}})
+        OutboxEvent.objects.create(id=10, topic='order.created', key='10')
+        self.assertEqual(dispatcher.run_once(), 1)
+        # An event whose transaction took its ID earlier but committed later
+        OutboxEvent.objects.create(id=5, topic='order.created', key='5')
+        self.assertEqual(dispatcher.run_once(), 1)
+        self.assertEqual(sinks['sink'].batches, [['10'], ['5']])
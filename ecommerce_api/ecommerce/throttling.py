@@ -0,0 +1,28 @@
+"""The REST framework throttles, letting the worker's own warm-up requests through.
+
+Warm-up requests (``warmup.is_warmup_request()``) all come from the server
+itself; counting them would spend the anonymous quota of whichever client
+shares their identity.
+"""
+from rest_framework import throttling
+
+from .warmup import is_warmup_request
+
+
+class WarmupExemptMixin:
+    def allow_request(self, request, view):
+        if is_warmup_request(request):
+            return True
+        return super().allow_request(request, view)
+
+
+class AnonRateThrottle(WarmupExemptMixin, throttling.AnonRateThrottle):
+    pass
+
+
+class UserRateThrottle(WarmupExemptMixin, throttling.UserRateThrottle):
+    pass
+
+
+class ScopedRateThrottle(WarmupExemptMixin, throttling.ScopedRateThrottle):
+    pass
@@ -0,0 +1,80 @@
+from django.db import transaction
+
+from .models import Order, OutboxEvent
+from .tasks import queue_status_jobs
+
+FILTER_LOOKUPS = {
+    'status': 'status',
+    'user_id': 'user_id',
+    'created_after': 'created_at__gte',
+    'created_before': 'created_at__lt',
+}
+
+
+def filter_orders(**criteria):
+    lookups = {FILTER_LOOKUPS[key]: value for key, value in criteria.items() if value is not None}
+    return Order.objects.filter(**lookups)
+
+
+def _id_batches(order_ids, queryset, batch_size):
+    if order_ids is not None:
+        order_ids = list(dict.fromkeys(order_ids))
+        for start in range(0, len(order_ids), batch_size):
+            yield order_ids[start:start + batch_size]
+        return
+    last_id = 0
+    while True:
+        batch = list(
+            queryset.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1]
+
+
+def _transition_batch(batch, new_status, sources):
+    with transaction.atomic():
+        current = dict(Order.objects.select_for_update().filter(pk__in=batch).values_list('pk', 'status'))
+        applied = [pk for pk in batch if current.get(pk) in sources]
+        Order.objects.filter(pk__in=applied, status__in=sources).update(status=new_status)
+        OutboxEvent.objects.publish_many('order.status_changed', [
+            (pk, {'order_id': pk, 'status': new_status, 'previous_status': current[pk]}) for pk in applied
+        ])
+        if new_status in Order.RESTOCK_STATUSES:
+            held = [pk for pk in applied if current[pk] in Order.STOCK_HOLDING_STATUSES]
+            Order.objects.filter(pk__in=held).restock()
+        for pk in applied:
+            queue_status_jobs(pk, new_status)
+
+    rejected = []
+    for pk in batch:
+        if pk not in current:
+            rejected.append({'id': pk, 'status': None, 'error': 'Order not found'})
+        elif current[pk] not in sources:
+            rejected.append({
+                'id': pk,
+                'status': current[pk],
+                'error': f"Cannot change status from {current[pk]} to {new_status}",
+            })
+    return applied, rejected
+
+
+def bulk_transition(new_status, order_ids=None, queryset=None, batch_size=1000):
+    """Move many orders to ``new_status`` following ``Order.INVALID_TRANSITIONS``.
+
+    Orders are taken from ``order_ids`` or, failing that, ``queryset`` and
+    handled ``batch_size`` at a time: each batch is one conditional UPDATE on
+    the allowed source statuses, plus one aggregated stock UPDATE for cancels
+    and returns. The status jobs are queued for each order that moved, as
+    they are for single transitions. Returns the applied order IDs and the rejected orders.
+    """
+    if order_ids is None and queryset is None:
+        raise ValueError('Either order_ids or queryset is required')
+    sources = Order.allowed_sources(new_status)
+    result = {'status': new_status, 'applied': [], 'rejected': []}
+    for batch in _id_batches(order_ids, queryset, batch_size):
+        applied, rejected = _transition_batch(batch, new_status, sources)
+        result['applied'].extend(applied)
+        result['rejected'].extend(rejected)
+    return result
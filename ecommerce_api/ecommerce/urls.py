@@ -2,11 +2,12 @@ from django.urls import path
 from .views import (
     RegisterView, LoginView, UserProfileView, AddressListCreateView, AddressDetailView,
     WishlistListCreateView, WishlistDeleteView, CategoryListCreateView, CategoryDetailView,
-    CategorySearchView, ProductListCreateView, ProductDetailView, ProductSearchView,
-    ProductFilterByCategoryView, CartView, CartItemAddView, CartItemUpdateView,
+    CategorySearchView, ProductListCreateView, ProductDetailView, ProductRecommendationsView, ProductSearchView,
+    ProductFilterByCategoryView, ProductFacetsView, CatalogChangesView, CartView, CartItemAddView, CartItemUpdateView,
     CartItemDeleteView, CartClearView, CheckoutPreviewView, CheckoutValidateView,
     CheckoutView, OrderListView, OrderDetailView, OrderCancelView, OrderReturnView,
-    OrderRefundView, OrderItemDetailView
+    OrderRefundView, OrderBulkTransitionView, OrderItemDetailView, ProfilerTokenView,
+    ProfilerReportListView, ProfilerReportDetailView, AutocompleteView, BatchView
 )
 
 urlpatterns = [
@@ -22,8 +23,12 @@ urlpatterns = [
     path('categories/search/', CategorySearchView.as_view(), name='category-search'),
     path('products/', ProductListCreateView.as_view(), name='product-list-create'),
     path('products/<int:pk>/', ProductDetailView.as_view(), name='product-detail'),
+    path('products/<int:pk>/recommendations/', ProductRecommendationsView.as_view(), name='product-recommendations'),
+    path('products/changes/', CatalogChangesView.as_view(), name='product-changes'),
     path('products/search/', ProductSearchView.as_view(), name='product-search'),
+    path('autocomplete/', AutocompleteView.as_view(), name='autocomplete'),
     path('products/filter/', ProductFilterByCategoryView.as_view(), name='product-filter-by-category'),
+    path('products/facets/', ProductFacetsView.as_view(), name='product-facets'),
     path('cart/', CartView.as_view(), name='cart'),
     path('cart/add/', CartItemAddView.as_view(), name='cart-item-add'),
     path('cart/items/<int:item_id>/', CartItemUpdateView.as_view(), name='cart-item-update'),
@@ -37,5 +42,10 @@ urlpatterns = [
     path('orders/<int:order_id>/cancel/', OrderCancelView.as_view(), name='order-cancel'),
     path('orders/<int:order_id>/return/', OrderReturnView.as_view(), name='order-return'),
     path('orders/<int:order_id>/refund/', OrderRefundView.as_view(), name='order-refund'),
+    path('orders/bulk-transition/', OrderBulkTransitionView.as_view(), name='order-bulk-transition'),
     path('orders/items/<int:pk>/', OrderItemDetailView.as_view(), name='order-item-detail'),
+    path('batch/', BatchView.as_view(), name='batch'),
+    path('profiler/token/', ProfilerTokenView.as_view(), name='profiler-token'),
+    path('profiler/reports/', ProfilerReportListView.as_view(), name='profiler-report-list'),
+    path('profiler/reports/<str:report_id>/', ProfilerReportDetailView.as_view(), name='profiler-report-detail'),
 ]
\ No newline at end of file
@@ -1,21 +1,36 @@
 from rest_framework import generics, status, filters
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import AllowAny, IsAuthenticated, BasePermission, SAFE_METHODS
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser, BasePermission, SAFE_METHODS
 from rest_framework_simplejwt.tokens import RefreshToken
-from rest_framework.throttling import ScopedRateThrottle
-from .models import Category, Product, Coupon, Address, Wishlist, Cart, CartItem, Order, OrderItem
+from .models import (
+    Category, Product, Coupon, Address, Wishlist, Cart, CartItem, Order, OrderItem, ArchivedOrder, ProductRecommendation,
+    OutboxEvent
+)
 from .serializers import (
     UserSerializer, CategorySerializer, ProductSerializer, CouponSerializer,
     AddressSerializer, WishlistSerializer, CartSerializer, CartItemSerializer,
-    OrderSerializer, OrderItemSerializer, CheckoutSerializer
+    OrderSerializer, OrderItemSerializer, ArchivedOrderSerializer, CheckoutSerializer, BulkOrderTransitionSerializer,
+    ProductRecommendationSerializer
 )
 from django.shortcuts import get_object_or_404
+from django.http import Http404, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.gzip import gzip_page
 from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
 from django.contrib.auth.models import User
-
-import random  # For simulating payment failure
+from decimal import Decimal
+from itertools import chain
+from . import autocomplete, batch, carts, jobs, profiler
+from .catalog import changes_since
+from .facets import ProductFilter, facet_counts
+from .fieldsets import Fieldset, serializer_paths, shape_queryset
+from .renderers import NDJSONRenderer
+from .tasks import queue_status_jobs
+from .throttling import ScopedRateThrottle
+from .transitions import bulk_transition, filter_orders
 
 class IsAuthenticatedOrReadOnly(BasePermission):
     def has_permission(self, request, view):
@@ -23,6 +38,57 @@ class IsAuthenticatedOrReadOnly(BasePermission):
             return True
         return request.user and request.user.is_authenticated
 
+class SparseFieldsetMixin:
+    """Applies ``?fields=``/``?expand=`` to the serializer and to the queryset it reads."""
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fieldset'] = Fieldset.from_request(self.request)
+        return context
+
+    def shape(self, queryset):
+        if self.request.method not in SAFE_METHODS:
+            return queryset
+        serializer = self.get_serializer_class()(context=self.get_serializer_context())
+        return shape_queryset(queryset, serializer_paths(serializer))
+
+class GZipMixin:
+    """Gzips responses, streamed ones included, for clients sending ``Accept-Encoding: gzip``.
+
+    Only for views whose responses hold no secrets such as tokens: compressing a
+    secret next to text an attacker can influence leaks it (BREACH).
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        return gzip_page(super().as_view(**initkwargs))
+
+class NDJSONStreamMixin:
+    """Streams the list row by row when the client accepts NDJSON.
+
+    Views with a paginator stream the requested page, with links to the next
+    and previous pages in the ``Link`` header; others stream the whole list.
+    """
+    stream_chunk_size = 500
+
+    def list(self, request, *args, **kwargs):
+        renderer = request.accepted_renderer
+        if not isinstance(renderer, NDJSONRenderer):
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer = self.get_serializer()
+        page = self.paginate_queryset(queryset)
+        objects = page if page is not None else queryset.iterator(chunk_size=self.stream_chunk_size)
+        rows = (serializer.to_representation(obj) for obj in objects)
+        response = StreamingHttpResponse(renderer.stream(rows), content_type=renderer.media_type)
+        if page is not None:
+            links = [(self.paginator.get_next_link(), 'next'), (self.paginator.get_previous_link(), 'prev')]
+            links = [f'<{url}>; rel="{rel}"' for url, rel in links if url]
+            if links:
+                response['Link'] = ', '.join(links)
+        patch_vary_headers(response, ['Accept'])
+        return response
+
 class RegisterView(generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
@@ -71,12 +137,12 @@ class AddressDetailView(generics.RetrieveUpdateDestroyAPIView):
     def get_queryset(self):
         return Address.objects.filter(user=self.request.user)
 
-class WishlistListCreateView(generics.ListCreateAPIView):
+class WishlistListCreateView(GZipMixin, NDJSONStreamMixin, SparseFieldsetMixin, generics.ListCreateAPIView):
     serializer_class = WishlistSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Wishlist.objects.filter(user=self.request.user)
+        return self.shape(Wishlist.objects.filter(user=self.request.user))
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -107,18 +173,55 @@ class CategorySearchView(generics.ListAPIView):
     search_fields = ['name', 'description']
     pagination_class = None
 
-class ProductListCreateView(generics.ListCreateAPIView):
+class ProductListCreateView(GZipMixin, NDJSONStreamMixin, SparseFieldsetMixin, generics.ListCreateAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
     pagination_class = None
 
-class ProductDetailView(generics.RetrieveUpdateDestroyAPIView):
+    def get_queryset(self):
+        return self.shape(super().get_queryset())
+
+class ProductDetailView(SparseFieldsetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
 
-class ProductSearchView(generics.ListAPIView):
+    def get_queryset(self):
+        return self.shape(super().get_queryset())
+
+class ProductRecommendationsView(SparseFieldsetMixin, generics.ListAPIView):
+    """Products frequently bought together with this one, precomputed by ``manage.py build_recommendations``."""
+    serializer_class = ProductRecommendationSerializer
+    permission_classes = [AllowAny]
+    pagination_class = None
+
+    def get_queryset(self):
+        return self.shape(
+            ProductRecommendation.objects.filter(product_id=self.kwargs['pk']).select_related('recommended').order_by('rank')
+        )
+
+class AutocompleteView(APIView):
+    """Typeahead suggestions for the search box, served from the worker's in-memory index."""
+    permission_classes = [AllowAny]
+    throttle_classes = [ScopedRateThrottle]
+    throttle_scope = 'autocomplete'
+
+    def get(self, request):
+        try:
+            limit = int(request.query_params['limit']) if 'limit' in request.query_params else None
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        if limit is not None and limit < 1:
+            return Response({'error': 'limit must be at least 1'}, status=status.HTTP_400_BAD_REQUEST)
+        query = request.query_params.get('q', '')
+        suggestions = autocomplete.get_index().suggest(query, limit)
+        return Response({
+            'query': query,
+            'results': [{'type': kind, 'id': pk, 'name': name} for kind, pk, name in suggestions],
+        })
+
+class ProductSearchView(GZipMixin, NDJSONStreamMixin, SparseFieldsetMixin, generics.ListAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [AllowAny]
@@ -126,45 +229,85 @@ class ProductSearchView(generics.ListAPIView):
     search_fields = ['name', 'description']
     pagination_class = None
 
-class ProductFilterByCategoryView(generics.ListAPIView):
+    def get_queryset(self):
+        return self.shape(super().get_queryset())
+
+class CatalogChangesView(GZipMixin, APIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        try:
+            since = int(request.query_params.get('since', 0))
+            limit = int(request.query_params.get('limit', 0)) or None
+        except ValueError:
+            return Response({'error': 'since and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+
+        changes = changes_since(since, limit)
+        if changes['resync']:
+            return Response({'resync': True, 'next': changes['next']})
+
+        products = Product.objects.select_related('category').filter(pk__in=changes['upserts']['product'])
+        categories = Category.objects.filter(pk__in=changes['upserts']['category'])
+        return Response({
+            'resync': False,
+            'since': since,
+            'next': changes['next'],
+            'has_more': changes['has_more'],
+            'products': ProductSerializer(products, many=True, context={'request': request}).data,
+            'categories': CategorySerializer(categories, many=True).data,
+            'deleted': {
+                'products': changes['deletes']['product'],
+                'categories': changes['deletes']['category'],
+            },
+        })
+
+class ProductFilterByCategoryView(GZipMixin, NDJSONStreamMixin, SparseFieldsetMixin, generics.ListAPIView):
     serializer_class = ProductSerializer
     permission_classes = [AllowAny]
     pagination_class = None
 
     def get_queryset(self):
-        category_id = self.request.query_params.get('category_id')
-        if category_id:
-            return Product.objects.filter(category_id=category_id)
-        return Product.objects.all()
+        return self.shape(ProductFilter(self.request.query_params).apply(Product.objects.all()))
 
-class CartView(generics.RetrieveAPIView):
+class ProductFacetsView(APIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        return Response(facet_counts(ProductFilter(request.query_params)))
+
+class CartView(SparseFieldsetMixin, generics.RetrieveAPIView):
     serializer_class = CartSerializer
     permission_classes = [IsAuthenticated]
 
     def get_object(self):
-        return get_object_or_404(Cart, user=self.request.user)
+        cart = carts.get_backend().get_cart(self.request.user, queryset=self.shape(Cart.objects.all()))
+        if cart is None:
+            raise Http404
+        return cart
 
 class CartItemAddView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
-        cart = get_object_or_404(Cart, user=request.user)
+        backend = carts.get_backend()
         product_id = request.data.get('product_id')
         quantity = int(request.data.get('quantity', 1))
         
         if quantity < 1:
             return Response({'error': 'Quantity must be at least 1'}, status=status.HTTP_400_BAD_REQUEST)
         
-        product = get_object_or_404(Product, id=product_id)
+        product = get_object_or_404(Product.objects.select_related('category'), id=product_id)
         if product.stock < quantity:
             return Response({'error': 'Insufficient stock'}, status=status.HTTP_400_BAD_REQUEST)
 
-        cart_item, created = CartItem.objects.get_or_create(cart=cart, product=product)
-        if not created:
+        cart_item = backend.get_item(request.user, product=product)
+        if cart_item is None:
+            cart_item = CartItem(product=product, quantity=quantity)
+        else:
             if product.stock < cart_item.quantity + quantity:
                 return Response({'error': 'Insufficient stock for additional quantity'}, status=status.HTTP_400_BAD_REQUEST)
             cart_item.quantity += quantity
-            cart_item.save()
+        cart_item = backend.save_item(request.user, cart_item)
         
         return Response(CartItemSerializer(cart_item).data, status=status.HTTP_201_CREATED)
 
@@ -172,8 +315,10 @@ class CartItemUpdateView(APIView):
     permission_classes = [IsAuthenticated]
 
     def patch(self, request, item_id):
-        cart = get_object_or_404(Cart, user=request.user)
-        cart_item = get_object_or_404(CartItem, id=item_id, cart=cart)
+        backend = carts.get_backend()
+        cart_item = backend.get_item(request.user, item_id=item_id)
+        if cart_item is None:
+            raise Http404
         action = request.data.get('action')
 
         if action == 'increment':
@@ -187,22 +332,22 @@ class CartItemUpdateView(APIView):
         else:
             return Response({'error': 'Invalid action'}, status=status.HTTP_400_BAD_REQUEST)
 
-        cart_item.save()
+        cart_item = backend.save_item(request.user, cart_item)
         return Response(CartItemSerializer(cart_item).data)
 
-class CartItemDeleteView(generics.DestroyAPIView):
-    queryset = CartItem.objects.all()
+class CartItemDeleteView(APIView):
     permission_classes = [IsAuthenticated]
 
-    def get_queryset(self):
-        return CartItem.objects.filter(cart__user=self.request.user)
+    def delete(self, request, pk):
+        if not carts.get_backend().delete_item(request.user, pk):
+            raise Http404
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
 class CartClearView(APIView):
     permission_classes = [IsAuthenticated]
 
     def delete(self, request):
-        cart = get_object_or_404(Cart, user=request.user)
-        cart.items.all().delete()
+        carts.get_backend().clear(request.user)
         return Response({'message': 'Cart cleared successfully'}, status=status.HTTP_204_NO_CONTENT)
 
 class CheckoutPreviewView(APIView):
@@ -211,7 +356,9 @@ class CheckoutPreviewView(APIView):
     throttle_scope = 'checkout'
 
     def post(self, request):
-        cart = get_object_or_404(Cart, user=request.user)
+        cart = carts.get_backend().get_cart(request.user)
+        if cart is None:
+            raise Http404
         if not cart.items.exists():
             return Response({'error': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -234,9 +381,9 @@ class CheckoutPreviewView(APIView):
 
         data['coupon_code'] = coupon_code if coupon else None
         data['discount_applied'] = discount_applied
-        data['tax'] = total_amount * 0.1
-        data['shipping_cost'] = 10.00
-        data['grand_total'] = total_amount + data['tax'] + data['shipping_cost']
+        data['tax'] = (total_amount * Decimal('0.1')).quantize(Decimal('0.01'))
+        data['shipping_cost'] = Decimal('10.00')
+        data['grand_total'] = (total_amount + data['tax'] + data['shipping_cost']).quantize(Decimal('0.01'))
         return Response(data)
 
 class CheckoutValidateView(APIView):
@@ -245,7 +392,9 @@ class CheckoutValidateView(APIView):
     throttle_scope = 'checkout'
 
     def post(self, request):
-        cart = get_object_or_404(Cart, user=request.user)
+        cart = carts.get_backend().get_cart(request.user)
+        if cart is None:
+            raise Http404
         if not cart.items.exists():
             return Response({'error': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -272,7 +421,11 @@ class CheckoutView(APIView):
     throttle_scope = 'checkout'
 
     def post(self, request):
-        cart = get_object_or_404(Cart, user=request.user)
+        backend = carts.get_backend()
+        # The cart only becomes durable here; backends that write behind save it now
+        cart = backend.persist(request.user)
+        if cart is None:
+            raise Http404
         if not cart.items.exists():
             return Response({'error': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -313,11 +466,7 @@ class CheckoutView(APIView):
                 coupon.used_count = F('used_count') + 1
                 coupon.save()
 
-            total_amount += total_amount * 0.1 + 10.00
-
-            # Simulate payment processing (10% chance of failure for demo)
-            if random.random() < 0.1:
-                return Response({'error': 'Payment failed'}, status=status.HTTP_400_BAD_REQUEST)
+            total_amount += total_amount * Decimal('0.1') + Decimal('10.00')
 
             order = Order.objects.create(
                 user=request.user,
@@ -325,7 +474,7 @@ class CheckoutView(APIView):
                 shipping_address=str(shipping_address),
                 billing_address=str(billing_address),
                 payment_reference=serializer.validated_data.get('payment_reference', ''),
-                status='pending' if random.random() >= 0.1 else 'failed',
+                status='pending',
                 coupon=coupon,
                 discount_applied=discount_applied
             )
@@ -340,39 +489,84 @@ class CheckoutView(APIView):
                 item_data['product'].stock = F('stock') - item_data['quantity']
                 item_data['product'].save()
 
+            OutboxEvent.objects.publish('order.created', order.id, {
+                'order_id': order.id,
+                'user_id': request.user.id,
+                'status': order.status,
+                'total_amount': str(Decimal(order.total_amount).quantize(Decimal('0.01'))),
+                'coupon': coupon.code if coupon else None,
+                'items': [
+                    {'product_id': item['product'].id, 'quantity': item['quantity'], 'price': str(item['price'])}
+                    for item in order_items
+                ],
+            })
+
             cart.items.all().delete()
+            backend.discard(request.user)
+            # Payment is captured by the job worker, which then moves the order to processing
+            jobs.enqueue('payment.capture', {'order_id': order.id})
 
         return Response(OrderSerializer(order).data, status=status.HTTP_201_CREATED)
 
-class OrderListView(generics.ListAPIView):
+class ArchivedOrdersMixin:
+    """Falls back to the order archive when the request has ``?include_archived=true``."""
+
+    def include_archived(self):
+        return self.request.query_params.get('include_archived') == 'true'
+
+    def get_archived_queryset(self):
+        return ArchivedOrder.objects.filter(user=self.request.user).order_by('-created_at')
+
+    def get_archived_serializer(self, *args, **kwargs):
+        return ArchivedOrderSerializer(*args, context=self.get_serializer_context(), **kwargs)
+
+class OrderListView(ArchivedOrdersMixin, GZipMixin, NDJSONStreamMixin, SparseFieldsetMixin, generics.ListAPIView):
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
     pagination_class = None
 
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user)
+        return self.shape(Order.objects.filter(user=self.request.user))
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if not self.include_archived():
+            return response
+        # Archived orders are older than every live one, so they follow the live list
+        if response.streaming:
+            serializer = self.get_archived_serializer()
+            archived = self.get_archived_queryset().iterator(chunk_size=self.stream_chunk_size)
+            rows = (serializer.to_representation(obj) for obj in archived)
+            response.streaming_content = chain(response.streaming_content, request.accepted_renderer.stream(rows))
+        else:
+            response.data = list(response.data) + self.get_archived_serializer(self.get_archived_queryset(), many=True).data
+        return response
 
-class OrderDetailView(generics.RetrieveUpdateAPIView):
+class OrderDetailView(ArchivedOrdersMixin, SparseFieldsetMixin, generics.RetrieveUpdateAPIView):
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user)
+        return self.shape(Order.objects.filter(user=self.request.user))
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            if not self.include_archived():
+                raise
+        archived = get_object_or_404(self.get_archived_queryset(), pk=kwargs['pk'])
+        return Response(self.get_archived_serializer(archived).data)
 
 class OrderCancelView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request, order_id):
         order = get_object_or_404(Order, id=order_id, user=request.user)
-        if order.status not in ['pending', 'processing']:
-            return Response({'error': f'Cannot cancel order in {order.status} status'}, status=status.HTTP_400_BAD_REQUEST)
-        
         with transaction.atomic():
-            order.status = 'cancelled'
-            for item in order.items.select_for_update().all():
-                item.product.stock = F('stock') + item.quantity
-                item.product.save()
-            order.save()
+            if not order.transition('cancelled', sources=['pending', 'processing']):
+                return Response({'error': f'Cannot cancel order in {order.status} status'}, status=status.HTTP_400_BAD_REQUEST)
+            queue_status_jobs(order.id, 'cancelled')
         return Response(OrderSerializer(order).data)
 
 class OrderReturnView(APIView):
@@ -380,15 +574,10 @@ class OrderReturnView(APIView):
 
     def post(self, request, order_id):
         order = get_object_or_404(Order, id=order_id, user=request.user)
-        if order.status not in ['delivered']:
-            return Response({'error': f'Cannot return order in {order.status} status'}, status=status.HTTP_400_BAD_REQUEST)
-        
         with transaction.atomic():
-            order.status = 'returned'
-            for item in order.items.select_for_update().all():
-                item.product.stock = F('stock') + item.quantity
-                item.product.save()
-            order.save()
+            if not order.transition('returned', sources=['delivered']):
+                return Response({'error': f'Cannot return order in {order.status} status'}, status=status.HTTP_400_BAD_REQUEST)
+            queue_status_jobs(order.id, 'returned')
         return Response(OrderSerializer(order).data)
 
 class OrderRefundView(APIView):
@@ -396,17 +585,72 @@ class OrderRefundView(APIView):
 
     def post(self, request, order_id):
         order = get_object_or_404(Order, id=order_id, user=request.user)
-        if order.status not in ['returned']:
-            return Response({'error': f'Cannot refund order in {order.status} status'}, status=status.HTTP_400_BAD_REQUEST)
-        
         with transaction.atomic():
-            order.status = 'refunded'
-            order.save()
+            if not order.transition('refunded', sources=['returned']):
+                return Response({'error': f'Cannot refund order in {order.status} status'}, status=status.HTTP_400_BAD_REQUEST)
+            queue_status_jobs(order.id, 'refunded')
         return Response(OrderSerializer(order).data)
 
+class OrderBulkTransitionView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        serializer = BulkOrderTransitionSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        data = serializer.validated_data
+        if 'order_ids' in data:
+            result = bulk_transition(data['status'], order_ids=data['order_ids'])
+        else:
+            result = bulk_transition(data['status'], queryset=filter_orders(**data['filter']))
+        return Response(result)
+
+class ProfilerTokenView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        conf = profiler.profiler_settings()
+        return Response({
+            'token': profiler.make_token(request.user),
+            'header': conf['HEADER'],
+            'expires_in': conf['TOKEN_MAX_AGE'],
+        })
+
+class ProfilerReportListView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        fields = ('id', 'method', 'path', 'view', 'status', 'sampled', 'started_at', 'duration_ms', 'db_ms', 'query_count')
+        return Response([
+            {**{name: report[name] for name in fields}, 'repeated': len(report['repeated'])}
+            for report in profiler.recent_reports()
+        ])
+
+class ProfilerReportDetailView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, report_id):
+        report = profiler.get_report(report_id)
+        if report is None:
+            return Response({'error': 'Report not found or expired'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(report)
+
 class OrderItemDetailView(generics.RetrieveAPIView):
     serializer_class = OrderItemSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         return OrderItem.objects.filter(order__user=self.request.user)
+
+class BatchView(APIView):
+    """Runs several API requests in one round trip; see ``ecommerce.batch``."""
+    permission_classes = [AllowAny]
+    batchable = False
+
+    def post(self, request):
+        requests = request.data.get('requests') if isinstance(request.data, dict) else None
+        error = batch.validate(requests)
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'responses': batch.run_batch(request, requests)})
@@ -0,0 +1,153 @@
+"""Worker warm-up.
+
+``warm_up()`` runs once per worker process, from ``wsgi.py``, before the first
+request is served, when ``WARMUP['ENABLED']`` is set (by default when
+``DEBUG`` is off, so ``runserver`` reloads are not slowed down). It pays up
+front for what the first requests would otherwise pay for lazily: compiling
+the URL patterns, building serializer field trees, opening the database
+connections and priming caches. Other modules add their own steps with
+``@warmup.register(name)``. A failing step is logged and skipped so it never
+prevents a worker from booting. The requests in ``WARMUP['REQUESTS']`` are
+marked (``is_warmup_request()``) so that they are neither throttled nor
+counted against a client, nor sampled by the query profiler.
+
+Database connections belong to the thread that opened them. Warm-up runs in
+the thread that loads the application, which serves the requests of a
+single-threaded worker (e.g. gunicorn's default ``sync`` workers); there, with
+a non-zero ``CONN_MAX_AGE``, the first requests reuse the connection. Threaded
+workers serve requests from other threads, so set
+``WARMUP['KEEP_CONNECTIONS']`` off to close it again instead of leaving it idle.
+With ``gunicorn --preload`` the application is imported before workers fork,
+so disable ``WARMUP['ENABLED']`` and call ``warm_up()`` from a ``post_fork``
+hook instead; forked processes must not share a connection.
+"""
+import logging
+import time
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.db import connections
+from django.urls import URLPattern, URLResolver, get_resolver
+
+from .conf import get_settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'REQUESTS': ['/api/categories/'],
+    'KEEP_CONNECTIONS': True,
+}
+
+# Set in the WSGI environ of warm-up requests; clients can only send HTTP_* keys
+ENVIRON_KEY = 'ecommerce.warmup'
+
+_steps = []
+
+
+def warmup_settings():
+    return get_settings('WARMUP', DEFAULTS)
+
+
+def register(name):
+    """Register a warm-up step; steps run in registration order."""
+    def decorator(func):
+        _steps.append((name, func))
+        return func
+    return decorator
+
+
+def url_patterns(resolver=None):
+    resolver = resolver or get_resolver()
+    for pattern in resolver.url_patterns:
+        if isinstance(pattern, URLResolver):
+            yield from url_patterns(pattern)
+        elif isinstance(pattern, URLPattern):
+            yield pattern
+
+
+def _touch_fields(serializer):
+    serializer = getattr(serializer, 'child', serializer)
+    for field in getattr(serializer, 'fields', {}).values():
+        _touch_fields(field)
+
+
+@register('routes')
+def compile_routes():
+    resolver = get_resolver()
+    resolver.reverse_dict
+    for pattern in url_patterns(resolver):
+        pattern.pattern.regex
+
+
+@register('serializers')
+def build_serializers():
+    seen = set()
+    for pattern in url_patterns():
+        view_class = getattr(pattern.callback, 'view_class', None)
+        serializer_class = getattr(view_class, 'serializer_class', None)
+        if serializer_class is not None and serializer_class not in seen:
+            seen.add(serializer_class)
+            _touch_fields(serializer_class(context={}))
+
+
+@register('database')
+def open_connections():
+    for connection in connections.all():
+        connection.ensure_connection()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+
+
+def is_warmup_request(request):
+    return bool(request.META.get(ENVIRON_KEY))
+
+
+def environ(path):
+    """Return a minimal WSGI environ for a warm-up GET of ``path`` on an allowed host."""
+    hosts = [host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*']
+    path, _, query = path.partition('?')
+    env = {
+        'PATH_INFO': path, 'QUERY_STRING': query, 'HTTP_HOST': hosts[0] if hosts else 'localhost',
+        ENVIRON_KEY: True,
+    }
+    setup_testing_defaults(env)
+    return env
+
+
+def get(application, path):
+    """Serve a GET of ``path`` through ``application`` and return the status line."""
+    result = {}
+
+    def start_response(status, headers, exc_info=None):
+        result['status'] = status
+
+    response = application(environ(path), start_response)
+    try:
+        for _ in response:
+            pass
+    finally:
+        if hasattr(response, 'close'):
+            response.close()
+    return result['status']
+
+
+def warm_up(application=None):
+    """Run every warm-up step and return the seconds spent per step."""
+    conf = warmup_settings()
+    timings = {}
+    started = time.perf_counter()
+    steps = list(_steps)
+    if application is not None:
+        steps.append(('requests', lambda: [get(application, path) for path in conf['REQUESTS']]))
+    for name, func in steps:
+        step_started = time.perf_counter()
+        try:
+            func()
+        except Exception:
+            logger.exception('Warm-up step %s failed', name)
+        timings[name] = time.perf_counter() - step_started
+    if not conf['KEEP_CONNECTIONS']:
+        connections.close_all()
+    logger.info('Worker warm-up finished in %.3fs', time.perf_counter() - started)
+    return timings
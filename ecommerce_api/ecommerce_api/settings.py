@@ -39,17 +39,25 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'ecommerce.renderers.MessagePackRenderer',
+        'ecommerce.renderers.NDJSONRenderer',
+    ),
+    'DEFAULT_CONTENT_NEGOTIATION_CLASS': 'ecommerce.renderers.ContentNegotiation',
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle',
+        'ecommerce.throttling.AnonRateThrottle',
+        'ecommerce.throttling.UserRateThrottle',
     ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '100/day',
         'user': '1000/day',
         'sensitive': '10/hour',
         'checkout': '50/hour',
+        'autocomplete': '600/hour',
     },
 }
 from datetime import timedelta
@@ -59,9 +67,122 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
 }
 
+# Background jobs, run with `python manage.py run_jobs`.
+# Set 'EAGER' to run jobs in-process as soon as they are committed (tests, local development).
+JOB_QUEUE = {
+    'EAGER': False,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_SECONDS': 5,
+}
+
+# Back-in-stock and price-drop notifications for wishlisted products.
+# 'SINK' may be 'ecommerce.notifications.DatabaseSink' or 'ecommerce.notifications.FileSink'.
+WISHLIST_NOTIFICATIONS = {
+    'SINK': 'ecommerce.notifications.DatabaseSink',
+    'CHUNK_SIZE': 1000,
+    'DEDUPE_WINDOW': timedelta(days=1),
+    'RATE_LIMIT': 5,
+    'RATE_WINDOW': timedelta(days=1),
+}
+
+# Catalog change feed served at /api/products/changes/.
+CATALOG_FEED = {
+    'BATCH_SIZE': 500,
+    'RETENTION': timedelta(days=7),
+}
+
+# Product filters and facet counts served at /api/products/filter/ and /api/products/facets/.
+PRODUCT_FACETS = {
+    'PRICE_BUCKETS': [0, 25, 50, 100, 250, 500, 1000],
+    'CREATED_WITHIN_DAYS': [7, 30, 90],
+    'CACHE_TIMEOUT': 300,
+}
+
+# Worker warm-up run from wsgi.py before the first request (see ecommerce/warmup.py).
+# Disable when the app is preloaded before forking and call warm_up() from a post-fork hook instead.
+WARMUP = {
+    # Off while DEBUG is on: runserver loads the application again on every reload
+    'ENABLED': not DEBUG,
+    'REQUESTS': ['/api/categories/'],
+}
+
+# Cart storage. 'ecommerce.carts.CacheCartBackend' keeps carts in the CACHES alias named by 'CACHE'
+# (it must be shared by all workers, e.g. Redis) and writes them to the database at most once per
+# 'WRITE_BEHIND_SECONDS' and at checkout.
+CART_STORAGE = {
+    'BACKEND': 'ecommerce.carts.ORMCartBackend',
+    'CACHE': 'default',
+    'WRITE_BEHIND_SECONDS': 300,
+}
+
+# Finished orders older than 'AFTER' are moved to the ArchivedOrder table by the orders.archive job
+# ('manage.py archive_orders --enqueue' starts it). Each batch is followed by a pause sized so the job
+# keeps the database busy for at most 'DUTY_CYCLE' of the time.
+ORDER_ARCHIVE = {
+    'AFTER': timedelta(days=180),
+    'STATUSES': ['completed', 'refunded', 'cancelled', 'failed'],
+    'BATCH_SIZE': 500,
+    'DUTY_CYCLE': 0.25,
+}
+
+# Retention for 'manage.py housekeeping' and the housekeeping.run job; None keeps the data forever.
+# Rows are deleted 'BATCH_SIZE' at a time, at most 'ROWS_PER_SECOND' and 'MAX_ROWS' per policy and run.
+HOUSEKEEPING = {
+    'INTERVAL': 3600,
+    'BATCH_SIZE': 500,
+    'ROWS_PER_SECOND': 2000,
+    'CART_ITEMS_AFTER': timedelta(days=30),
+    'EXPIRED_COUPONS_AFTER': timedelta(days=90),
+    'OUT_OF_STOCK_WISHLISTS_AFTER': timedelta(days=365),
+    'JOBS_AFTER': timedelta(days=7),
+    'NOTIFICATIONS_AFTER': timedelta(days=90),
+    'OUTBOX_EVENTS_AFTER': timedelta(days=7),
+}
+
+# "Frequently bought together", rebuilt by 'manage.py build_recommendations' (needs numpy and scipy).
+RECOMMENDATIONS = {
+    'TOP_K': 10,
+    'MIN_COUNT': 2,
+    'MATRIX_PATH': BASE_DIR / 'recommendations.npz',
+}
+
+# In-memory autocomplete for /api/autocomplete/, built per worker at warm-up.
+# Names are indexed from their first 'MAX_WORDS' words, 'KEY_LENGTH' characters deep; see 'manage.py autocomplete_report'.
+AUTOCOMPLETE = {
+    'LIMIT': 10,
+    'MAX_LIMIT': 50,
+    'KEY_LENGTH': 24,
+    'MAX_WORDS': 4,
+    'SYNC_SECONDS': 5,
+}
+
+# POST /api/batch/: sub-requests per batch, seconds per batch and threads for concurrent reads.
+BATCH = {
+    'MAX_REQUESTS': 20,
+    'TIMEOUT': 10,
+    'WORKERS': 4,
+}
+
+# Order events for downstream systems, delivered by 'manage.py dispatch_outbox' to each sink in 'SINKS',
+# e.g. {'warehouse': {'BACKEND': 'ecommerce.outbox.HTTPSink', 'URL': '...'}}. See ecommerce/outbox.py.
+OUTBOX = {
+    'SINKS': {},
+    'BATCH_SIZE': 500,
+}
+
+# Per-request SQL profiling for staff (X-Profile-Queries header, token from /api/profiler/token/).
+# 'SAMPLE_RATE' also profiles that fraction of all requests and stores the reports for /api/profiler/reports/.
+QUERY_PROFILER = {
+    'ENABLED': True,
+    'SAMPLE_RATE': 0.0,
+    'EXPLAIN_SLOWEST': 3,
+    'CAPTURE_PARAMS': False,
+}
+
 
 
 MIDDLEWARE = [
+    'ecommerce.profiler.QueryProfilerMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -105,6 +226,9 @@ DATABASES = {
         'OPTIONS': {
             'init_command': "SET sql_mode='STRICT_TRANS_TABLES'",
         },
+        # Keep connections open across requests, so the one opened by the worker warm-up is reused
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce_api.settings')
 
 application = get_wsgi_application()
+
+from ecommerce.warmup import warm_up, warmup_settings  # noqa: E402
+
+if warmup_settings()['ENABLED']:
+    warm_up(application)